@@ -0,0 +1,285 @@
+"""Аналитика дефектов по журналу контроля.
+
+    python analytics.py pareto [--category доработка] [--top 10]
+    python analytics.py rates --by casting|inspector|day|month
+    python analytics.py rates --by month --from 01.01.2025 --to 31.03.2025 --csv отчет.csv
+    python analytics.py rebuild
+    python analytics.py export --xlsx отчет.xlsx [--from 01.03.2025] [--to 31.03.2025] [--casting] [--inspector]
+
+Журнал один раз загружается в типизированные массивы (количества - int32,
+дата - datetime64, отливка и контролеры - категории), а все отчеты
+считаются векторно по этим массивам, без обхода записей в Python.
+Отчеты без разреза по контролерам строятся по сводам журнала (по дням
+или месяцам) - это сотни строк вместо всех записей; rebuild пересчитывает
+своды заново, export выгружает отобранные записи журнала в отдельную
+книгу Excel потоково, без загрузки журнала в память. Те же отчеты показывает окно "Аналитика" формы (analytics_view.py).
+"""
+import argparse
+import sys
+
+from core import parse_date
+from journal import CASTING_COLUMN, DB_PATH, PLAVKA_PATH, RECORDS_COLUMN, ControlJournal, quote, read_castings
+from schema import CATEGORIES, DATE_COLUMN, JOURNAL_DEFECTS
+
+# Отливка для плавок, которых нет в реестре
+UNKNOWN_CASTING = 'нет в реестре'
+
+COUNT_COLUMNS = ['Контроль_отлито', 'Контроль_принято'] + [field.column for field in JOURNAL_DEFECTS]
+
+# Разрезы отчета по долям брака: ключ для CLI -> заголовок группы
+GROUPINGS = {
+    'casting': 'Наименование отливки',
+    'inspector': 'Контролер',
+    'day': 'День',
+    'month': 'Месяц',
+}
+
+
+def load_castings(plavka_path=PLAVKA_PATH):
+    """Номер плавки -> наименование отливки из реестра (pandas Series)"""
+    import pandas as pd
+
+    return pd.Series(read_castings(plavka_path), dtype=object)
+
+
+def load_frame(db_path=DB_PATH, plavka_path=PLAVKA_PATH):
+    """Журнал в виде таблицы pandas с типизированными колонками и наименованием отливки"""
+    import pandas as pd
+
+    journal = ControlJournal(db_path)
+    try:
+        query = journal.select_sql.replace(' FROM', f', {quote(CASTING_COLUMN)} FROM')
+        frame = pd.read_sql_query(query, journal.conn)
+    finally:
+        journal.close()
+
+    frame[COUNT_COLUMNS] = frame[COUNT_COLUMNS].fillna(0).astype('int32')
+    frame['Дата'] = pd.to_datetime(frame[DATE_COLUMN], format='%Y-%m-%d', errors='coerce')
+    for column in ('Контролер1', 'Контролер2'):
+        frame[column] = frame[column].fillna('').astype(str).str.strip().astype('category')
+
+    # Отливка сохраняется вместе с записью; для записей из control.xlsx ее берем из реестра
+    castings = frame[CASTING_COLUMN]
+    if castings.isna().any():
+        castings = castings.fillna(frame['Номер_плавки'].map(load_castings(plavka_path)))
+    frame[CASTING_COLUMN] = castings.fillna(UNKNOWN_CASTING).replace('', UNKNOWN_CASTING).astype('category')
+    return frame
+
+
+def load_rollup_frame(db_path=DB_PATH, period='month', date_from=None, date_to=None):
+    """Своды журнала в том же виде, что load_frame: строка - (период, отливка), без контролеров"""
+    import pandas as pd
+
+    journal = ControlJournal(db_path)
+    try:
+        rollups = pd.DataFrame(journal.rollups(period, date_from, date_to).fetchall(),
+                               columns=['period', 'casting', 'column', 'count'])
+    finally:
+        journal.close()
+
+    frame = rollups.pivot_table(index=['period', 'casting'], columns='column', values='count',
+                                aggfunc='sum', fill_value=0)
+    frame = frame.reindex(columns=[RECORDS_COLUMN] + COUNT_COLUMNS, fill_value=0).astype('int64')
+    frame = frame.reset_index()
+    date_format = '%Y-%m-%d' if period == 'day' else '%Y-%m'
+    frame['Дата'] = pd.to_datetime(frame['period'], format=date_format, errors='coerce')
+    frame[CASTING_COLUMN] = frame['casting'].replace('', UNKNOWN_CASTING).astype('category')
+    for column in ('Контролер1', 'Контролер2'):
+        frame[column] = pd.Categorical([''] * len(frame))
+    return frame.drop(columns=['period', 'casting'])
+
+
+def month_aligned(date_from, date_to):
+    """Совпадает ли период (ГГГГ-ММ-ДД) с целыми месяцами - тогда хватает месячных сводов"""
+    import pandas as pd
+
+    if date_from and not date_from.endswith('-01'):
+        return False
+    return not date_to or pd.Timestamp(date_to).is_month_end
+
+
+class DefectAnalytics:
+    """Отчеты по журналу; filter() возвращает такую же аналитику по части записей"""
+
+    def __init__(self, frame):
+        import numpy as np
+
+        self.frame = frame
+        # Матрица дефектов: запись x поле дефекта (в порядке JOURNAL_DEFECTS)
+        self.defects = frame[[field.column for field in JOURNAL_DEFECTS]].to_numpy(dtype=np.int64)
+        # Итоги по категориям для каждой записи
+        self.category_totals = {
+            category.key: self.defects[:, [i for i, field in enumerate(JOURNAL_DEFECTS)
+                                            if field.category == category.key]].sum(axis=1)
+            for category in CATEGORIES
+        }
+
+    @classmethod
+    def load(cls, db_path=DB_PATH, plavka_path=PLAVKA_PATH):
+        return cls(load_frame(db_path, plavka_path))
+
+    @classmethod
+    def from_rollups(cls, db_path=DB_PATH, period='month', date_from=None, date_to=None):
+        """Аналитика по сводам за период: без разреза по контролерам, но без чтения всех записей"""
+        return cls(load_rollup_frame(db_path, period, date_from, date_to))
+
+    def __len__(self):
+        return len(self.frame)
+
+    def records(self):
+        """Сколько проверок охватывает аналитика (в сводах строка - несколько проверок)"""
+        if RECORDS_COLUMN in self.frame:
+            return int(self.frame[RECORDS_COLUMN].sum())
+        return len(self.frame)
+
+    def filter(self, date_from=None, date_to=None, casting=None, inspector=None):
+        """Записи за период (даты ГГГГ-ММ-ДД, включительно), по отливке и контролеру (по вхождению)"""
+        import pandas as pd
+
+        frame = self.frame
+        mask = pd.Series(True, index=frame.index)
+        if date_from:
+            mask &= frame['Дата'] >= pd.Timestamp(date_from)
+        if date_to:
+            mask &= frame['Дата'] <= pd.Timestamp(date_to)
+        if casting:
+            mask &= frame[CASTING_COLUMN].astype(str).str.contains(casting, case=False, regex=False)
+        if inspector:
+            mask &= (frame['Контролер1'].astype(str).str.contains(inspector, case=False, regex=False)
+                     | frame['Контролер2'].astype(str).str.contains(inspector, case=False, regex=False))
+        return DefectAnalytics(frame[mask.to_numpy()])
+
+    def pareto(self, category=None):
+        """Дефекты по убыванию количества с долей и накопленной долей (нулевые не попадают)"""
+        import numpy as np
+        import pandas as pd
+
+        titles = {category.key: category.title for category in CATEGORIES}
+        columns = [i for i, field in enumerate(JOURNAL_DEFECTS)
+                   if category is None or field.category == category]
+        totals = self.defects[:, columns].sum(axis=0)
+        order = np.argsort(-totals, kind='stable')
+        order = order[totals[order] > 0]
+        fields = [JOURNAL_DEFECTS[columns[i]] for i in order]
+        counts = totals[order]
+        share = counts / counts.sum() if len(counts) else counts.astype(float)
+        return pd.DataFrame({
+            'Категория': [titles[field.category] for field in fields],
+            'Дефект': [field.label for field in fields],
+            'Штук': counts,
+            'Доля, %': (share * 100).round(1),
+            'Накопленная доля, %': (np.cumsum(share) * 100).round(1),
+        })
+
+    def rates(self, by='casting'):
+        """Отлито, принято, итоги категорий и их доли от отлитого в разрезе by (см. GROUPINGS).
+
+        По контролерам запись учитывается у каждого из двух контролеров.
+        """
+        import numpy as np
+        import pandas as pd
+
+        frame = self.frame
+        values = pd.DataFrame({
+            # В сводах строка - уже сумма нескольких проверок
+            'Проверок': (frame[RECORDS_COLUMN].to_numpy(dtype=np.int64) if RECORDS_COLUMN in frame
+                         else np.ones(len(frame), dtype=np.int64)),
+            'Отлито': frame['Контроль_отлито'].to_numpy(dtype=np.int64),
+            'Принято': frame['Контроль_принято'].to_numpy(dtype=np.int64),
+            **{category.title: self.category_totals[category.key] for category in CATEGORIES},
+        })
+        if by == 'casting':
+            keys = frame[CASTING_COLUMN].astype(str).to_numpy()
+        elif by == 'inspector':
+            values = pd.concat([values, values], ignore_index=True)
+            keys = np.concatenate([frame['Контролер1'].astype(str).to_numpy(),
+                                   frame['Контролер2'].astype(str).to_numpy()])
+            named = keys != ''
+            values, keys = values[named], keys[named]
+        elif by in ('day', 'month'):
+            dates = frame['Дата']
+            keys = dates.dt.strftime('%Y-%m-%d' if by == 'day' else '%Y-%m').fillna('без даты').to_numpy()
+        else:
+            raise ValueError(f"Неизвестный разрез отчета: {by}")
+
+        table = values.groupby(keys, sort=True).sum()
+        table.index.name = GROUPINGS[by]
+        отлито = table['Отлито'].where(table['Отлито'] > 0)
+        for category in CATEGORIES:
+            table[f'{category.title}, %'] = (table[category.title] / отлито * 100).round(2)
+        return table.reset_index()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Аналитика дефектов по журналу контроля")
+    parser.add_argument('report', choices=['pareto', 'rates', 'rebuild', 'export'],
+                        help="Парето дефектов, доли брака, пересчет сводов или выгрузка записей")
+    parser.add_argument('--by', choices=list(GROUPINGS), default='casting',
+                        help="разрез для rates: отливка, контролер, день, месяц")
+    parser.add_argument('--category', choices=[category.key for category in CATEGORIES],
+                        help="категория дефектов для pareto (по умолчанию все)")
+    parser.add_argument('--from', dest='date_from', help="начало периода, ДД.ММ.ГГГГ")
+    parser.add_argument('--to', dest='date_to', help="конец периода, ДД.ММ.ГГГГ")
+    parser.add_argument('--casting', help="только отливки, в наименовании которых есть этот текст")
+    parser.add_argument('--inspector', help="только записи этого контролера")
+    parser.add_argument('--top', type=int, help="сколько строк показать")
+    parser.add_argument('--csv', help="сохранить отчет в CSV (для Excel)")
+    parser.add_argument('--xlsx', help="книга для export")
+    parser.add_argument('--records', action='store_true',
+                        help="считать по всем записям журнала, а не по сводам")
+    parser.add_argument('--db', default=DB_PATH, help="журнал контроля (по умолчанию control.db)")
+    parser.add_argument('--plavka', default=PLAVKA_PATH, help="реестр плавок")
+    args = parser.parse_args(argv)
+
+    try:
+        date_from = parse_date(args.date_from) if args.date_from else None
+        date_to = parse_date(args.date_to) if args.date_to else None
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.report == 'rebuild':
+        journal = ControlJournal(args.db)
+        try:
+            journal.rebuild_rollups(read_castings(args.plavka))
+        finally:
+            journal.close()
+        print("Своды журнала пересчитаны")
+        return 0
+
+    if args.report == 'export':
+        if not args.xlsx:
+            parser.error("для export укажите --xlsx")
+        journal = ControlJournal(args.db)
+        try:
+            # Записи без отливки (перенесенные из control.xlsx) отбираются по реестру
+            castings = read_castings(args.plavka) if args.casting else None
+            count = journal.export_report(args.xlsx, date_from, date_to, args.casting, args.inspector, castings)
+        finally:
+            journal.close()
+        print(f"Записей выгружено в {args.xlsx}: {count}")
+        return 0
+
+    if args.records or args.inspector or (args.report == 'rates' and args.by == 'inspector'):
+        analytics = DefectAnalytics.load(args.db, args.plavka).filter(
+            date_from, date_to, args.casting, args.inspector)
+    else:
+        by_day = args.report == 'rates' and args.by == 'day' or not month_aligned(date_from, date_to)
+        analytics = DefectAnalytics.from_rollups(
+            args.db, 'day' if by_day else 'month', date_from, date_to).filter(casting=args.casting)
+    if args.report == 'pareto':
+        table = analytics.pareto(args.category)
+    else:
+        table = analytics.rates(args.by)
+    if args.top:
+        table = table.head(args.top)
+
+    if args.csv:
+        # Excel в русской локали открывает CSV через ';'
+        table.to_csv(args.csv, sep=';', index=False, encoding='utf-8-sig', decimal=',')
+    print(f"Проверок в отчете: {analytics.records()}")
+    print(table.to_string(index=False) if len(table) else "Нет данных")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
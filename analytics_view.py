@@ -0,0 +1,252 @@
+"""Окно "Аналитика": Парето дефектов и доли брака по журналу контроля.
+
+Журнал загружается в фоне один раз при открытии окна (и по кнопке
+"Обновить"), а смена отчета и фильтров пересчитывается по уже
+загруженным массивам (analytics.DefectAnalytics). "Выгрузить записи"
+пишет записи с теми же фильтрами в отдельную книгу Excel.
+"""
+from PySide6.QtWidgets import (
+    QWidget, QVBoxLayout, QHBoxLayout, QComboBox, QDateEdit, QLineEdit,
+    QLabel, QPushButton, QTableView, QHeaderView, QFileDialog, QMessageBox
+)
+from PySide6.QtCore import (
+    QAbstractTableModel, QDate, QModelIndex, Qt, QObject, QRunnable, QThreadPool, Signal
+)
+
+from analytics import DefectAnalytics
+from journal import PLAVKA_PATH, ControlJournal, read_castings
+from schema import CATEGORIES
+
+# Отчеты окна: заголовок -> (отчет, параметр)
+REPORTS = {
+    'Парето дефектов': ('pareto', None),
+    **{f'Парето: {category.title.lower()}': ('pareto', category.key) for category in CATEGORIES},
+    'Доли брака по отливкам': ('rates', 'casting'),
+    'Доли брака по контролерам': ('rates', 'inspector'),
+    'Доли брака по дням': ('rates', 'day'),
+    'Доли брака по месяцам': ('rates', 'month'),
+}
+
+
+class FrameModel(QAbstractTableModel):
+    """Таблица pandas для QTableView (только чтение)"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.table = None
+
+    def set_table(self, table):
+        self.beginResetModel()
+        self.table = table
+        self.endResetModel()
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if self.table is None or parent.isValid() else len(self.table)
+
+    def columnCount(self, parent=QModelIndex()):
+        return 0 if self.table is None or parent.isValid() else len(self.table.columns)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole:
+            value = self.table.iat[index.row(), index.column()]
+            return '' if value != value else str(value)  # NaN - пустая ячейка
+        if role == Qt.TextAlignmentRole and self.table.dtypes.iloc[index.column()].kind in 'iuf':
+            return int(Qt.AlignRight | Qt.AlignVCenter)
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role == Qt.DisplayRole and orientation == Qt.Horizontal:
+            return str(self.table.columns[section])
+        return None
+
+
+class AnalyticsLoaderSignals(QObject):
+    finished = Signal(bool, object)  # По записям ли, DefectAnalytics
+    failed = Signal(bool, str)
+
+
+class AnalyticsLoader(QRunnable):
+    """Загружает аналитику вне GUI-потока: дневные своды или (records) все записи журнала с реестром плавок"""
+
+    def __init__(self, db_path, records=False):
+        super().__init__()
+        self.db_path = db_path
+        self.records = records
+        self.signals = AnalyticsLoaderSignals()
+
+    def run(self):
+        try:
+            if self.records:
+                analytics = DefectAnalytics.load(self.db_path)
+            else:
+                analytics = DefectAnalytics.from_rollups(self.db_path, 'day')
+            self.signals.finished.emit(self.records, analytics)
+        except Exception as e:
+            self.signals.failed.emit(self.records, str(e))
+
+
+class ReportExportSignals(QObject):
+    finished = Signal(str, int)  # книга и число записей
+    failed = Signal(str)
+
+
+class ReportExporter(QRunnable):
+    """Выгружает отобранные записи журнала в книгу Excel вне GUI-потока"""
+
+    def __init__(self, db_path, path, filters):
+        super().__init__()
+        self.db_path = db_path
+        self.path = path
+        self.filters = filters
+        self.signals = ReportExportSignals()
+
+    def run(self):
+        try:
+            # Записи без отливки (перенесенные из control.xlsx) отбираются по реестру
+            castings = read_castings(PLAVKA_PATH) if self.filters[2] else None
+            journal = ControlJournal(self.db_path)
+            try:
+                count = journal.export_report(self.path, *self.filters, castings=castings)
+            finally:
+                journal.close()
+            self.signals.finished.emit(self.path, count)
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+
+
+class AnalyticsView(QWidget):
+    def __init__(self, db_path, parent=None):
+        super().__init__(parent, Qt.Window)
+        self.db_path = db_path
+        # Отчеты без контролеров считаются по дневным сводам (любой период, строк - дни x отливки),
+        # все записи журнала читаются, только когда нужен контролер
+        self.analytics = {}  # По записям ли -> DefectAnalytics
+        self.loaders = {}  # По записям ли -> AnalyticsLoader
+
+        self.setWindowTitle("Аналитика дефектов")
+        self.resize(1000, 600)
+        layout = QVBoxLayout(self)
+
+        filters = QHBoxLayout()
+        self.report_combo = QComboBox()
+        self.report_combo.addItems(list(REPORTS))
+        filters.addWidget(self.report_combo)
+
+        # Период по умолчанию - с начала года
+        today = QDate.currentDate()
+        self.date_from_input = QDateEdit(QDate(today.year(), 1, 1))
+        self.date_to_input = QDateEdit(today)
+        for label, date_input in (("с", self.date_from_input), ("по", self.date_to_input)):
+            date_input.setCalendarPopup(True)
+            date_input.setDisplayFormat("dd.MM.yyyy")
+            filters.addWidget(QLabel(label))
+            filters.addWidget(date_input)
+
+        self.casting_input = QLineEdit()
+        self.casting_input.setPlaceholderText("Отливка")
+        self.inspector_input = QLineEdit()
+        self.inspector_input.setPlaceholderText("Контролер")
+        filters.addWidget(self.casting_input)
+        filters.addWidget(self.inspector_input)
+
+        self.reload_button = QPushButton("Обновить")
+        self.reload_button.clicked.connect(self.reload)
+        filters.addWidget(self.reload_button)
+        self.export_button = QPushButton("Выгрузить записи")
+        self.export_button.clicked.connect(self.export_records)
+        filters.addWidget(self.export_button)
+        layout.addLayout(filters)
+
+        self.model = FrameModel(self)
+        self.table_view = QTableView()
+        self.table_view.setModel(self.model)
+        self.table_view.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        layout.addWidget(self.table_view)
+
+        self.status_label = QLabel()
+        layout.addWidget(self.status_label)
+
+        self.report_combo.currentTextChanged.connect(self.refresh)
+        self.date_from_input.dateChanged.connect(self.refresh)
+        self.date_to_input.dateChanged.connect(self.refresh)
+        self.casting_input.textChanged.connect(self.refresh)
+        self.inspector_input.textChanged.connect(self.refresh)
+
+        self.reload()
+
+    def reload(self):
+        """Перечитывает журнал в фоне (то, что нужно выбранному отчету)"""
+        if self.loaders:
+            return
+        self.analytics.clear()
+        self.load(self.needs_records())
+
+    def load(self, records):
+        self.status_label.setText("Загрузка журнала...")
+        self.reload_button.setEnabled(False)
+        loader = self.loaders[records] = AnalyticsLoader(self.db_path, records)
+        loader.signals.finished.connect(self.on_loaded)
+        loader.signals.failed.connect(self.on_failed)
+        QThreadPool.globalInstance().start(loader)
+
+    def on_loaded(self, records, analytics):
+        self.loaders.pop(records, None)
+        self.reload_button.setEnabled(not self.loaders)
+        self.analytics[records] = analytics
+        self.refresh()
+
+    def on_failed(self, records, message):
+        self.loaders.pop(records, None)
+        self.reload_button.setEnabled(not self.loaders)
+        self.status_label.setText(f"Не удалось загрузить журнал: {message}")
+
+    def needs_records(self):
+        """Нужны ли отчету записи журнала: в сводах нет контролеров"""
+        report = REPORTS[self.report_combo.currentText()]
+        return report == ('rates', 'inspector') or bool(self.inspector_input.text().strip())
+
+    def filters(self):
+        """Период (ГГГГ-ММ-ДД), отливка и контролер из полей окна"""
+        return (
+            self.date_from_input.date().toString('yyyy-MM-dd'),
+            self.date_to_input.date().toString('yyyy-MM-dd'),
+            self.casting_input.text().strip(),
+            self.inspector_input.text().strip(),
+        )
+
+    def refresh(self):
+        """Пересчитывает выбранный отчет по загруженному журналу"""
+        records = self.needs_records()
+        analytics = self.analytics.get(records)
+        if analytics is None:
+            if records not in self.loaders:
+                self.load(records)
+            return
+        selected = analytics.filter(*self.filters())
+        report, parameter = REPORTS[self.report_combo.currentText()]
+        if report == 'pareto':
+            self.model.set_table(selected.pareto(parameter))
+        else:
+            self.model.set_table(selected.rates(parameter))
+        self.status_label.setText(f"Проверок за период: {selected.records()} из {analytics.records()}")
+
+    def export_records(self):
+        """Выгружает записи журнала с фильтрами окна в выбранную книгу (в фоне)"""
+        path, _ = QFileDialog.getSaveFileName(self, "Выгрузить записи", "отчет.xlsx", "Книга Excel (*.xlsx)")
+        if not path:
+            return
+        self.export_button.setEnabled(False)
+        self.status_label.setText(f"Выгрузка записей в {path}...")
+        exporter = ReportExporter(self.db_path, path, self.filters())
+        exporter.signals.finished.connect(self.on_exported)
+        exporter.signals.failed.connect(self.on_export_failed)
+        QThreadPool.globalInstance().start(exporter)
+
+    def on_exported(self, path, count):
+        self.export_button.setEnabled(True)
+        self.status_label.setText(f"Записей выгружено в {path}: {count}")
+
+    def on_export_failed(self, message):
+        self.export_button.setEnabled(True)
+        self.status_label.setText("")
+        QMessageBox.warning(self, "Ошибка", f"Ошибка при выгрузке записей: {message}")
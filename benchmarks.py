@@ -0,0 +1,327 @@
+"""Замеры формы на синтетических реестре и журнале без экрана.
+
+    python benchmarks.py [--sizes 1000 10000 100000] [--repeat 20] [--output benchmarks.json]
+
+Для каждого размера во временной папке создаются plavka.xlsx и control.xlsx
+с таким числом строк, и на них замеряются запуск формы (перенос журнала,
+первая загрузка реестра и повторная - из кэша), load_plavka_numbers,
+update_наименование_отливки, calculate_control_prinato, проверка записи
+(validation.py), save_data, выгрузка control.xlsx и сверка журнала, а также
+память и время построения списка плавок формы (HeatRegister) против
+прежнего пути через DataFrame. Окна создаются
+на платформе offscreen, диалоги форме отвечают сразу. Результаты - JSON, чтобы сравнивать версии между собой.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import date, datetime, timedelta
+
+os.environ.setdefault('QT_QPA_PLATFORM', 'offscreen')
+
+import validation
+from core import ControlRecord
+from schema import DEFECTS, HEADERS
+
+SIZES = (1000, 10000, 100000)
+REPEAT = 20
+CASTINGS = ['Фланец', 'Втулка', 'Корпус', 'Крышка', 'Кронштейн', 'Муфта', 'Патрубок', 'Шкив']
+INSPECTORS = ['Рябова', 'Улитина', 'Елхова', 'Лабуткина']
+
+# Сколько ждать фоновой загрузки реестра, секунд
+LOAD_TIMEOUT = 600
+
+
+def make_plavka(path, rows, rng):
+    """Реестр плавок: половина номеров текущего сезона (/25), половина прошлого"""
+    from openpyxl import Workbook
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(['Учетный_номер', 'Наименование_отливки', 'Плановая_дата'])
+    start = date(2025, 1, 1)
+    numbers = []
+    for i in range(rows):
+        number = f"{i}-{rng.randint(1, 9)}/{25 if i % 2 else 24}"
+        numbers.append(number)
+        ws.append([number, rng.choice(CASTINGS), (start + timedelta(days=i % 365)).strftime('%d.%m.%Y')])
+    wb.save(path)
+    return numbers
+
+
+def make_control(path, rows, numbers, rng):
+    """Журнал: первые записи занимают половину плавок сезона из реестра, остальные - старые плавки"""
+    from openpyxl import Workbook
+
+    season = [number for number in numbers if number.endswith('/25')]
+    used = season[:len(season) // 2]
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(HEADERS)
+    start = datetime(2025, 1, 1)
+    for i in range(rows):
+        number = used[i] if i < len(used) else f"старая-{i}/23"
+        отлито = rng.randint(50, 400)
+        defects = [rng.randint(0, 3) if rng.random() < 0.2 else None for _ in range(len(HEADERS) - 6)]
+        принято = отлито - sum(count for count in defects if count)
+        ws.append([number, отлито, принято, start + timedelta(days=i % 365),
+                   rng.choice(INSPECTORS), rng.choice(INSPECTORS + [None])] + defects)
+    wb.save(path)
+
+
+def summary(times):
+    """Статистика времени операции, мс"""
+    times = sorted(t * 1000 for t in times)
+    return {
+        'runs': len(times),
+        'mean_ms': round(statistics.fmean(times), 3),
+        'p50_ms': round(times[len(times) // 2], 3),
+        'p95_ms': round(times[min(len(times) - 1, int(len(times) * 0.95))], 3),
+        'min_ms': round(times[0], 3),
+        'max_ms': round(times[-1], 3),
+    }
+
+
+def answer_dialogs():
+    """Диалоги формы не должны ждать пользователя: сообщения собираются, на вопросы - "Нет" """
+    from PySide6.QtWidgets import QMessageBox
+
+    messages = []
+
+    def message(parent, title, text, *args, **kwargs):
+        messages.append(f"{title}: {text}")
+        return QMessageBox.Ok
+
+    QMessageBox.information = staticmethod(message)
+    QMessageBox.warning = staticmethod(message)
+    QMessageBox.critical = staticmethod(message)
+    QMessageBox.question = staticmethod(lambda *args, **kwargs: QMessageBox.No)
+    return messages
+
+
+def wait_loaded(app, form):
+    """Ждет, пока фоновая загрузка номеров плавок дойдет до формы"""
+    deadline = time.monotonic() + LOAD_TIMEOUT
+    while form.plavka_loading:
+        if time.monotonic() > deadline:
+            raise TimeoutError("Загрузка реестра плавок не закончилась")
+        app.processEvents()
+        time.sleep(0.001)
+
+
+def new_form(app):
+    import kontrol
+
+    return kontrol.ControlForm()
+
+
+def dataframe_heats(df_plavka, used_numbers, seasons):
+    """Прежний путь формы: отфильтрованный DataFrame со всеми колонками и словарь атрибутов на каждую плавку"""
+    from core import available_plavka
+
+    df_plavka = available_plavka(df_plavka, used_numbers, seasons)
+    index = {}
+    for number, attributes in zip(df_plavka['Учетный_номер'].astype(str), df_plavka.to_dict('records')):
+        index.setdefault(number, attributes)
+    return df_plavka, index
+
+
+def bench_heat_memory(used_numbers, seasons):
+    """Память, которая остается за списком плавок формы, и время его построения: DataFrame и HeatRegister"""
+    from heat_register import HeatRegister
+    from plavka_cache import load_plavka
+
+    result = {}
+    for name, build in (('dataframe', dataframe_heats), ('register', HeatRegister.from_plavka)):
+        df_plavka = load_plavka('plavka.xlsx', seasons)
+        started = time.perf_counter()
+        build(df_plavka, used_numbers, seasons)
+        elapsed = time.perf_counter() - started
+        del df_plavka
+        # Реестр читается из кэша заново под tracemalloc: строки номеров, которые
+        # переживут DataFrame, должны попасть в счет
+        tracemalloc.start()
+        df_plavka = load_plavka('plavka.xlsx', seasons)
+        kept = build(df_plavka, used_numbers, seasons)
+        del df_plavka
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        del kept
+        result[name] = {'build_ms': round(elapsed * 1000, 3), 'kept_bytes': current, 'peak_bytes': peak}
+    return result
+
+
+def bench_size(app, rows, repeat, rng, messages):
+    """Замеры на реестре и журнале по rows строк; папка - текущая рабочая"""
+    from PySide6.QtCore import QDate
+    from journal import ControlJournal
+
+    result = {'rows': rows}
+    started = time.perf_counter()
+    numbers = make_plavka('plavka.xlsx', rows, rng)
+    make_control('control.xlsx', rows, numbers, rng)
+    result['generate_s'] = round(time.perf_counter() - started, 3)
+
+    # Первый запуск: перенос control.xlsx в журнал и разбор plavka.xlsx без кэша
+    started = time.perf_counter()
+    form = new_form(app)
+    wait_loaded(app, form)
+    result['startup_cold_ms'] = round((time.perf_counter() - started) * 1000, 3)
+    form.close()
+    # Выгрузка, начатая первым запуском, не должна мешать замерам второго
+    form.export_writer.join()
+    form.deleteLater()
+
+    started = time.perf_counter()
+    form = new_form(app)
+    wait_loaded(app, form)
+    result['startup_warm_ms'] = round((time.perf_counter() - started) * 1000, 3)
+    result['available_heats'] = len(form.plavka_index)
+    result['heat_memory'] = bench_heat_memory(form.used_numbers, form.seasons)
+
+    times = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        form.load_plavka_numbers()
+        wait_loaded(app, form)
+        times.append(time.perf_counter() - started)
+    result['load_plavka_numbers'] = summary(times)
+
+    available = list(form.plavka_index)
+    times = []
+    for number in rng.sample(available, min(len(available), repeat * 10)):
+        started = time.perf_counter()
+        form.update_наименование_отливки(number)
+        times.append(time.perf_counter() - started)
+    result['update_наименование_отливки'] = summary(times)
+
+    times = []
+    keys = [field.key for field in DEFECTS]
+    form.контроль_отлито_input.setText('1000')
+    for _ in range(repeat * 10):
+        key = rng.choice(keys)
+        form.defect_inputs[key].setText(str(rng.randint(0, 20)))
+        started = time.perf_counter()
+        form.calculate_control_prinato()
+        times.append(time.perf_counter() - started)
+    result['calculate_control_prinato'] = summary(times)
+
+    times = []
+    for number in available[:repeat * 10]:
+        record = ControlRecord(number, rng.randint(1, 200), '2025-03-01', INSPECTORS[0], '',
+                               наименование_отливки=form.plavka_index.casting(number))
+        started = time.perf_counter()
+        form.validator.validate(record)
+        times.append(time.perf_counter() - started)
+    result['validate_record'] = summary(times)
+
+    times = []
+    errors_before = len(messages)
+    form.контролер1_input.setCurrentIndex(0)
+    # Дата в сезоне плавок реестра и обычное для истории "Отлито", иначе проверка
+    # записи спросит подтверждение, а ответ "Нет" отменит сохранение
+    form.контроль_дата_приемки_input.setDate(QDate(2025, 3, 1))
+    for input_field in form.defect_inputs.values():
+        input_field.setText('')
+    form.контроль_отлито_input.setText('200')
+    saved_before = len(form.used_numbers)
+    for number in available[:repeat]:
+        form.номер_плавки_input.select_number(number)
+        started = time.perf_counter()
+        form.save_data()
+        times.append(time.perf_counter() - started)
+    result['save_data'] = summary(times)
+    failed = [m for m in messages[errors_before:] if not m.startswith('Успех')]
+    if len(form.used_numbers) - saved_before < len(times) and not failed:
+        failed = ["Часть записей не сохранена (проверка записи)"]
+    if failed:
+        result['save_errors'] = failed[:5]
+
+    form.close()
+    form.deleteLater()
+
+    journal = ControlJournal('control.db')
+    try:
+        started = time.perf_counter()
+        journal.export_xlsx('control.xlsx')
+        result['export_xlsx_ms'] = round((time.perf_counter() - started) * 1000, 3)
+        started = time.perf_counter()
+        for _ in validation.audit(journal):
+            pass
+        result['audit_ms'] = round((time.perf_counter() - started) * 1000, 3)
+    finally:
+        journal.close()
+    return result
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Замеры формы на синтетических данных")
+    parser.add_argument('--sizes', type=int, nargs='+', default=list(SIZES), help="строк в реестре и журнале")
+    parser.add_argument('--repeat', type=int, default=REPEAT, help="повторов каждой операции")
+    parser.add_argument('--output', default='benchmarks.json', help="файл с результатами (JSON)")
+    parser.add_argument('--seed', type=int, default=1, help="зерно генератора данных")
+    parser.add_argument('--keep', action='store_true', help="не удалять папки с синтетическими данными")
+    args = parser.parse_args(argv)
+
+    from PySide6.QtWidgets import QApplication
+
+    app = QApplication.instance() or QApplication([sys.argv[0]])
+    messages = answer_dialogs()
+    report = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'revision': git_revision(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'results': [],
+    }
+    output = os.path.abspath(args.output)
+    cwd = os.getcwd()
+    try:
+        for rows in args.sizes:
+            # Форма работает с файлами в текущей папке
+            folder = tempfile.mkdtemp(prefix=f'kontrol-bench-{rows}-')
+            os.chdir(folder)
+            print(f"{rows} строк ({folder})...", file=sys.stderr)
+            result = bench_size(app, rows, args.repeat, random.Random(args.seed), messages)
+            report['results'].append(result)
+            os.chdir(cwd)
+            if not args.keep:
+                shutil.rmtree(folder, ignore_errors=True)
+            for name, value in result.items():
+                if name == 'heat_memory':
+                    for path, memory in value.items():
+                        print(f"  heat_memory.{path:<19} {memory['kept_bytes'] / 2 ** 20:8.2f} МБ"
+                              f"  (пик {memory['peak_bytes'] / 2 ** 20:.2f} МБ, {memory['build_ms']} мс)",
+                              file=sys.stderr)
+                elif isinstance(value, dict):
+                    print(f"  {name:<30} p50 {value['p50_ms']:10.3f} мс  p95 {value['p95_ms']:10.3f} мс",
+                          file=sys.stderr)
+                elif name.endswith(('_ms', '_s')):
+                    print(f"  {name:<30} {value}", file=sys.stderr)
+    finally:
+        os.chdir(cwd)
+
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"Результаты: {output}", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+"""Пакетный ввод записей контроля из CSV или JSONL без запуска формы.
+
+    python bulk_import.py смена.csv
+    python bulk_import.py смена.jsonl --batch-size 500 --dry-run
+
+Колонки (ключи JSON) - как в control.xlsx: Номер_плавки, Контроль_отлито,
+Контроль_дата_приемки, Контролер1, Контролер2 и колонки дефектов.
+Контроль_принято можно не указывать - он считается так же, как в форме.
+Записи проверяются теми же правилами, что и в форме (validation.py):
+строки с ошибками не записываются, по каждой выводится сообщение;
+предупреждения (необычное "Отлито", дата вне сезона плавки) выводятся,
+но строка записывается.
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+
+from config import active_seasons
+from core import DEFECT_SLOTS, ControlRecord, parse_count, parse_date
+from journal import DB_PATH, XLSX_PATH, ControlJournal, open_journal, read_castings, read_used_numbers_xlsx
+from schema import DATE_COLUMN, HEADERS, JOURNAL_DEFECTS
+from validation import WARNING, RecordValidator, errors_of, output_ranges, warnings_of
+
+BATCH_SIZE = 1000
+
+
+def read_records(path, encoding='utf-8-sig'):
+    """Построчно читает файл: (номер строки, запись). Запись CSV - словарь, JSONL - строка JSON"""
+    if path.lower().endswith(('.jsonl', '.json')):
+        with open(path, encoding=encoding) as f:
+            for line_number, line in enumerate(f, start=1):
+                if line.strip():
+                    yield line_number, line
+        return
+
+    with open(path, encoding=encoding, newline='') as f:
+        # Excel в русской локали сохраняет CSV через ';'
+        dialect = csv.Sniffer().sniff(f.read(4096), delimiters=',;\t')
+        f.seek(0)
+        reader = csv.DictReader(f, dialect=dialect)
+        unknown = [name for name in reader.fieldnames or [] if name not in HEADERS]
+        if unknown:
+            print(f"Колонки не из журнала будут пропущены: {', '.join(unknown)}", file=sys.stderr)
+        for record in reader:
+            yield reader.line_num, record
+
+
+def _count(record, column):
+    value = record.get(column)
+    if value is None or value == '':
+        return None
+    try:
+        count = parse_count(value)
+    except ValueError:
+        raise ValueError(f"{column}: не число {value!r}") from None
+    if count < 0:
+        raise ValueError(f"{column}: отрицательное количество {count}")
+    return count
+
+
+def build_record(record, validator):
+    """Проверяет запись файла; возвращает ControlRecord и предупреждения (ValueError с текстом ошибки)
+
+    validator - validation.RecordValidator с реестром (castings: номер плавки ->
+    наименование отливки) и занятыми плавками.
+    """
+    if isinstance(record, str):
+        try:
+            record = json.loads(record)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"Не удалось разобрать JSON: {e.msg}") from None
+        if not isinstance(record, dict):
+            raise ValueError("Строка JSONL должна быть объектом")
+
+    номер_плавки = str(record.get('Номер_плавки') or '').strip()
+    if not record.get(DATE_COLUMN):
+        raise ValueError("Не указана дата приемки")
+    result = ControlRecord(номер_плавки, _count(record, 'Контроль_отлито'), parse_date(record[DATE_COLUMN]),
+                           record.get('Контролер1') or '', record.get('Контролер2') or '',
+                           наименование_отливки=validator.castings.get(номер_плавки))
+    for field in JOURNAL_DEFECTS:
+        result.defects[DEFECT_SLOTS[field.key]] = _count(record, field.column) or 0
+    issues = validator.validate(result, _count(record, 'Контроль_принято'))
+    errors = errors_of(issues)
+    if errors:
+        raise ValueError("; ".join(errors))
+    return result, warnings_of(issues)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Пакетный ввод записей контроля из CSV/JSONL")
+    parser.add_argument('path', help="файл .csv или .jsonl")
+    parser.add_argument('--db', default=DB_PATH, help="журнал контроля (по умолчанию control.db)")
+    parser.add_argument('--plavka', default='plavka.xlsx', help="реестр плавок")
+    parser.add_argument('--batch-size', type=int, default=BATCH_SIZE,
+                        help="сколько строк записывать одной транзакцией")
+    parser.add_argument('--encoding', default='utf-8-sig', help="кодировка CSV (например cp1251)")
+    parser.add_argument('--dry-run', action='store_true', help="только проверить, ничего не записывать (журнал не создается)")
+    parser.add_argument('--export', action='store_true', help="после записи выгрузить журнал в control.xlsx")
+    parser.add_argument('--xlsx', help="выгрузка журнала (по умолчанию control.xlsx рядом с --db)")
+    args = parser.parse_args(argv)
+    # Выгрузка и ее старые записи - от того же журнала, что и --db
+    xlsx_path = args.xlsx or os.path.join(os.path.dirname(args.db), XLSX_PATH)
+
+    for path in (args.path, args.plavka):
+        if not os.path.exists(path):
+            print(f"{path}: файл не найден", file=sys.stderr)
+            return 1
+
+    # Номер плавки -> наименование отливки (для сводов журнала), как при переносе журнала
+    castings = read_castings(args.plavka)
+    if not args.dry_run:
+        journal = open_journal(args.db, xlsx_path, args.plavka)
+    elif os.path.exists(args.db):
+        # Проверка без записи не создает и не переносит журнал
+        journal = ControlJournal(args.db, read_only=True)
+    else:
+        journal = None
+    if journal is not None:
+        used_numbers = journal.used_numbers_with_xlsx(xlsx_path)
+        ranges = output_ranges(journal, castings)
+    else:
+        # Журнала еще нет - занятые плавки только в control.xlsx, истории для диапазонов нет
+        used_numbers = read_used_numbers_xlsx(xlsx_path) if os.path.exists(xlsx_path) else set()
+        ranges = {}
+    validator = RecordValidator(used_numbers, castings, ranges)
+
+    started = time.perf_counter()
+    imported = errors = 0
+    batch = []
+
+    def flush():
+        nonlocal imported, errors
+        skipped = []
+        if batch and not args.dry_run:
+            skipped = journal.save_many(batch)
+        for number in skipped:
+            # Плавку успели сохранить с другой станции, пока шел ввод
+            print(f"{args.path}: По плавке {number} уже есть запись контроля", file=sys.stderr)
+        imported += len(batch) - len(skipped)
+        errors += len(skipped)
+        batch.clear()
+
+    try:
+        for line_number, record in read_records(args.path, args.encoding):
+            try:
+                result, warnings = build_record(record, validator)
+            except ValueError as e:
+                errors += 1
+                print(f"{args.path}:{line_number}: {e}", file=sys.stderr)
+                continue
+            for warning in warnings:
+                print(f"{args.path}:{line_number}: {WARNING}: {warning}", file=sys.stderr)
+            # Повтор плавки внутри того же файла - тоже ошибка
+            used_numbers.add(result.номер_плавки)
+            batch.append(result)
+            if len(batch) >= args.batch_size:
+                flush()
+        flush()
+        if args.export and imported and not args.dry_run:
+            journal.export_xlsx(xlsx_path, seasons=active_seasons())
+    finally:
+        if journal is not None:
+            journal.close()
+
+    elapsed = time.perf_counter() - started
+    rate = (imported + errors) / elapsed if elapsed else 0
+    action = "Проверено" if args.dry_run else "Записано"
+    print(f"{action}: {imported}, с ошибками: {errors} ({elapsed:.2f} с, {rate:.0f} строк/с)")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,52 @@
+"""Настройки станции из kontrol.ini (рядом с формой).
+
+    [kontrol]
+    seasons = 25, 26
+    server = 127.0.0.1:8765
+
+seasons - активные сезоны: две цифры года после "/" в учетном номере
+плавки. В списке формы только плавки активных сезонов, и control.xlsx
+выгружается только по ним. Переменная окружения KONTROL_SEASONS
+(например 25,26) важнее файла.
+
+server - адрес службы журнала (journal_server.py); если задан, форма
+сохраняет записи через нее. Переменная окружения KONTROL_SERVER важнее
+файла, пустое значение отключает службу.
+"""
+import configparser
+import os
+
+CONFIG_PATH = 'kontrol.ini'
+
+# Если сезон нигде не задан
+DEFAULT_SEASONS = ('25',)
+
+
+def _setting(name, path):
+    value = os.environ.get(f'KONTROL_{name.upper()}')
+    if value is None:
+        config = configparser.ConfigParser()
+        config.read(path, encoding='utf-8')
+        value = config.get('kontrol', name, fallback=None)
+    return value
+
+
+def active_seasons(path=CONFIG_PATH):
+    """Активные сезоны, например ('25', '26')"""
+    value = _setting('seasons', path)
+    if not value:
+        return DEFAULT_SEASONS
+    seasons = tuple(season.strip().lstrip('/') for season in value.replace(';', ',').split(','))
+    return tuple(season for season in seasons if season) or DEFAULT_SEASONS
+
+
+def server_address(path=CONFIG_PATH):
+    """Адрес службы журнала (хост, порт) или None, если форма работает с control.db сама"""
+    value = (_setting('server', path) or '').strip()
+    if not value:
+        return None
+    host, _, port = value.rpartition(':')
+    try:
+        return host or '127.0.0.1', int(port)
+    except ValueError:
+        raise ValueError(f"Неверный адрес службы журнала: {value!r} (нужно хост:порт)") from None
@@ -0,0 +1,203 @@
+"""Правила записи контроля без зависимости от Qt.
+
+Запись контроля (ControlRecord), расчет и проверка "Принято", отбор
+доступных плавок и интерфейс хранилища записей. Форма (kontrol.py) только
+показывает поля и вызывает эти функции, поэтому их же используют пакетный
+ввод (bulk_import.py) и замеры без окна.
+"""
+from abc import ABC, abstractmethod
+from array import array
+from datetime import datetime
+
+from perf import metrics
+from schema import DEFECTS, JOURNAL_DEFECTS
+
+# Поле дефекта -> его место в векторе дефектов записи (порядок JOURNAL_DEFECTS)
+DEFECT_SLOTS = {field.key: i for i, field in enumerate(JOURNAL_DEFECTS)}
+
+
+def parse_count(value):
+    """Количество штук из поля формы: пусто -> 0, иначе целое число (ValueError, если не число)"""
+    if value is None or value == '':
+        return 0
+    if isinstance(value, int):
+        return value
+    return int(str(value).strip() or 0)
+
+
+def calculate_prinato(отлито, defect_total):
+    """Принято = отлито минус все дефекты (второй сорт, доработка, окончательный брак)"""
+    return отлито - defect_total
+
+
+def validate_prinato(отлито, defect_total, указано=None):
+    """Проверка "Принято": не отрицательное и (если указано) совпадает с расчетом; текст ошибки или None"""
+    принято = calculate_prinato(отлито, defect_total)
+    if принято < 0:
+        return f"Принято получается отрицательным: {принято}"
+    if указано is not None and указано != принято:
+        return f"Контроль_принято {указано} не сходится с расчетом {принято}"
+    return None
+
+
+def check_required(номер_плавки, отлито, контролер1, контролер2):
+    """Проверка обязательных полей; возвращает текст ошибки или None"""
+    if not номер_плавки:
+        return "Выберите номер плавки"
+    if отлито is None or отлито == '':
+        return "Укажите количество отлитых деталей"
+    if not контролер1 and not контролер2:
+        return "Укажите хотя бы одного контролера"
+    return None
+
+
+# Сезон плавки - две цифры года после первой "/" в учетном номере: 123/25 -> '25'
+# (в журнале так же считается колонка Сезон, см. journal.py)
+def season_of(number):
+    """Сезон учетного номера плавки ('' - номер без года)"""
+    return str(number).partition('/')[2][:2]
+
+
+def seasons_of(numbers):
+    """То же для колонки pandas с номерами"""
+    return numbers.astype(str).str.partition('/')[2].str[:2]
+
+
+def parse_date(value):
+    """Дата приемки ДД.ММ.ГГГГ (как в форме) или ГГГГ-ММ-ДД -> ГГГГ-ММ-ДД (ValueError, если не дата)"""
+    value = str(value).strip()
+    for fmt in ('%d.%m.%Y', '%Y-%m-%d'):
+        try:
+            return datetime.strptime(value, fmt).strftime('%Y-%m-%d')
+        except ValueError:
+            pass
+    raise ValueError(f"Неверная дата приемки: {value!r}")
+
+
+class ControlRecord:
+    """Одна проверка плавки; количества дефектов - в компактном векторе array('l')"""
+
+    __slots__ = ('номер_плавки', 'отлито', 'дата_приемки', 'контролер1', 'контролер2',
+                 'defects', 'наименование_отливки')
+
+    def __init__(self, номер_плавки, отлито, дата_приемки, контролер1='', контролер2='',
+                 defects=None, наименование_отливки=None):
+        self.номер_плавки = номер_плавки
+        self.отлито = отлито
+        self.дата_приемки = дата_приемки  # ГГГГ-ММ-ДД
+        self.контролер1 = контролер1
+        self.контролер2 = контролер2
+        self.defects = defects if defects is not None else array('l', [0]) * len(JOURNAL_DEFECTS)
+        self.наименование_отливки = наименование_отливки
+
+    @classmethod
+    def from_form(cls, номер_плавки, отлито, дата_приемки, контролер1, контролер2, defect_texts,
+                  наименование_отливки=None):
+        """Запись из текстов полей формы (defect_texts: ключ поля -> текст); ValueError с текстом ошибки"""
+        error = check_required(номер_плавки, отлито, контролер1, контролер2)
+        if error:
+            raise ValueError(error)
+        record = cls(номер_плавки, _form_count(отлито, "Отлито"), parse_date(дата_приемки),
+                     контролер1, контролер2, наименование_отливки=наименование_отливки)
+        for field in DEFECTS:
+            record.defects[DEFECT_SLOTS[field.key]] = _form_count(defect_texts.get(field.key), field.label)
+        return record
+
+    @classmethod
+    def from_row(cls, row, наименование_отливки=None):
+        """Запись из строки журнала (порядок HEADERS, дата ГГГГ-ММ-ДД)"""
+        record = cls(row[0], parse_count(row[1]), row[3], row[4] or '', row[5] or '',
+                     наименование_отливки=наименование_отливки)
+        for slot, value in enumerate(row[6:]):
+            record.defects[slot] = parse_count(value)
+        return record
+
+    @property
+    def defect_total(self):
+        return sum(self.defects)
+
+    @property
+    def принято(self):
+        return calculate_prinato(self.отлито, self.defect_total)
+
+    def validate(self):
+        """Текст ошибки или None"""
+        return (check_required(self.номер_плавки, self.отлито, self.контролер1, self.контролер2)
+                or validate_prinato(self.отлито, self.defect_total))
+
+    def to_row(self):
+        """Строка журнала в порядке HEADERS (нулевой дефект - пустая ячейка, как незаполненное поле формы)"""
+        return [self.номер_плавки, self.отлито, self.принято, self.дата_приемки,
+                self.контролер1, self.контролер2] + [count or None for count in self.defects]
+
+
+def _form_count(text, label):
+    try:
+        count = parse_count(text)
+    except ValueError:
+        raise ValueError(f"{label}: не число {text!r}") from None
+    if count < 0:
+        raise ValueError(f"{label}: отрицательное количество {count}")
+    return count
+
+
+@metrics.timed('plavka.filter')
+def available_plavka(df_plavka, used_numbers, seasons):
+    """Плавки активных сезонов, по которым еще нет записи, по возрастанию номера
+
+    При повторе номера в реестре первой остается первая строка.
+    """
+    numbers = df_plavka['Учетный_номер'].astype(str)
+    keep = seasons_of(numbers).isin(seasons) & ~numbers.isin(used_numbers)
+    return df_plavka[keep].iloc[numbers[keep].argsort(kind='stable')]
+
+
+class ControlStorage(ABC):
+    """Хранилище записей контроля: журнал control.db (journal.ControlJournal) или память (MemoryStorage)
+
+    Хранилище без какого-то из методов не создается (TypeError при создании).
+    """
+
+    @abstractmethod
+    def save(self, record):
+        """Сохраняет запись; если по плавке уже есть запись - HeatAlreadyUsed"""
+
+    @abstractmethod
+    def save_many(self, records):
+        """Сохраняет пачку записей; возвращает номера плавок, которые уже были сохранены"""
+
+    @abstractmethod
+    def used_numbers(self):
+        """Множество номеров плавок, по которым уже есть запись"""
+
+
+class HeatAlreadyUsed(Exception):
+    """По плавке уже есть запись контроля (например, ее только что сохранила другая станция)"""
+
+    def __init__(self, number):
+        super().__init__(f"По плавке {number} уже есть запись контроля")
+        self.number = number
+
+
+class MemoryStorage(ControlStorage):
+    """Записи в памяти - для проверок и замеров без базы"""
+
+    def __init__(self):
+        self.records = {}
+
+    def save(self, record):
+        if record.номер_плавки in self.records:
+            raise HeatAlreadyUsed(record.номер_плавки)
+        self.records[record.номер_плавки] = record
+
+    def save_many(self, records):
+        skipped = []
+        for record in records:
+            try:
+                self.save(record)
+            except HeatAlreadyUsed:
+                skipped.append(record.номер_плавки)
+        return skipped
+
+    def used_numbers(self):
+        return set(self.records)
@@ -0,0 +1,78 @@
+"""Панель диагностики формы (Ctrl+Shift+D): замеры горячих мест из perf.metrics.
+
+Показывает для каждого места число вызовов, p50/p95/max и суммарное
+время; замеры можно включить прямо здесь, без перезапуска формы.
+"""
+from PySide6.QtWidgets import (
+    QWidget, QVBoxLayout, QHBoxLayout, QCheckBox, QLabel, QPushButton,
+    QTableWidget, QTableWidgetItem, QHeaderView
+)
+from PySide6.QtCore import Qt, QTimer
+
+from perf import metrics
+
+# Как часто обновлять таблицу, пока панель открыта
+REFRESH_MS = 1000
+
+COLUMNS = [
+    ('name', "Место"), ('count', "Вызовов"), ('p50_ms', "p50, мс"),
+    ('p95_ms', "p95, мс"), ('max_ms', "max, мс"), ('total_ms', "Всего, мс"),
+]
+
+
+class DiagnosticsView(QWidget):
+    def __init__(self, parent=None):
+        super().__init__(parent, Qt.Window)
+        self.setWindowTitle("Диагностика")
+        self.resize(700, 400)
+        layout = QVBoxLayout(self)
+
+        controls = QHBoxLayout()
+        self.enabled_checkbox = QCheckBox("Замерять")
+        self.enabled_checkbox.setChecked(metrics.enabled)
+        self.enabled_checkbox.toggled.connect(self.set_enabled)
+        controls.addWidget(self.enabled_checkbox)
+        reset_button = QPushButton("Сбросить")
+        reset_button.clicked.connect(self.reset)
+        controls.addWidget(reset_button)
+        controls.addStretch()
+        layout.addLayout(controls)
+
+        self.table = QTableWidget(0, len(COLUMNS))
+        self.table.setHorizontalHeaderLabels([title for _, title in COLUMNS])
+        self.table.horizontalHeader().setSectionResizeMode(QHeaderView.ResizeToContents)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        layout.addWidget(self.table)
+
+        layout.addWidget(QLabel(f"Каждый замер пишется в {metrics.log_path}"))
+
+        self.timer = QTimer(self)
+        self.timer.timeout.connect(self.refresh)
+
+    def set_enabled(self, enabled):
+        metrics.enabled = enabled
+
+    def reset(self):
+        metrics.reset()
+        self.refresh()
+
+    def refresh(self):
+        rows = metrics.snapshot()
+        self.table.setRowCount(len(rows))
+        for row_number, row in enumerate(rows):
+            for column, (key, _) in enumerate(COLUMNS):
+                value = row[key]
+                item = QTableWidgetItem(value if isinstance(value, str) else
+                                        str(value) if isinstance(value, int) else f"{value:.3f}")
+                if not isinstance(value, str):
+                    item.setTextAlignment(Qt.AlignRight | Qt.AlignVCenter)
+                self.table.setItem(row_number, column, item)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.refresh()
+        self.timer.start(REFRESH_MS)
+
+    def hideEvent(self, event):
+        self.timer.stop()
+        super().hideEvent(event)
@@ -0,0 +1,81 @@
+"""Фоновая выгрузка журнала в control.xlsx (write-behind).
+
+Сохранение в форме только дописывает строку в control.db и сразу
+возвращается, а control.xlsx обновляет этот поток: после сохранения он
+ждет FLUSH_DELAY секунд, собирая следующие сохранения в ту же выгрузку,
+и записывает книгу во временный файл с атомарной подменой. Какие записи
+уже выгружены, хранится в журнале (exported_id), поэтому записи, не
+попавшие в control.xlsx из-за сбоя или выключения, выгружаются при
+следующем запуске. Если заданы активные сезоны, в control.xlsx
+выгружаются только они, а закрытые сезоны - в свои архивы.
+"""
+import threading
+import time
+
+from journal import XLSX_PATH, ControlJournal
+
+# Сколько ждать после сохранения, прежде чем выгружать (следующие сохранения попадут в ту же выгрузку)
+FLUSH_DELAY = 30
+
+# Через сколько повторить неудачную выгрузку (например, control.xlsx открыт в Excel)
+RETRY_DELAY = 60
+
+
+class ExportWriter(threading.Thread):
+    """Поток выгрузки; on_flushed(error) вызывается из этого потока после каждой попытки"""
+
+    def __init__(self, db_path, xlsx_path=XLSX_PATH, on_flushed=None, seasons=None):
+        super().__init__(name='ExportWriter', daemon=True)
+        self.db_path = db_path
+        self.xlsx_path = xlsx_path
+        self.seasons = seasons
+        self.on_flushed = on_flushed
+        self.condition = threading.Condition()
+        self.due = None  # Когда выгружать (time.monotonic), None - выгрузка не нужна
+        self.force = False  # Выгрузить, даже если новых записей нет
+        self.stopping = False
+
+    def schedule(self, delay=FLUSH_DELAY, force=False):
+        """Просит выгрузить журнал не позже чем через delay секунд"""
+        with self.condition:
+            due = time.monotonic() + delay
+            if self.due is None or due < self.due:
+                self.due = due
+            self.force = self.force or force
+            self.condition.notify()
+
+    def stop(self, timeout=None):
+        """Выгружает то, что ждет выгрузки, и завершает поток"""
+        with self.condition:
+            self.stopping = True
+            self.condition.notify()
+        self.join(timeout)
+
+    def run(self):
+        journal = ControlJournal(self.db_path)
+        try:
+            while True:
+                with self.condition:
+                    while not self.stopping and (self.due is None or time.monotonic() < self.due):
+                        timeout = None if self.due is None else self.due - time.monotonic()
+                        self.condition.wait(timeout)
+                    if self.due is None and self.stopping:
+                        return
+                    self.due = None
+                    force, self.force = self.force, False
+                self.flush(journal, force)
+        finally:
+            journal.close()
+
+    def flush(self, journal, force=False):
+        error = None
+        try:
+            if force or journal.pending_export(self.seasons):
+                journal.export_xlsx(self.xlsx_path, self.seasons)
+        except Exception as e:
+            error = e
+            print(f"Ошибка при выгрузке журнала в control.xlsx: {str(e)}")
+            if not self.stopping:
+                self.schedule(RETRY_DELAY)
+        if self.on_flushed:
+            self.on_flushed(error)
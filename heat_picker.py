@@ -0,0 +1,156 @@
+"""Выбор номера плавки из большого реестра.
+
+Номера хранятся отсортированными: в списке Python (по нему bisect ищет
+строку номера и номера с введенным началом) и в QStringListModel, который
+показывают комбобокс и подсказки. Модель - C++, поэтому Qt не вызывает
+Python на каждую из 100 тысяч строк. Подсказки при вводе - срез
+отсортированного списка между двумя bisect, сохраненные плавки удаляются
+из модели по одной строке, без перестроения списка.
+"""
+from bisect import bisect_left
+
+from PySide6.QtWidgets import QComboBox, QCompleter
+from PySide6.QtCore import QStringListModel
+
+from perf import metrics
+
+# Сколько номеров добавлять по одной строке; большие порции не по порядку вливаются в список целиком
+INSERT_ONE_BY_ONE = 64
+
+# Сколько подсказок показывать: по одной-двум цифрам совпадают десятки тысяч номеров
+MAX_MATCHES = 500
+
+# Символ, который больше любого символа номера плавки: все номера с префиксом p лежат в [p, p + END)
+END = '\uffff'
+
+
+class HeatListModel(QStringListModel):
+    """Отсортированный список доступных номеров плавок"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.numbers = []  # Те же строки, что в модели, для bisect
+
+    def row_of(self, number):
+        """Строка номера или -1"""
+        row = bisect_left(self.numbers, number)
+        return row if row < len(self.numbers) and self.numbers[row] == number else -1
+
+    def prefix_range(self, prefix):
+        """Строки [start, end) номеров, начинающихся с prefix"""
+        return bisect_left(self.numbers, prefix), bisect_left(self.numbers, prefix + END)
+
+    def add_numbers(self, numbers):
+        """Добавляет номера, которых еще нет в списке"""
+        numbers = sorted({number for number in numbers if self.row_of(number) < 0})
+        if not numbers:
+            return
+        if not self.numbers or numbers[0] > self.numbers[-1]:
+            # Порция целиком после последнего номера (так приходит загрузка реестра) - дописываем в конец
+            self.insert_run(len(self.numbers), numbers)
+        elif len(numbers) <= INSERT_ONE_BY_ONE:
+            for number in numbers:
+                self.insert_run(bisect_left(self.numbers, number), [number])
+        else:
+            self.numbers = sorted(self.numbers + numbers)
+            self.setStringList(self.numbers)
+
+    def insert_run(self, row, numbers):
+        self.numbers[row:row] = numbers
+        self.insertRows(row, len(numbers))
+        for offset, number in enumerate(numbers):
+            self.setData(self.index(row + offset), number)
+
+    def remove_number(self, number):
+        row = self.row_of(number)
+        if row >= 0:
+            del self.numbers[row]
+            self.removeRows(row, 1)
+        return row >= 0
+
+    def clear(self):
+        self.numbers = []
+        self.setStringList([])
+
+
+class HeatPicker(QComboBox):
+    """Комбобокс номера плавки: выпадающий список и подсказки по началу номера"""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.heats = HeatListModel(self)
+        self.setModel(self.heats)
+        self.setEditable(True)
+        self.setInsertPolicy(QComboBox.NoInsert)
+        # Иначе по Enter QComboBox ищет введенный текст перебором всей модели;
+        # номер по Enter выбирает select_typed
+        self.setDuplicatesEnabled(True)
+        # Все строки одной высоты - список не измеряет каждую из 100 тысяч строк
+        self.view().setUniformItemSizes(True)
+
+        self.matches = QStringListModel(self)
+        completer = QCompleter(self.matches, self)
+        # Модель подсказок уже отфильтрована, QCompleter показывает ее как есть
+        completer.setCompletionMode(QCompleter.UnfilteredPopupCompletion)
+        completer.setModelSorting(QCompleter.CaseSensitivelySortedModel)
+        completer.popup().setUniformItemSizes(True)
+        completer.activated[str].connect(self.select_number)
+        self.setCompleter(completer)
+        self.lineEdit().textEdited.connect(self.update_matches)
+        self.lineEdit().returnPressed.connect(self.select_typed)
+
+        # Слияние большой порции перестраивает модель - выбранный номер или введенный текст восстанавливаем
+        self.selected_before_reset = None
+        self.heats.modelAboutToBeReset.connect(self.remember_selection)
+        self.heats.modelReset.connect(self.restore_selection)
+
+    def setPlaceholderText(self, text):
+        # У редактируемого комбобокса текст-подсказку показывает поле ввода
+        super().setPlaceholderText(text)
+        self.lineEdit().setPlaceholderText(text)
+
+    def add_numbers(self, numbers):
+        self.heats.add_numbers(numbers)
+        self.update_matches(self.lineEdit().text())
+
+    def remove_number(self, number):
+        if self.heats.remove_number(number):
+            self.update_matches(self.lineEdit().text())
+
+    def clear_numbers(self):
+        self.heats.clear()
+        self.matches.setStringList([])
+
+    @metrics.timed('picker.matches')
+    def update_matches(self, text):
+        """Подсказки: первые MAX_MATCHES номеров, начинающихся с введенного текста"""
+        if text:
+            start, end = self.heats.prefix_range(text)
+            self.matches.setStringList(self.heats.numbers[start:min(end, start + MAX_MATCHES)])
+        else:
+            self.matches.setStringList([])
+
+    def select_number(self, number):
+        """Выбирает номер из списка (строка находится bisect, а не перебором)"""
+        self.setCurrentIndex(self.heats.row_of(number))
+
+    def select_typed(self):
+        """Enter в поле ввода: выбирает напечатанный номер, если он есть в списке"""
+        row = self.heats.row_of(self.currentText().strip())
+        if row >= 0:
+            self.setCurrentIndex(row)
+
+    def remember_selection(self):
+        self.selected_before_reset = (self.currentIndex() >= 0, self.currentText())
+
+    def restore_selection(self):
+        # После сброса модели QComboBox выбирает первую строку - возвращаем выбранный
+        # номер или недописанный текст, не подставляя чужую плавку
+        if self.selected_before_reset is not None:
+            selected, text = self.selected_before_reset
+            self.selected_before_reset = None
+            if selected:
+                self.select_number(text)
+            else:
+                self.setCurrentIndex(-1)
+                self.setEditText(text)
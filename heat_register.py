@@ -0,0 +1,134 @@
+"""Компактный реестр доступных плавок для формы.
+
+Форме из plavka.xlsx нужны только номер плавки и наименование отливки,
+поэтому вместо DataFrame со всеми колонками и словаря атрибутов на каждую
+плавку хранятся отсортированный список номеров (те же объекты строк, что
+в списке комбобокса), array с кодом наименования на каждую плавку и
+список разных наименований (их десятки на весь реестр) - как категории
+pandas. Номер ищется bisect по списку.
+"""
+from array import array
+from bisect import bisect_left
+
+from core import available_plavka
+
+NUMBER_COLUMN = 'Учетный_номер'
+CASTING_COLUMN = 'Наименование_отливки'
+
+# Сколько плавок вставлять по одной; большие порции вливаются пересортировкой
+INSERT_ONE_BY_ONE = 64
+
+
+class HeatRegister:
+    """Доступные плавки: номер -> наименование отливки"""
+
+    __slots__ = ('numbers', 'codes', 'castings', 'casting_codes')
+
+    def __init__(self):
+        self.numbers = []  # По возрастанию
+        self.codes = array('i')  # Код наименования отливки для каждого номера
+        self.castings = []  # Код -> наименование
+        self.casting_codes = {}  # Наименование -> код
+
+    @classmethod
+    def from_plavka(cls, df_plavka, used_numbers, seasons):
+        """Плавки активных сезонов без записи контроля (при повторе номера - первая строка реестра)"""
+        import pandas as pd
+
+        df_plavka = available_plavka(df_plavka[[NUMBER_COLUMN, CASTING_COLUMN]], used_numbers, seasons)
+        numbers = df_plavka[NUMBER_COLUMN].astype(str)
+        first = ~numbers.duplicated().to_numpy()
+        # Пустое наименование - '' (без fillna pandas оставляет NaN, а factorize дает ему код -1)
+        codes, castings = pd.factorize(df_plavka[CASTING_COLUMN].fillna('').astype(str).to_numpy()[first])
+        register = cls()
+        register.numbers = numbers.to_numpy()[first].tolist()
+        register.codes = array('i', codes.tolist())
+        register.castings = castings.tolist()
+        register.casting_codes = {casting: code for code, casting in enumerate(register.castings)}
+        return register
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def __iter__(self):
+        return iter(self.numbers)
+
+    def __contains__(self, number):
+        return self.row_of(number) >= 0
+
+    def row_of(self, number):
+        """Строка номера или -1"""
+        row = bisect_left(self.numbers, number)
+        return row if row < len(self.numbers) and self.numbers[row] == number else -1
+
+    def casting(self, number):
+        """Наименование отливки плавки (None, если плавки нет)"""
+        row = self.row_of(number)
+        return self.castings[self.codes[row]] if row >= 0 else None
+
+    def code_of(self, casting):
+        code = self.casting_codes.get(casting)
+        if code is None:
+            code = self.casting_codes[casting] = len(self.castings)
+            self.castings.append(casting)
+        return code
+
+    def add(self, number, casting):
+        """Добавляет плавку, если ее еще нет; True, если добавлена"""
+        row = bisect_left(self.numbers, number)
+        if row < len(self.numbers) and self.numbers[row] == number:
+            return False
+        self.numbers.insert(row, number)
+        self.codes.insert(row, self.code_of(casting))
+        return True
+
+    def update(self, number, casting):
+        """Добавляет плавку или меняет ее наименование отливки"""
+        row = self.row_of(number)
+        if row >= 0:
+            self.codes[row] = self.code_of(casting)
+        else:
+            self.add(number, casting)
+
+    def update_many(self, castings):
+        """update для порции {номер: наименование}; возвращает номера, которых раньше не было"""
+        added = [number for number in castings if number not in self]
+        if len(added) <= INSERT_ONE_BY_ONE:
+            for number, casting in castings.items():
+                self.update(number, casting)
+        else:
+            codes = dict(zip(self.numbers, self.codes))
+            for number, casting in castings.items():
+                codes[number] = self.code_of(casting)
+            self.numbers = sorted(codes)
+            self.codes = array('i', (codes[number] for number in self.numbers))
+        return added
+
+    def remove(self, number):
+        row = self.row_of(number)
+        if row >= 0:
+            del self.numbers[row]
+            del self.codes[row]
+        return row >= 0
+
+    def items(self):
+        """Пары (номер, наименование отливки) по возрастанию номера"""
+        castings = self.castings
+        return ((number, castings[code]) for number, code in zip(self.numbers, self.codes))
+
+    def copy(self):
+        register = HeatRegister()
+        register.numbers = list(self.numbers)
+        register.codes = array('i', self.codes)
+        register.castings = list(self.castings)
+        register.casting_codes = dict(self.casting_codes)
+        return register
+
+    def changes(self, fresh):
+        """Разница с заново прочитанным реестром fresh
+
+        Возвращает (новые и измененные плавки {номер: наименование}, номера, которых больше нет).
+        """
+        updated = {number: casting for number, casting in fresh.items() if self.casting(number) != casting}
+        removed = [number for number in self.numbers if number not in fresh]
+        return updated, removed
@@ -0,0 +1,701 @@
+"""Журнал контроля в SQLite.
+
+Каждая проверка дописывается в control.db одной строкой в одной транзакции,
+база работает в режиме WAL. control.xlsx больше не пишется при каждом
+сохранении - это выгрузка из журнала по кнопке или по расписанию.
+При первом открытии журнала в него переносятся записи из control.xlsx.
+
+Рядом с записями в той же базе хранятся своды по дням и по месяцам:
+(период, отливка, колонка) -> количество. Они обновляются в той же
+транзакции, что и запись, поэтому отчетам за месяц или год достаточно
+прочитать несколько сотен строк сводов вместо всего журнала.
+
+Записи разделены по сезонам (году в номере плавки, колонка Сезон с
+индексом): форма читает занятые номера только активных сезонов, в
+control.xlsx выгружаются только они, а закрытые сезоны - в отдельные
+архивы control_24.xlsx и т.д., которые переписываются, только если в
+сезон что-то добавили.
+
+Сохраненную запись можно исправить (correct): она находится по индексу
+номера плавки, своды поправляются на разницу, а каждое исправленное поле
+дописывается в control_audit - эту таблицу нельзя изменить или очистить.
+"""
+import glob
+import os
+import platform
+import sqlite3
+from collections import Counter
+from datetime import date, datetime
+from urllib.request import pathname2url
+
+from core import ControlStorage, HeatAlreadyUsed, season_of
+from locking import FileLock
+from perf import metrics
+from plavka_cache import file_signature
+from schema import DATE_COLUMN, HEADERS, TEXT_COLUMNS
+
+DB_PATH = 'control.db'
+XLSX_PATH = 'control.xlsx'
+PLAVKA_PATH = 'plavka.xlsx'
+
+# Режим журнала SQLite. WAL не работает, если control.db лежит в сетевой папке -
+# тогда станциям нужно задать KONTROL_JOURNAL_MODE=DELETE
+JOURNAL_MODE = os.environ.get('KONTROL_JOURNAL_MODE', 'WAL')
+
+# Версия схемы базы хранится в PRAGMA user_version
+SCHEMA_VERSION = 5
+
+# Наименование отливки из реестра плавок на момент сохранения (в control.xlsx не выгружается)
+CASTING_COLUMN = 'Наименование_отливки'
+
+# Сезон записи - вычисляется из номера плавки так же, как core.season_of
+SEASON_COLUMN = 'Сезон'
+SEASON_SQL = ('CASE WHEN instr("Номер_плавки", \'/\') > 0 '
+              'THEN substr("Номер_плавки", instr("Номер_плавки", \'/\') + 1, 2) ELSE \'\' END')
+
+# Журнал исправлений сохраненных записей (только дополняется)
+AUDIT_TABLE = 'control_audit'
+
+# Формат даты приемки в выгрузках Excel
+DATE_FORMAT = 'DD.MM.YYYY'
+DATE_STYLE = 'Дата приемки'  # Именованный стиль книги с этим форматом
+
+# Колонки сводов: число проверок и все количества записи
+RECORDS_COLUMN = 'Проверок'
+ROLLUP_COLUMNS = [RECORDS_COLUMN] + [h for h in HEADERS if h not in TEXT_COLUMNS]
+
+# Таблицы сводов: период -> таблица
+ROLLUP_TABLES = {'day': 'rollup_day', 'month': 'rollup_month'}
+
+
+def quote(name):
+    return '"' + name.replace('"', '""') + '"'
+
+
+def to_iso_date(value):
+    """Приводит дату приемки к виду ГГГГ-ММ-ДД, чтобы по ней можно было сортировать и фильтровать"""
+    if value is None or value == '':
+        return None
+    if isinstance(value, (datetime, date)):
+        return value.strftime('%Y-%m-%d')
+    try:
+        return datetime.strptime(str(value).strip(), '%d.%m.%Y').strftime('%Y-%m-%d')
+    except ValueError:
+        # Непонятное значение сохраняем как есть, чтобы ничего не потерять
+        return str(value)
+
+
+def from_iso_date(value):
+    """Обратное преобразование для выгрузки в Excel"""
+    try:
+        return datetime.strptime(value, '%Y-%m-%d')
+    except (TypeError, ValueError):
+        return value
+
+
+def _count(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def _blank(value):
+    """Значение ячейки для сравнения: 0, '' и пусто - одно и то же (нулевой дефект - пустое поле формы)"""
+    return None if value is None or value == '' or value == 0 else value
+
+
+def rollup_items(row, casting):
+    """Что запись добавляет в своды: ((таблица, период, отливка, колонка), количество)"""
+    day = row[HEADERS.index(DATE_COLUMN)] or ''
+    # Месяц - только у распознанной даты, непонятные значения остаются как есть
+    month = day[:7] if len(day) == 10 and day[4] == '-' else day
+    # NaN из pandas (пустое наименование в реестре) - тоже без отливки
+    casting = casting if isinstance(casting, str) else ''
+    counts = [(RECORDS_COLUMN, 1)]
+    for header, value in zip(HEADERS, row):
+        if header not in TEXT_COLUMNS:
+            value = _count(value)
+            if value:
+                counts.append((header, value))
+    for column, value in counts:
+        yield ('rollup_day', day, casting, column), value
+        yield ('rollup_month', month, casting, column), value
+
+
+def normalize_row(values):
+    """Готовит строку формы (или control.xlsx) к записи в журнал"""
+    row = []
+    for header, value in zip(HEADERS, values):
+        if header == DATE_COLUMN:
+            value = to_iso_date(value)
+        elif value == '':
+            value = None
+        elif header == 'Номер_плавки' and value is not None:
+            value = str(value)
+        row.append(value)
+    return row
+
+
+class ControlJournal(ControlStorage):
+    """Журнал записей контроля в SQLite (по одной строке на проверку плавки)"""
+
+    def __init__(self, path=DB_PATH, read_only=False):
+        self.path = path
+        # isolation_level=None - транзакции открываем сами через BEGIN
+        if read_only:
+            # Только чтение (проверка без записи): база не создается и режим журнала не меняется
+            self.conn = sqlite3.connect(f'file:{pathname2url(os.path.abspath(path))}?mode=ro', uri=True,
+                                        timeout=30, isolation_level=None)
+        else:
+            self.conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+            self.conn.execute(f'PRAGMA journal_mode={JOURNAL_MODE}')
+        # Записи со всех станций идут по очереди через файл-замок рядом с базой
+        self.lock = FileLock(path + '.lock')
+        columns = ', '.join(quote(h) for h in HEADERS)
+        placeholders = ', '.join('?' for _ in HEADERS)
+        # Вставляется строка HEADERS и наименование отливки последним значением
+        self.insert_sql = (f'INSERT INTO control ({columns}, {quote(CASTING_COLUMN)}) '
+                           f'VALUES ({placeholders}, ?)')
+        self.select_sql = f'SELECT {columns} FROM control ORDER BY id'
+
+    def create_schema(self):
+        """Создает или обновляет таблицы журнала; возвращает True, если база только что создана"""
+        version = self.conn.execute('PRAGMA user_version').fetchone()[0]
+        if version < 1:
+            columns = ',\n'.join(
+                f'{quote(h)} {"TEXT" if h in TEXT_COLUMNS else "INTEGER"}' for h in HEADERS
+            )
+            self.conn.execute(f'CREATE TABLE IF NOT EXISTS control (\n'
+                              f'id INTEGER PRIMARY KEY AUTOINCREMENT,\n{columns})')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS control_номер_плавки '
+                              'ON control ("Номер_плавки")')
+        if version < 2:
+            # Служебные значения: например, каким control.xlsx был после последней выгрузки
+            self.conn.execute('CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT)')
+        if version < 3:
+            self.conn.execute(f'ALTER TABLE control ADD COLUMN {quote(CASTING_COLUMN)} TEXT')
+            for table in ROLLUP_TABLES.values():
+                self.conn.execute(f'CREATE TABLE IF NOT EXISTS {table} (\n'
+                                  'period TEXT, casting TEXT, "column" TEXT, count INTEGER,\n'
+                                  'PRIMARY KEY (period, casting, "column")) WITHOUT ROWID')
+            if version:
+                # Записи, сделанные до появления сводов
+                self.fill_rollups()
+        if version < 4:
+            # Вычисляемая колонка не хранится в строке, место занимает только индекс
+            self.conn.execute(f'ALTER TABLE control ADD COLUMN {quote(SEASON_COLUMN)} TEXT '
+                              f'GENERATED ALWAYS AS ({SEASON_SQL}) VIRTUAL')
+            self.conn.execute(f'CREATE INDEX IF NOT EXISTS control_сезон '
+                              f'ON control ({quote(SEASON_COLUMN)}, "Номер_плавки")')
+        if version < 5:
+            # old и new без типа: количество остается числом, дата и фамилия - текстом
+            self.conn.execute(f'CREATE TABLE IF NOT EXISTS {AUDIT_TABLE} (\n'
+                              'id INTEGER PRIMARY KEY AUTOINCREMENT, record_id INTEGER, "Номер_плавки" TEXT,\n'
+                              'changed_at TEXT, station TEXT, "column" TEXT, old, new)')
+            self.conn.execute(f'CREATE INDEX IF NOT EXISTS {AUDIT_TABLE}_record ON {AUDIT_TABLE} (record_id)')
+            for action in ('UPDATE', 'DELETE'):
+                self.conn.execute(f'CREATE TRIGGER IF NOT EXISTS {AUDIT_TABLE}_no_{action.lower()} '
+                                  f'BEFORE {action} ON {AUDIT_TABLE} '
+                                  "BEGIN SELECT RAISE(ABORT, 'Журнал исправлений только дополняется'); END")
+        if version < SCHEMA_VERSION:
+            self.conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+        return version == 0
+
+    def get_meta(self, key):
+        row = self.conn.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key, value):
+        self.conn.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def last_correction(self):
+        """Последнее исправление записей (control_audit только дописывается, поэтому номер растет)"""
+        return self.conn.execute(f'SELECT COALESCE(MAX(id), 0) FROM {AUDIT_TABLE}').fetchone()[0]
+
+    def set_meta_if_uncorrected(self, key, value, correction):
+        """set_meta, если после исправления correction (last_correction) записи не исправляли
+
+        Одним запросом, поэтому исправление не вклинится между проверкой и
+        записью. Возвращает, записано ли значение.
+        """
+        cursor = self.conn.execute(
+            f'INSERT OR REPLACE INTO meta (key, value) SELECT ?, ? '
+            f'WHERE (SELECT COALESCE(MAX(id), 0) FROM {AUDIT_TABLE}) = ?', (key, value, correction)
+        )
+        return cursor.rowcount > 0
+
+    def remember_xlsx(self, xlsx_path=XLSX_PATH):
+        """Запоминает состояние control.xlsx, который сейчас совпадает с журналом"""
+        self.set_meta('xlsx_signature', repr(file_signature(xlsx_path)))
+
+    def is_used(self, number):
+        cursor = self.conn.execute('SELECT 1 FROM control WHERE "Номер_плавки" = ? LIMIT 1', (number,))
+        return cursor.fetchone() is not None
+
+    @metrics.timed('journal.append')
+    def append(self, values, casting=None):
+        """Дописывает одну проверку (и ее вклад в своды) в отдельной транзакции, возвращает id записи
+
+        Если плавку уже сохранили (в том числе с другой станции), выбрасывает HeatAlreadyUsed.
+        """
+        row = normalize_row(values)
+        with self.lock, self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            if self.is_used(row[0]):
+                raise HeatAlreadyUsed(row[0])
+            cursor = self.conn.execute(self.insert_sql, row + [casting])
+            self.add_to_rollups(rollup_items(row, casting))
+        return cursor.lastrowid
+
+    def save(self, record):
+        return self.append(record.to_row(), casting=record.наименование_отливки)
+
+    def save_many(self, records):
+        records = list(records)
+        castings = {record.номер_плавки: record.наименование_отливки for record in records}
+        return self.append_many([record.to_row() for record in records], castings)
+
+    def find(self, number):
+        """Запись по номеру плавки (по индексу): (id, строка в порядке HEADERS, отливка) или None"""
+        columns = ', '.join(quote(h) for h in HEADERS)
+        row = self.conn.execute(
+            f'SELECT id, {columns}, {quote(CASTING_COLUMN)} FROM control '
+            'WHERE "Номер_плавки" = ? ORDER BY id LIMIT 1', (number,)
+        ).fetchone()
+        if row is None:
+            return None
+        return row[0], list(row[1:-1]), row[-1]
+
+    @metrics.timed('journal.correct')
+    def correct(self, record_id, record, station=None):
+        """Исправляет сохраненную запись record_id; возвращает исправления [(колонка, было, стало)]
+
+        Номер плавки не меняется. Своды поправляются на разницу, исправления
+        дописываются в control_audit, а выгрузка помечается устаревшей.
+        """
+        row = normalize_row(record.to_row())
+        columns = ', '.join(quote(h) for h in HEADERS)
+        with self.lock, self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            found = self.conn.execute(
+                f'SELECT {columns}, {quote(CASTING_COLUMN)}, {quote(SEASON_COLUMN)} FROM control WHERE id = ?',
+                (record_id,)
+            ).fetchone()
+            if found is None:
+                raise ValueError(f"Записи {record_id} нет в журнале")
+            old, casting, season = list(found[:-2]), found[-2], found[-1]
+            if row[0] != old[0]:
+                raise ValueError(f"Номер плавки в исправлении менять нельзя: {old[0]} -> {row[0]}")
+            # В перенесенных записях нули записаны явно, а форма отдает пусто - это не исправление
+            changes = [(header, before, after) for header, before, after in zip(HEADERS, old, row)
+                       if _blank(before) != _blank(after)]
+            if not changes:
+                return changes
+            assignments = ', '.join(f'{quote(header)} = ?' for header, _, _ in changes)
+            self.conn.execute(f'UPDATE control SET {assignments} WHERE id = ?',
+                              [after for _, _, after in changes] + [record_id])
+            totals = Counter()
+            for key, value in rollup_items(old, casting):
+                totals[key] -= value
+            for key, value in rollup_items(row, casting):
+                totals[key] += value
+            self.add_to_rollups((key, value) for key, value in totals.items() if value)
+            changed_at = datetime.now().isoformat(timespec='seconds')
+            station = station or platform.node()
+            self.conn.executemany(
+                f'INSERT INTO {AUDIT_TABLE} (record_id, "Номер_плавки", changed_at, station, "column", old, new) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?)',
+                [(record_id, row[0], changed_at, station, header, before, after) for header, before, after in changes],
+            )
+            # control.xlsx (или архив сезона записи) перепишется при следующей выгрузке
+            self.set_meta('exported_id', str(min(self.exported_id(), record_id - 1)))
+            archived = self.get_meta(f'archive_{season}')
+            if archived is not None:
+                self.set_meta(f'archive_{season}', str(min(int(archived), record_id - 1)))
+        return changes
+
+    def corrections(self, record_id):
+        """Исправления записи: (когда, станция, колонка, было, стало) по порядку"""
+        return self.conn.execute(
+            f'SELECT changed_at, station, "column", old, new FROM {AUDIT_TABLE} '
+            'WHERE record_id = ? ORDER BY id', (record_id,)
+        ).fetchall()
+
+    @metrics.timed('journal.append_many')
+    def append_many(self, rows, castings=None):
+        """Дописывает пачку проверок одной транзакцией (castings - номер плавки -> отливка)
+
+        Плавки, по которым запись уже есть, пропускаются; возвращается список их номеров.
+        """
+        skipped = []
+        totals = Counter()
+        with self.lock, self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            for row in rows:
+                row = normalize_row(row)
+                if self.is_used(row[0]):
+                    skipped.append(row[0])
+                    continue
+                casting = castings.get(row[0]) if castings else None
+                self.conn.execute(self.insert_sql, row + [casting])
+                for key, value in rollup_items(row, casting):
+                    totals[key] += value
+            self.add_to_rollups(totals.items())
+        return skipped
+
+    def add_to_rollups(self, items):
+        """Прибавляет количества к сводам (вызывается внутри транзакции записи)"""
+        by_table = {}
+        for (table, period, casting, column), value in items:
+            by_table.setdefault(table, []).append((period, casting, column, value))
+        for table, values in by_table.items():
+            self.conn.executemany(
+                f'INSERT INTO {table} (period, casting, "column", count) VALUES (?, ?, ?, ?) '
+                'ON CONFLICT (period, casting, "column") DO UPDATE SET count = count + excluded.count',
+                values,
+            )
+
+    def fill_rollups(self):
+        """Строит своды заново за один проход по журналу (внутри транзакции)"""
+        columns = ', '.join(quote(h) for h in HEADERS)
+        totals = Counter()
+        for row in self.conn.execute(f'SELECT {columns}, {quote(CASTING_COLUMN)} FROM control'):
+            for key, value in rollup_items(list(row[:-1]), row[-1]):
+                totals[key] += value
+        for table in ROLLUP_TABLES.values():
+            self.conn.execute(f'DELETE FROM {table}')
+        self.add_to_rollups(totals.items())
+
+    def missing_castings(self):
+        """Есть ли записи без отливки (перенесенные из control.xlsx и не дополненные по реестру)"""
+        return self.conn.execute(
+            f'SELECT 1 FROM control WHERE {quote(CASTING_COLUMN)} IS NULL LIMIT 1').fetchone() is not None
+
+    def fill_castings(self, castings):
+        """Дополняет отливку у записей без нее (перенесенных из control.xlsx) по castings: номер плавки -> отливка
+
+        Возвращает, сколько записей дополнено.
+        """
+        numbers = [number for (number,) in self.conn.execute(
+            f'SELECT DISTINCT "Номер_плавки" FROM control WHERE {quote(CASTING_COLUMN)} IS NULL'
+        ) if number in castings]
+        self.conn.executemany(
+            f'UPDATE control SET {quote(CASTING_COLUMN)} = ? '
+            f'WHERE "Номер_плавки" = ? AND {quote(CASTING_COLUMN)} IS NULL',
+            ((castings[number], number) for number in numbers),
+        )
+        return len(numbers)
+
+    def rebuild_rollups(self, castings=None):
+        """Пересчитывает своды; castings (номер плавки -> отливка) дополняет записи без отливки"""
+        with self.lock, self.conn:
+            self.conn.execute('BEGIN IMMEDIATE')
+            if castings:
+                self.fill_castings(castings)
+            self.fill_rollups()
+
+    def rollups(self, period='month', date_from=None, date_to=None):
+        """Строки сводов (период, отливка, колонка, количество) за даты ГГГГ-ММ-ДД включительно"""
+        length = 10 if period == 'day' else 7
+        query = f'SELECT period, casting, "column", count FROM {ROLLUP_TABLES[period]} WHERE 1'
+        params = []
+        if date_from:
+            query += ' AND period >= ?'
+            params.append(date_from[:length])
+        if date_to:
+            query += ' AND period <= ?'
+            params.append(date_to[:length])
+        return self.conn.execute(query, params)
+
+    def used_numbers(self, seasons=None):
+        """Множество номеров плавок, по которым уже есть запись контроля (только сезонов seasons, если заданы)"""
+        where, params = season_filter(seasons)
+        cursor = self.conn.execute(f'SELECT DISTINCT "Номер_плавки" FROM control{where}', params)
+        return {str(number) for (number,) in cursor if number is not None}
+
+    @metrics.timed('journal.used_numbers')
+    def used_numbers_with_xlsx(self, xlsx_path=XLSX_PATH, seasons=None):
+        """Использованные номера из журнала и из control.xlsx, если его меняли в обход журнала
+
+        Пока на части станций стоит старая версия формы, они пишут прямо в
+        control.xlsx - такие плавки тоже считаются занятыми.
+        """
+        used = self.used_numbers(seasons)
+        if os.path.exists(xlsx_path) and self.get_meta('xlsx_signature') != repr(file_signature(xlsx_path)):
+            numbers = read_used_numbers_xlsx(xlsx_path)
+            if seasons is not None:
+                numbers = {number for number in numbers if season_of(number) in seasons}
+            used |= numbers
+        return used
+
+    def last_id(self):
+        return self.conn.execute('SELECT COALESCE(MAX(id), 0) FROM control').fetchone()[0]
+
+    @metrics.timed('journal.numbers_since')
+    def numbers_since(self, last_id):
+        """Номера плавок из записей новее last_id; возвращает (новый last_id, номера)"""
+        rows = self.conn.execute(
+            'SELECT id, "Номер_плавки" FROM control WHERE id > ? ORDER BY id', (last_id,)
+        ).fetchall()
+        if rows:
+            last_id = rows[-1][0]
+        return last_id, [str(number) for _, number in rows if number is not None]
+
+    def data_version(self):
+        """Меняется, когда в журнал что-то записало другое подключение (другая станция)"""
+        return self.conn.execute('PRAGMA data_version').fetchone()[0]
+
+    def count(self):
+        return self.conn.execute('SELECT COUNT(*) FROM control').fetchone()[0]
+
+    def rows(self, upto=None, seasons=None):
+        """Записи журнала (до id upto включительно, сезонов seasons) в порядке добавления, колонками как в HEADERS"""
+        where, params = season_filter(seasons)
+        if upto is not None:
+            where += ' AND id <= ?' if where else ' WHERE id <= ?'
+            params.append(upto)
+        return self.conn.execute(self.select_sql.replace(' ORDER BY', where + ' ORDER BY'), params)
+
+    def report_rows(self, date_from=None, date_to=None, casting=None, inspector=None, castings=None):
+        """Записи для отчета в порядке добавления, колонками как в HEADERS
+
+        Период - даты ГГГГ-ММ-ДД включительно, отливка и контролер - по
+        вхождению без учета регистра, как в analytics.py. У записей без
+        отливки (перенесенных из control.xlsx) она берется из реестра
+        castings (номер плавки -> отливка). Записи читаются из базы по
+        одной, по мере выгрузки.
+        """
+        columns = ', '.join(quote(h) for h in HEADERS)
+        query = f'SELECT {columns}, {quote(CASTING_COLUMN)} FROM control WHERE 1'
+        params = []
+        if date_from:
+            query += f' AND {quote(DATE_COLUMN)} >= ?'
+            params.append(date_from)
+        if date_to:
+            query += f' AND {quote(DATE_COLUMN)} <= ?'
+            params.append(date_to)
+        # lower() в SQLite не знает кириллицы, поэтому текст сравнивается здесь
+        casting = casting.casefold() if casting else None
+        inspector = inspector.casefold() if inspector else None
+        inspectors = [HEADERS.index('Контролер1'), HEADERS.index('Контролер2')]
+        for row in self.conn.execute(query + ' ORDER BY id', params):
+            if casting:
+                name = row[-1] or (castings.get(row[0]) if castings else None)
+                if casting not in (name or '').casefold():
+                    continue
+            if inspector and not any(inspector in (row[i] or '').casefold() for i in inspectors):
+                continue
+            yield row[:-1]
+
+    @metrics.timed('journal.export_report')
+    def export_report(self, path, date_from=None, date_to=None, casting=None, inspector=None, castings=None):
+        """Выгружает отобранные записи (см. report_rows) в отдельную книгу path; возвращает их число"""
+        return write_xlsx(path, self.report_rows(date_from, date_to, casting, inspector, castings))
+
+    def exported_id(self):
+        """Последняя запись журнала, которая уже есть в control.xlsx"""
+        return int(self.get_meta('exported_id') or 0)
+
+    def pending_export(self, seasons=None):
+        """Есть ли записи, которые еще не попали в control.xlsx (или сменились активные сезоны)"""
+        return (self.last_id() > self.exported_id()
+                or (self.get_meta('exported_seasons') or '*') != seasons_key(seasons))
+
+    @metrics.timed('journal.export_xlsx')
+    def export_xlsx(self, path=XLSX_PATH, seasons=None):
+        """Выгружает журнал в control.xlsx через временный файл
+
+        Если заданы активные сезоны seasons, в control.xlsx попадают только
+        они, а закрытые сезоны - в свои архивы (export_archives). Записи,
+        дописанные в control.xlsx в обход журнала, сначала переносятся в
+        журнал (import_foreign_xlsx), иначе подмена книги их бы стерла.
+        """
+        with FileLock(path + '.lock'):
+            self.import_foreign_xlsx(path)
+            # Выгружаем записи, которые были в журнале на момент начала выгрузки.
+            # Исправление, сделанное во время выгрузки, понижает exported_id (см. correct) -
+            # тогда отметка не поднимается и исправленная запись выгрузится в следующий раз
+            correction = self.last_correction()
+            upto = self.last_id()
+            write_xlsx(path, self.rows(upto, seasons))
+            self.remember_xlsx(path)
+            self.set_meta_if_uncorrected('exported_id', str(upto), correction)
+            self.set_meta('exported_seasons', seasons_key(seasons))
+        if seasons is not None:
+            self.export_archives(path, seasons, upto, correction)
+
+    def import_foreign_xlsx(self, xlsx_path=XLSX_PATH):
+        """Дописывает в журнал записи, которые старые станции добавили прямо в control.xlsx
+
+        Книга читается, только если она изменилась после нашей выгрузки
+        (xlsx_signature). Переносятся записи по плавкам, которых в журнале
+        еще нет; правки уже выгруженных строк не переносятся. Возвращает
+        число перенесенных записей.
+        """
+        if not os.path.exists(xlsx_path) or self.get_meta('xlsx_signature') == repr(file_signature(xlsx_path)):
+            return 0
+        rows = [row for row in read_xlsx_rows(xlsx_path) if not self.is_used(row[0])]
+        if not rows:
+            return 0
+        return len(rows) - len(self.append_many(rows))
+
+    def export_archives(self, path, seasons, upto, correction):
+        """Переписывает архивы закрытых сезонов, в которые добавились записи после прошлой выгрузки
+
+        correction - last_correction до начала выгрузки, как в export_xlsx.
+        """
+        cursor = self.conn.execute(f'SELECT {quote(SEASON_COLUMN)}, MAX(id) FROM control '
+                                   f'WHERE id <= ? GROUP BY {quote(SEASON_COLUMN)}', (upto,))
+        for season, last_id in cursor.fetchall():
+            if season in seasons or last_id <= int(self.get_meta(f'archive_{season}') or 0):
+                continue
+            archive = archive_path(path, season)
+            with FileLock(archive + '.lock'):
+                write_xlsx(archive, self.rows(upto, [season]))
+                self.set_meta_if_uncorrected(f'archive_{season}', str(last_id), correction)
+
+    def close(self):
+        self.conn.close()
+
+
+def season_filter(seasons):
+    """Условие WHERE по колонке Сезон (по индексу) и его параметры; пустое, если сезоны не заданы"""
+    if seasons is None:
+        return '', []
+    seasons = list(seasons)
+    placeholders = ', '.join('?' for _ in seasons)
+    return f' WHERE {quote(SEASON_COLUMN)} IN ({placeholders})', seasons
+
+
+def seasons_key(seasons):
+    """Сезоны выгрузки для meta: '24,25' или '*' - все"""
+    return '*' if seasons is None else ','.join(sorted(seasons))
+
+
+def archive_path(path, season):
+    """Архив закрытого сезона рядом с выгрузкой: control.xlsx -> control_24.xlsx"""
+    base, ext = os.path.splitext(path)
+    return f'{base}_{season or "без_года"}{ext}'
+
+
+def write_xlsx(path, rows):
+    """Записывает книгу журнала (заголовок HEADERS и строки rows) на место path через временный файл
+
+    Книга пишется потоково (write_only): строки берутся из rows по одной и
+    сразу уходят в файл, поэтому память не растет вместе с журналом.
+    Возвращает число записанных строк.
+    """
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    from openpyxl.styles import NamedStyle
+    from openpyxl.utils import get_column_letter
+
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    date_col = HEADERS.index(DATE_COLUMN)
+    # Формат даты задается один раз - колонке (для строк, которые допишут в Excel)
+    # и именованному стилю книги, который получают все даты выгрузки
+    ws.column_dimensions[get_column_letter(date_col + 1)].number_format = DATE_FORMAT
+    wb.add_named_style(NamedStyle(name=DATE_STYLE, number_format=DATE_FORMAT))
+    ws.append(HEADERS)
+    count = 0
+    for row in rows:
+        row = list(row)
+        cell = row[date_col] = WriteOnlyCell(ws, from_iso_date(row[date_col]))
+        cell.style = DATE_STYLE
+        ws.append(row)
+        count += 1
+    # Старый файл подменяется только целиком записанным новым
+    # (две станции не подменяют его одновременно - замок у вызывающего)
+    tmp_path = path + '.tmp'
+    wb.save(tmp_path)
+    # Файл должен оказаться на диске до подмены, иначе при отключении питания
+    # после os.replace книга может остаться пустой
+    with open(tmp_path, 'rb+') as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+    return count
+
+
+def read_xlsx_rows(path=XLSX_PATH):
+    """Построчно читает записи из control.xlsx (без заголовка и пустых строк)"""
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path, read_only=True)
+    try:
+        ws = wb.active
+        for row in ws.iter_rows(min_row=2, max_col=len(HEADERS), values_only=True):
+            if any(value is not None for value in row):
+                yield normalize_row(row)
+    finally:
+        wb.close()
+
+
+@metrics.timed('control_xlsx.read_numbers')
+def read_used_numbers_xlsx(path=XLSX_PATH):
+    """Номера плавок из колонки A control.xlsx.
+
+    Книга читается потоково (read_only) и только первая колонка, поэтому
+    память не растет вместе с журналом.
+    """
+    from openpyxl import load_workbook
+
+    wb = load_workbook(path, read_only=True)
+    try:
+        ws = wb.active
+        return {
+            str(number)
+            for (number,) in ws.iter_rows(min_row=2, max_col=1, values_only=True)
+            if number is not None
+        }
+    finally:
+        wb.close()
+
+
+def read_castings(plavka_path=PLAVKA_PATH):
+    """Номер плавки -> наименование отливки из реестра (при повторе номера - первая строка); {} без реестра
+
+    Плавка без наименования в реестре есть, но отливка у нее '' (как в сводах).
+    """
+    from plavka_cache import load_plavka
+
+    try:
+        plavka = load_plavka(plavka_path)
+    except FileNotFoundError:
+        return {}
+    castings = {}
+    for number, casting in zip(plavka['Учетный_номер'].astype(str), plavka['Наименование_отливки']):
+        if number not in castings:
+            castings[number] = str(casting) if casting == casting else ''  # NaN - отливка не указана
+    return castings
+
+
+def open_journal(path=DB_PATH, xlsx_path=XLSX_PATH, plavka_path=PLAVKA_PATH):
+    """Открывает журнал; при первом запуске переносит в него записи из control.xlsx и архивов сезонов
+
+    У перенесенных записей нет отливки - она берется из реестра плавок
+    (один раз, см. meta castings_filled), иначе своды и отчеты по отливкам
+    отнесли бы всю историю к "нет в реестре".
+    """
+    journal = ControlJournal(path)
+    # Создание схемы и перенос старых записей - одна транзакция:
+    # если что-то пойдет не так, при следующем запуске перенос повторится
+    with journal.conn:
+        journal.conn.execute('BEGIN IMMEDIATE')
+        migrated = journal.create_schema() and os.path.exists(xlsx_path)
+        if migrated:
+            for path in sorted(glob.glob(archive_path(glob.escape(xlsx_path), '*'))) + [xlsx_path]:
+                journal.conn.executemany(journal.insert_sql, (row + [None] for row in read_xlsx_rows(path)))
+            journal.remember_xlsx(xlsx_path)
+            journal.set_meta('exported_id', str(journal.last_id()))
+        filled = False
+        if journal.get_meta('castings_filled') is None and journal.missing_castings():
+            castings = read_castings(plavka_path)
+            # Без реестра попробуем в следующий раз
+            if castings:
+                filled = journal.fill_castings(castings) > 0
+                journal.set_meta('castings_filled', '1')
+        if migrated or filled:
+            journal.fill_rollups()
+    return journal
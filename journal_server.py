@@ -0,0 +1,445 @@
+"""Служба журнала: один процесс пишет control.db, формы сохраняют через нее.
+
+    python journal_server.py [--host 127.0.0.1] [--port 8765] [--db control.db] [--plavka plavka.xlsx]
+
+Формы (kontrol.py, если в kontrol.ini задан server = хост:порт) и другие
+клиенты подключаются по TCP (по умолчанию только с этой же машины) и
+обмениваются строками JSON. Запрос - {"id": 1, "op": ..., ...}, ответ -
+{"id": 1, "ok": true, ...} или {"id": 1, "ok": false, "error": "..."}:
+
+    heats                   доступные плавки активных сезонов: [[номер, отливка], ...]
+    casting  number         наименование отливки плавки (null, если ее нет в списке)
+    used                    номера плавок активных сезонов, по которым есть запись
+    submit   row, casting   запись контроля (строка в порядке HEADERS);
+                            "used": true - по плавке уже есть запись
+    find     number         сохраненная запись плавки: [id, строка, отливка] или null
+    correct  record_id, row, station
+                            исправить запись; "changes": [[колонка, было, стало], ...]
+    corrections  record_id  исправления записи: [[когда, станция, колонка, было, стало], ...]
+    subscribe               присылать этому клиенту события
+
+События приходят подписчикам строками без id:
+
+    {"event": "used", "numbers": [...]}                 плавки сохранены (кем угодно)
+    {"event": "heats", "updated": {...}, "removed": [...]}  изменился plavka.xlsx
+
+Записи, пришедшие почти одновременно, пишутся одной транзакцией (через
+BATCH_DELAY секунд после первой), control.xlsx после записей и
+исправлений выгружает тот же ExportWriter, что и в форме (формы со
+службой сами его не выгружают). Записи, сделанные в обход службы
+(bulk_import.py, формы без службы), служба замечает по PRAGMA data_version
+и тоже рассылает.
+
+С базой работает один поток записи (подключение открыто в нем же):
+ожидание замка control.db.lock, пока пишет другая станция, задерживает
+только записи, а не ответы на heats, casting и события.
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import platform
+import signal
+import socket
+import sys
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+from config import active_seasons
+from core import ControlRecord, ControlStorage, HeatAlreadyUsed
+from export_writer import ExportWriter
+from heat_register import HeatRegister
+from journal import DB_PATH, XLSX_PATH, ControlJournal, open_journal
+from perf import metrics
+from plavka_cache import file_signature, load_plavka
+from schema import HEADERS
+from validation import RecordValidator, errors_of
+
+DEFAULT_PORT = 8765
+
+# Сколько собирать записи в одну транзакцию, секунд
+BATCH_DELAY = 0.05
+
+# Как часто проверять записи в обход службы и изменения plavka.xlsx, секунд
+WATCH_INTERVAL = 1.0
+
+# Сколько клиент ждет подключения и ответа, секунд
+CONNECT_TIMEOUT = 5
+REQUEST_TIMEOUT = 30
+
+# Список плавок в ответе heats - одна длинная строка
+LINE_LIMIT = 64 * 1024 * 1024
+
+
+def encode(message):
+    return json.dumps(message, ensure_ascii=False).encode('utf-8') + b'\n'
+
+
+class JournalServer:
+    """Владелец журнала: принимает записи от клиентов и рассылает изменения"""
+
+    def __init__(self, db_path=DB_PATH, plavka_path='plavka.xlsx', xlsx_path=XLSX_PATH, seasons=None):
+        self.db_path = db_path
+        self.plavka_path = plavka_path
+        self.seasons = seasons or active_seasons()
+        # Все обращения к журналу - через этот поток (sqlite3 не дает делить подключение между потоками)
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='JournalWriter')
+        self.journal = self.writer.submit(open_journal, db_path, xlsx_path, plavka_path).result()
+        self.export_writer = ExportWriter(db_path, xlsx_path, seasons=self.seasons)
+        self.register = HeatRegister()  # Доступные плавки
+        self.plavka_signature = None  # Состояние plavka.xlsx, по которому построен список
+        self.journal_version = None
+        self.last_seen_id = 0  # Последняя запись журнала, учтенная в списке
+        self.subscribers = set()
+        self.batch = []  # (строка, отливка, future) до записи
+        # Правила записи из validation.py; занятость плавки проверяет сама запись в журнал
+        self.validator = RecordValidator()
+
+    def load_heats(self):
+        """Доступные плавки из реестра и журнала (в потоке исполнителя, со своим подключением к базе)"""
+        df_plavka = load_plavka(self.plavka_path, self.seasons)
+        journal = ControlJournal(self.db_path)
+        try:
+            used_numbers = journal.used_numbers_with_xlsx(seasons=self.seasons)
+        finally:
+            journal.close()
+        return HeatRegister.from_plavka(df_plavka, used_numbers, self.seasons)
+
+    def run(self, func, *args):
+        """func(*args) в потоке записи; результат ждут через await"""
+        return asyncio.get_running_loop().run_in_executor(self.writer, func, *args)
+
+    async def serve(self, host='127.0.0.1', port=DEFAULT_PORT):
+        loop = asyncio.get_running_loop()
+        self.export_writer.start()
+        if await self.run(self.journal.pending_export, self.seasons):
+            self.export_writer.schedule(0)
+        # Записи, сделанные пока читается реестр, уберет первая проверка sync_used
+        self.journal_version = await self.run(self.journal.data_version)
+        self.last_seen_id = await self.run(self.journal.last_id)
+        self.plavka_signature = file_signature(self.plavka_path)
+        self.register = await loop.run_in_executor(None, self.load_heats)
+        server = await asyncio.start_server(self.handle, host, port, limit=LINE_LIMIT)
+        print(f"Служба журнала: {host}:{port}, доступно плавок: {len(self.register)}", file=sys.stderr)
+        async with server:
+            await asyncio.gather(server.serve_forever(), self.watch())
+
+    def close(self):
+        self.export_writer.stop(timeout=30)
+        self.writer.submit(self.journal.close).result()
+        self.writer.shutdown()
+
+    async def handle(self, reader, writer):
+        # Запросы одного клиента обрабатываются параллельно: пачка отправленных
+        # подряд записей попадает в одну транзакцию, ответы сопоставляются по id
+        tasks = set()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                task = asyncio.create_task(self.respond(line, writer))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self.subscribers.discard(writer)
+            if tasks:
+                await asyncio.wait(tasks)
+            writer.close()
+
+    async def respond(self, line, writer):
+        request = {}
+        try:
+            request = json.loads(line)
+            response = await self.answer(request, writer)
+        except Exception as e:
+            response = {'ok': False, 'error': str(e)}
+        response['id'] = request.get('id') if isinstance(request, dict) else None
+        if not writer.is_closing():
+            writer.write(encode(response))
+
+    async def answer(self, request, writer):
+        op = request.get('op')
+        if op == 'heats':
+            return {'ok': True, 'heats': [list(item) for item in self.register.items()]}
+        if op == 'casting':
+            return {'ok': True, 'casting': self.register.casting(str(request['number']))}
+        if op == 'used':
+            return {'ok': True, 'numbers': sorted(await self.run(self.journal.used_numbers, self.seasons))}
+        if op == 'submit':
+            row = request['row']
+            self.check_row(row)
+            if await self.submit(row, request.get('casting')):
+                return {'ok': True}
+            return {'ok': False, 'used': True, 'error': str(HeatAlreadyUsed(row[0]))}
+        if op == 'find':
+            found = await self.run(self.journal.find, str(request['number']))
+            return {'ok': True, 'record': list(found) if found else None}
+        if op == 'correct':
+            row = request['row']
+            record = self.check_row(row)
+            changes = await self.run(self.journal.correct, int(request['record_id']), record, request.get('station'))
+            if changes:
+                self.export_writer.schedule()
+            return {'ok': True, 'changes': [list(change) for change in changes]}
+        if op == 'corrections':
+            corrections = await self.run(self.journal.corrections, int(request['record_id']))
+            return {'ok': True, 'corrections': [list(item) for item in corrections]}
+        if op == 'subscribe':
+            self.subscribers.add(writer)
+            return {'ok': True}
+        raise ValueError(f"Неизвестная операция: {op!r}")
+
+    def check_row(self, row):
+        """Запись из строки клиента; ValueError - запись не проходит правила записи"""
+        if len(row) != len(HEADERS):
+            raise ValueError(f"В записи должно быть {len(HEADERS)} колонок, а не {len(row)}")
+        record = ControlRecord.from_row(row)
+        errors = errors_of(self.validator.validate(record, row[2], check_heat=False))
+        if errors:
+            raise ValueError("; ".join(errors))
+        return record
+
+    def submit(self, row, casting):
+        """Ставит запись в очередь; future - True, если записана, False - плавка уже занята"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.batch.append((row, casting, future))
+        if len(self.batch) == 1:
+            loop.call_later(BATCH_DELAY, lambda: asyncio.ensure_future(self.flush()))
+        return future
+
+    @metrics.timed('server.flush')
+    def write_batch(self, rows, castings):
+        return self.journal.append_many(rows, castings)
+
+    async def flush(self):
+        """Пишет накопленные записи одной транзакцией и отвечает их отправителям
+
+        Пока пачка пишется, следующие записи копятся в новую пачку; поток
+        записи один, поэтому пачки ложатся в журнал по очереди.
+        """
+        batch, self.batch = self.batch, []
+        rows = [row for row, _, _ in batch]
+        try:
+            skipped = Counter(await self.run(self.write_batch, rows,
+                                             {row[0]: casting for row, casting, _ in batch}))
+        except Exception as e:
+            for _, _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        # Из повторов одной плавки в пачке записывается первый
+        remaining = Counter(str(row[0]) for row in rows)
+        saved = []
+        for row, _, future in batch:
+            number = str(row[0])
+            ok = remaining[number] > skipped[number]
+            remaining[number] -= 1
+            if ok:
+                saved.append(number)
+            if not future.done():
+                future.set_result(ok)
+        if saved:
+            for number in saved:
+                self.register.remove(number)
+            self.export_writer.schedule()
+            self.broadcast({'event': 'used', 'numbers': saved})
+
+    def broadcast(self, message):
+        data = encode(message)
+        for writer in list(self.subscribers):
+            if writer.is_closing():
+                self.subscribers.discard(writer)
+            else:
+                writer.write(data)
+
+    async def watch(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(WATCH_INTERVAL)
+            await self.sync_used()
+            signature = file_signature(self.plavka_path)
+            if signature is None or signature == self.plavka_signature:
+                continue
+            self.plavka_signature = signature
+            try:
+                fresh = await loop.run_in_executor(None, self.load_heats)
+            except Exception as e:
+                # Файл могли поймать недописанным - следующее изменение перечитает его снова
+                print(f"Ошибка при перечитывании {self.plavka_path}: {str(e)}", file=sys.stderr)
+                continue
+            updated, removed = self.register.changes(fresh)
+            # Плавки, сохраненные пока читался реестр, уже заняты
+            used = await self.run(self.used_of, list(updated))
+            updated = {number: casting for number, casting in updated.items() if number not in used}
+            for number in removed:
+                self.register.remove(number)
+            self.register.update_many(updated)
+            if updated or removed:
+                self.broadcast({'event': 'heats', 'updated': updated, 'removed': removed})
+
+    def used_of(self, numbers):
+        return {number for number in numbers if self.journal.is_used(number)}
+
+    def changes_since(self, version, last_id):
+        """(data_version, last_id, номера) - номера None, если в обход службы ничего не писали"""
+        fresh = self.journal.data_version()
+        if fresh == version:
+            return version, last_id, None
+        return (fresh, *self.journal.numbers_since(last_id))
+
+    async def sync_used(self):
+        """Рассылает плавки, сохраненные в обход службы (свои записи data_version не меняют)"""
+        self.journal_version, self.last_seen_id, numbers = await self.run(
+            self.changes_since, self.journal_version, self.last_seen_id)
+        if numbers is None:
+            return
+        numbers = [number for number in numbers if self.register.remove(number)]
+        if numbers:
+            self.broadcast({'event': 'used', 'numbers': numbers})
+
+
+class JournalClient(ControlStorage):
+    """Подключение к службе журнала; on_event(событие) вызывается из потока чтения
+
+    При обрыве связи ожидающие запросы получают ConnectionError, а
+    on_event - событие {"event": "closed"}. После close() on_event больше
+    не вызывается (его владелец, например форма, может быть уже удален).
+    """
+
+    def __init__(self, address, on_event=None, timeout=REQUEST_TIMEOUT):
+        self.sock = socket.create_connection(address, timeout=CONNECT_TIMEOUT)
+        self.sock.settimeout(None)
+        self.on_event = on_event
+        self.timeout = timeout
+        self.ids = itertools.count(1)
+        self.pending = {}  # id запроса -> [Event, ответ]
+        self.send_lock = threading.Lock()
+        self.reader = threading.Thread(target=self.read_loop, name='JournalClient', daemon=True)
+        self.reader.start()
+
+    def send(self, op, **params):
+        request_id = next(self.ids)
+        waiter = self.pending[request_id] = [threading.Event(), None]
+        with self.send_lock:
+            self.sock.sendall(encode({'id': request_id, 'op': op, **params}))
+        return waiter
+
+    def wait(self, waiter):
+        if not waiter[0].wait(self.timeout):
+            raise TimeoutError("Служба журнала не отвечает")
+        response = waiter[1]
+        if response is None:
+            raise ConnectionError("Нет связи со службой журнала")
+        return response
+
+    def call(self, op, **params):
+        response = self.wait(self.send(op, **params))
+        if not response.get('ok') and not response.get('used'):
+            raise ValueError(response.get('error'))
+        return response
+
+    def read_loop(self):
+        try:
+            for line in self.sock.makefile('rb'):
+                message = json.loads(line)
+                if 'event' in message:
+                    on_event = self.on_event
+                    if on_event:
+                        on_event(message)
+                    continue
+                waiter = self.pending.pop(message.get('id'), None)
+                if waiter:
+                    waiter[1] = message
+                    waiter[0].set()
+        except (OSError, ValueError):
+            pass
+        finally:
+            for waiter in list(self.pending.values()):
+                waiter[0].set()
+            self.pending.clear()
+            on_event = self.on_event
+            if on_event:
+                on_event({'event': 'closed'})
+
+    def heats(self):
+        """Доступные плавки: [(номер, наименование отливки), ...] по возрастанию номера"""
+        return [tuple(item) for item in self.call('heats')['heats']]
+
+    def casting(self, number):
+        return self.call('casting', number=number)['casting']
+
+    def used_numbers(self):
+        return set(self.call('used')['numbers'])
+
+    def subscribe(self):
+        self.call('subscribe')
+
+    def save(self, record):
+        response = self.call('submit', row=record.to_row(), casting=record.наименование_отливки)
+        if response.get('used'):
+            raise HeatAlreadyUsed(record.номер_плавки)
+
+    def save_many(self, records):
+        # Все записи отправляются сразу и попадают в одну-две транзакции службы
+        records = list(records)
+        waiters = [self.send('submit', row=record.to_row(), casting=record.наименование_отливки)
+                   for record in records]
+        skipped = []
+        for record, waiter in zip(records, waiters):
+            response = self.wait(waiter)
+            if response.get('used'):
+                skipped.append(record.номер_плавки)
+            elif not response.get('ok'):
+                raise ValueError(response.get('error'))
+        return skipped
+
+    def find(self, number):
+        """Запись по номеру плавки: (id, строка в порядке HEADERS, отливка) или None"""
+        found = self.call('find', number=number)['record']
+        return tuple(found) if found else None
+
+    def correct(self, record_id, record, station=None):
+        """Исправляет запись через службу; исправления [(колонка, было, стало)]"""
+        response = self.call('correct', record_id=record_id, row=record.to_row(),
+                             station=station or platform.node())
+        return [tuple(change) for change in response['changes']]
+
+    def corrections(self, record_id):
+        return [tuple(item) for item in self.call('corrections', record_id=record_id)['corrections']]
+
+    def close(self):
+        self.on_event = None
+        try:
+            self.sock.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.sock.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Служба журнала контроля")
+    parser.add_argument('--host', default='127.0.0.1', help="адрес (0.0.0.0 - принимать и с других машин)")
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--db', default=DB_PATH, help="журнал контроля (по умолчанию control.db)")
+    parser.add_argument('--plavka', default='plavka.xlsx', help="реестр плавок")
+    args = parser.parse_args(argv)
+
+    server = JournalServer(args.db, args.plavka)
+    # Остановка службы (kill, systemd) - как Ctrl+C: control.xlsx выгружается перед выходом
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        asyncio.run(server.serve(args.host, args.port))
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        server.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,15 +1,209 @@
 import sys
-import pandas as pd
+from perf import metrics, startup
+startup.begin('импорт')
 from PySide6.QtWidgets import (
     QApplication, QWidget, QVBoxLayout, QFormLayout, QLineEdit,
-    QDateEdit, QPushButton, QMessageBox, QGroupBox, QLabel, QScrollArea, QComboBox, QHBoxLayout, QGraphicsDropShadowEffect
+    QDateEdit, QPushButton, QMessageBox, QGroupBox, QLabel, QScrollArea, QComboBox, QHBoxLayout, QGraphicsDropShadowEffect,
+    QInputDialog
+)
+from PySide6.QtCore import (
+    QDate, Qt, QPropertyAnimation, QEasingCurve, QEvent, QTimer,
+    QObject, QRunnable, QThreadPool, Signal, QFileSystemWatcher
 )
-from PySide6.QtCore import QDate, Qt, QPropertyAnimation, QEasingCurve, QEvent
 from PySide6 import QtGui
-from PySide6.QtGui import QFont, QColor
+from PySide6.QtGui import QFont, QColor, QKeySequence, QShortcut, QValidator
 import os
-from openpyxl import load_workbook, Workbook
 from datetime import datetime, timedelta
+from plavka_cache import file_signature, load_plavka
+from journal import DB_PATH, ControlJournal, open_journal, read_castings
+from export_writer import ExportWriter
+from config import active_seasons, server_address
+from heat_picker import HeatPicker
+from schema import CATEGORIES, DEFECTS
+from heat_register import HeatRegister
+from core import DEFECT_SLOTS, ControlRecord, HeatAlreadyUsed, calculate_prinato, parse_count
+from journal_server import JournalClient
+from validation import RecordValidator, errors_of, output_ranges, warnings_of
+startup.end('импорт')
+
+# Как часто проверять, не сохранили ли плавки другие станции
+SYNC_INTERVAL_MS = 3000
+
+# Сколько ждать после изменения plavka.xlsx: Excel записывает файл в несколько приемов
+PLAVKA_SETTLE_MS = 1000
+
+# Наибольшее количество штук, которое можно ввести в числовое поле
+MAX_COUNT = 99999
+
+# Пересчет "Принято" откладывается, пока оператор печатает или вставляет текст
+RECALC_DELAY_MS = 100
+
+# Цвета заголовков блоков дефектов
+CATEGORY_COLORS = {
+    'второй_сорт': '#50fa7b',
+    'доработка': '#ffb86c',
+    'окончательный_брак': '#ff5555',
+}
+
+
+class CountValidator(QValidator):
+    """Пропускает в поле количества только цифры (не больше MAX_COUNT).
+
+    Из вставленного текста лишние символы убираются, а правка, которая
+    не добавляет ни одной цифры (нажатие не цифровой клавиши, в том числе
+    поверх выделения), отклоняется - текст поля не меняется и textChanged
+    не срабатывает.
+    """
+
+    def __init__(self, field):
+        super().__init__(field)
+        # Во время validate field.text() уже новый, поэтому прежний текст запоминается отдельно
+        self.previous = field.text()
+        field.textChanged.connect(self.remember)
+
+    def remember(self, text):
+        self.previous = text
+
+    def validate(self, text, pos):
+        digits = ''.join(c for c in text if '0' <= c <= '9')
+        if digits != text:
+            # Вставленная часть - то, что отличается от прежнего текста в середине
+            start = len(os.path.commonprefix([text, self.previous]))
+            end = len(os.path.commonprefix([text[start:][::-1], self.previous[start:][::-1]]))
+            if not any('0' <= c <= '9' for c in text[start:len(text) - end]):
+                return QValidator.Invalid, text, pos
+            pos -= sum(1 for c in text[:pos] if not '0' <= c <= '9')
+        if digits and int(digits) > MAX_COUNT:
+            return QValidator.Invalid, text, pos
+        return QValidator.Acceptable, digits, pos
+
+
+class ExportSignals(QObject):
+    """Переносит сообщения фоновой выгрузки control.xlsx в GUI-поток"""
+    flushed = Signal(object)  # None или ошибка выгрузки
+
+
+class ServerSignals(QObject):
+    """Переносит события службы журнала из потока чтения в GUI-поток"""
+    event = Signal(object)
+
+
+class JournalOpenerSignals(QObject):
+    """Сигналы фоновой подготовки журнала"""
+    opened = Signal()
+    failed = Signal(str)
+
+
+class JournalOpener(QRunnable):
+    """Готовит control.db вне GUI-потока: при первом запуске перенос control.xlsx и архивов, отливки из реестра
+
+    Подключение к базе привязано к потоку, поэтому здесь оно закрывается,
+    а форма после сигнала opened открывает журнал заново (уже без переноса).
+    """
+
+    def __init__(self, path):
+        super().__init__()
+        self.path = path
+        self.signals = JournalOpenerSignals()
+
+    def run(self):
+        try:
+            open_journal(self.path).close()
+            self.signals.opened.emit()
+        except Exception as e:
+            self.signals.failed.emit(str(e))
+
+
+class PlavkaLoaderSignals(QObject):
+    """Сигналы фоновой загрузки номеров плавок (первый аргумент - номер загрузки)"""
+    chunk = Signal(int, object, object)  # порция номеров и их наименования отливок
+    finished = Signal(int, object, object)  # использованные номера, обычные диапазоны "Отлито"
+    failed = Signal(int, str)
+
+
+class PlavkaRefreshSignals(QObject):
+    """Сигналы фонового перечитывания реестра (первый аргумент - номер загрузки)"""
+    finished = Signal(int, object)  # (новые/измененные, убранные)
+    failed = Signal(int, str)
+
+
+class PlavkaRefresher(QRunnable):
+    """Перечитывает измененный plavka.xlsx вне GUI-потока и сравнивает с реестром формы"""
+
+    def __init__(self, generation, plavka_path, seasons, register, used_numbers):
+        super().__init__()
+        self.generation = generation
+        self.plavka_path = plavka_path
+        self.seasons = seasons
+        self.register = register  # Копия реестра формы на момент запуска
+        self.used_numbers = used_numbers
+        self.signals = PlavkaRefreshSignals()
+
+    def run(self):
+        try:
+            fresh = HeatRegister.from_plavka(load_plavka(self.plavka_path, self.seasons),
+                                             self.used_numbers, self.seasons)
+            self.signals.finished.emit(self.generation, self.register.changes(fresh))
+        except Exception as e:
+            self.signals.failed.emit(self.generation, str(e))
+
+
+class PlavkaLoader(QRunnable):
+    """Читает plavka.xlsx и журнал (или список службы журнала) вне GUI-потока и отдает номера плавок порциями"""
+
+    CHUNK_SIZE = 2000
+
+    def __init__(self, generation, plavka_path, journal_path, seasons, server=None):
+        super().__init__()
+        self.generation = generation
+        self.plavka_path = plavka_path
+        self.journal_path = journal_path
+        self.seasons = seasons
+        self.server = server
+        self.signals = PlavkaLoaderSignals()
+
+    def run(self):
+        try:
+            # Обычные диапазоны "Отлито" по отливкам для проверки записей (validation.py)
+            # считаются по журналу и со службой журнала (у потока свое подключение к базе)
+            journal = ControlJournal(self.journal_path)
+            try:
+                # Записи без отливки (перенесенные из control.xlsx) учитываются по реестру
+                castings = read_castings(self.plavka_path) if journal.missing_castings() else None
+                ranges = output_ranges(journal, castings)
+                if self.server is None:
+                    # Получение списка уже использованных номеров плавок из журнала
+                    used_numbers = journal.used_numbers_with_xlsx(seasons=self.seasons)
+            finally:
+                journal.close()
+
+            if self.server is not None:
+                # Служба журнала сама держит список доступных плавок
+                heats = self.server.heats()
+                for start in range(0, len(heats), self.CHUNK_SIZE):
+                    numbers, castings = zip(*heats[start:start + self.CHUNK_SIZE])
+                    self.signals.chunk.emit(self.generation, list(numbers), list(castings))
+                self.signals.finished.emit(self.generation, set(), ranges)
+                return
+
+            # Загрузка данных из plavka.xlsx (через кэш, XLSX разбирается только после изменения файла);
+            # из кэша читаются только активные сезоны
+            df_plavka = load_plavka(self.plavka_path, self.seasons)
+            # Плавки активных сезонов без записи контроля, по возрастанию номера;
+            # из реестра остаются только номер и наименование отливки
+            register = HeatRegister.from_plavka(df_plavka, used_numbers, self.seasons)
+            del df_plavka
+
+            # Отдаем номера и наименования порциями, чтобы список заполнялся постепенно;
+            # по возрастанию номера каждая порция дописывается в конец списка
+            castings = [register.castings[code] for code in register.codes]
+            for start in range(0, len(register), self.CHUNK_SIZE):
+                end = start + self.CHUNK_SIZE
+                self.signals.chunk.emit(self.generation, register.numbers[start:end], castings[start:end])
+            self.signals.finished.emit(self.generation, used_numbers, ranges)
+        except Exception as e:
+            self.signals.failed.emit(self.generation, str(e))
+
 
 class ControlForm(QWidget):
     def __init__(self):
@@ -126,9 +320,39 @@ class ControlForm(QWidget):
         form_layout1.setSpacing(3)
         form_layout1.setContentsMargins(5, 5, 5, 5)
         
-        # Выпадающий список для номера плавки
-        self.номер_плавки_input = QComboBox(self)
-        self.load_plavka_numbers()
+        # Журнал контроля (control.db), control.xlsx - только выгрузка из него.
+        # Открывается после фоновой подготовки (JournalOpener), до этого форма недоступна
+        self.journal = None
+        self.closed = False
+        # Активные сезоны из kontrol.ini: в списке и в control.xlsx только их плавки
+        self.seasons = active_seasons()
+
+        # Служба журнала (journal_server.py), если она задана в kontrol.ini: записи
+        # сохраняются через нее, а занятые и новые плавки она присылает сама
+        self.server = None
+        self.server_signals = ServerSignals(self)
+        self.server_signals.event.connect(self.on_server_event)
+        self.connect_server()
+
+        # Строка состояния внизу формы (загрузка, количество доступных плавок)
+        self.status_label = QLabel(self)
+        self.load_generation = 0  # Номер текущей фоновой загрузки номеров плавок
+
+        # Выпадающий список для номера плавки с поиском по началу номера
+        self.номер_плавки_input = HeatPicker(self)
+        self.plavka_index = HeatRegister()  # Доступные плавки: номер -> наименование отливки
+        self.used_numbers = set()  # Номера плавок, по которым уже есть запись в журнале
+        # Правила проверки записи перед сохранением (validation.py) - по тем же занятым номерам
+        self.validator = RecordValidator(self.used_numbers)
+        self.plavka_signature = None  # Состояние plavka.xlsx на момент загрузки
+        self.control_signature = None  # Состояние control.xlsx на момент загрузки
+        self.journal_version = None  # Версия журнала на момент загрузки
+        self.last_seen_id = 0  # Последняя запись журнала, учтенная в списке плавок
+        # Идет полная загрузка номеров (первая начнется, когда будет готов журнал)
+        self.plavka_loading = True
+        self.plavka_refreshing = False  # Идет перечитывание измененного реестра
+        self.номер_плавки_input.setPlaceholderText("Загрузка...")
+        self.status_label.setText("Подготовка журнала...")
         
         # Добавляем поле для отображения наименования отливки (только для чтения)
         self.наименование_отливки_input = QLineEdit(self)
@@ -198,130 +422,32 @@ class ControlForm(QWidget):
         
         group_box1.setLayout(form_layout1)
 
-        # Блок 2: Второй сорт
-        group_box2 = QGroupBox("Второй сорт")
-        group_box2.setStyleSheet("""
-            QGroupBox::title {
-                color: #50fa7b;
-            }
-        """)
-        form_layout2 = QFormLayout()
-        form_layout2.setSpacing(3)
-        form_layout2.setContentsMargins(5, 5, 5, 5)
-        
-        self.второй_сорт_раковины_input = QLineEdit(self)
-        self.второй_сорт_зарез_input = QLineEdit(self)
-
-        form_layout2.addRow(QLabel("Раковины:"), self.второй_сорт_раковины_input)
-        form_layout2.addRow(QLabel("Зарез:"), self.второй_сорт_зарез_input)
+        # Блоки 2-4: дефекты по категориям, поля строятся по схеме из schema.py
+        self.defect_inputs = {}  # Ключ поля дефекта -> поле ввода
+        defect_groups = {}
+        defect_layouts = {}
+        for category in CATEGORIES:
+            group_box = QGroupBox(category.title)
+            group_box.setStyleSheet(f"""
+                QGroupBox::title {{
+                    color: {CATEGORY_COLORS[category.key]};
+                }}
+            """)
+            form_layout = QFormLayout()
+            form_layout.setSpacing(3)
+            form_layout.setContentsMargins(5, 5, 5, 5)
+            group_box.setLayout(form_layout)
+            defect_groups[category.key] = group_box
+            defect_layouts[category.key] = form_layout
 
-        group_box2.setLayout(form_layout2)
+        for field in DEFECTS:
+            input_field = QLineEdit(self)
+            defect_layouts[field.category].addRow(QLabel(f"{field.label}:"), input_field)
+            self.defect_inputs[field.key] = input_field
 
-        # Блок 3: Доработка
-        group_box3 = QGroupBox("Доработка")
-        group_box3.setStyleSheet("""
-            QGroupBox::title {
-                color: #ffb86c;
-            }
-        """)
-        form_layout3 = QFormLayout()
-        form_layout3.setSpacing(3)
-        form_layout3.setContentsMargins(5, 5, 5, 5)
-        
-        self.доработка_раковины_input = QLineEdit(self)
-        self.доработка_зарез_input = QLineEdit(self)
-        self.доработка_несоответствие_размеров_input = QLineEdit(self)
-        self.доработка_несоответствие_внешнего_вида_input = QLineEdit(self)
-        self.доработка_наплыв_металла_input = QLineEdit(self)
-        self.доработка_прорыв_металла_input = QLineEdit(self)
-        self.доработка_вырыв_input = QLineEdit(self)
-        self.доработка_облой_input = QLineEdit(self)
-        self.доработка_песок_на_поверхности_input = QLineEdit(self)
-        self.доработка_песок_в_резьбе_input = QLineEdit(self)
-        self.доработка_клей_input = QLineEdit(self)
-        self.доработка_коробление_input = QLineEdit(self)
-        self.доработка_дефект_пеномодели_input = QLineEdit(self)
-        self.доработка_лапы_input = QLineEdit(self)
-        self.доработка_питатель_input = QLineEdit(self)
-        self.доработка_корона_input = QLineEdit(self)
-        self.доработка_смещение_input = QLineEdit(self)
-
-        form_layout3.addRow(QLabel("Раковины:"), self.доработка_раковины_input)
-        form_layout3.addRow(QLabel("Зарез:"), self.доработка_зарез_input)
-        form_layout3.addRow(QLabel("Несоответствие размеров:"), self.доработка_несоответствие_размеров_input)
-        form_layout3.addRow(QLabel("Несоответствие внешнего вида:"), self.доработка_несоответствие_внешнего_вида_input)
-        form_layout3.addRow(QLabel("Наплыв металла:"), self.доработка_наплыв_металла_input)
-        form_layout3.addRow(QLabel("Прорыв металла:"), self.доработка_прорыв_металла_input)
-        form_layout3.addRow(QLabel("Вырыв:"), self.доработка_вырыв_input)
-        form_layout3.addRow(QLabel("Облой:"), self.доработка_облой_input)
-        form_layout3.addRow(QLabel("Песок на поверхности:"), self.доработка_песок_на_поверхности_input)
-        form_layout3.addRow(QLabel("Песок в резьбе:"), self.доработка_песок_в_резьбе_input)
-        form_layout3.addRow(QLabel("Клей:"), self.доработка_клей_input)
-        form_layout3.addRow(QLabel("Коробление:"), self.доработка_коробление_input)
-        form_layout3.addRow(QLabel("Дефект пеномодели:"), self.доработка_дефект_пеномодели_input)
-        form_layout3.addRow(QLabel("Лапы:"), self.доработка_лапы_input)
-        form_layout3.addRow(QLabel("Питатель:"), self.доработка_питатель_input)
-        form_layout3.addRow(QLabel("Корона:"), self.доработка_корона_input)
-        form_layout3.addRow(QLabel("Смещение:"), self.доработка_смещение_input)
-
-        group_box3.setLayout(form_layout3)
-
-        # Блок 4: Окончательный брак
-        group_box4 = QGroupBox("Окончательный брак")
-        group_box4.setStyleSheet("""
-            QGroupBox::title {
-                color: #ff5555;
-            }
-        """)
-        form_layout4 = QFormLayout()
-        form_layout4.setSpacing(3)
-        form_layout4.setContentsMargins(5, 5, 5, 5)
-        
-        self.окончательный_брак_недолив_input = QLineEdit(self)
-        self.окончательный_брак_раковины_input = QLineEdit(self)
-        self.окончательный_брак_коробление_input = QLineEdit(self)
-        self.окончательный_брак_спай_input = QLineEdit(self)
-        self.окончательный_брак_трещины_input = QLineEdit(self)
-        self.окончательный_брак_пригар_песка_input = QLineEdit(self)
-        self.окончательный_брак_пористость_input = QLineEdit(self)
-        self.окончательный_брак_вырыв_input = QLineEdit(self)
-        self.окончательный_брак_скол_input = QLineEdit(self)
-        self.окончательный_брак_слом_input = QLineEdit(self)
-        self.окончательный_брак_зарез_input = QLineEdit(self)
-        self.окончательный_брак_нарушение_геометрии_input = QLineEdit(self)
-        self.окончательный_брак_рыхлота_input = QLineEdit(self)
-        self.окончательный_брак_непроклей_input = QLineEdit(self)
-        self.окончательный_брак_пеномодель_input = QLineEdit(self)
-        self.окончательный_брак_наплыв_металла_input = QLineEdit(self)
-        self.окончательный_брак_несоответствие_размеров_input = QLineEdit(self)
-        self.окончательный_брак_несоответствие_внешнего_вида_input = QLineEdit(self)
-        self.окончательный_брак_нарушение_маркировки_input = QLineEdit(self)
-        self.окончательный_брак_неслитина_input = QLineEdit(self)
-        self.окончательный_брак_прочее_input = QLineEdit(self)
-
-        form_layout4.addRow(QLabel("Недолив:"), self.окончательный_брак_недолив_input)
-        form_layout4.addRow(QLabel("Раковины:"), self.окончательный_брак_раковины_input)
-        form_layout4.addRow(QLabel("Коробление:"), self.окончательный_брак_коробление_input)
-        form_layout4.addRow(QLabel("Спай:"), self.окончательный_брак_спай_input)
-        form_layout4.addRow(QLabel("Трещины:"), self.окончательный_брак_трещины_input)
-        form_layout4.addRow(QLabel("Пригар песка:"), self.окончательный_брак_пригар_песка_input)
-        form_layout4.addRow(QLabel("Пористость:"), self.окончательный_брак_пористость_input)
-        form_layout4.addRow(QLabel("Вырыв:"), self.окончательный_брак_вырыв_input)
-        form_layout4.addRow(QLabel("Скол:"), self.окончательный_брак_скол_input)
-        form_layout4.addRow(QLabel("Слом:"), self.окончательный_брак_слом_input)
-        form_layout4.addRow(QLabel("Зарез:"), self.окончательный_брак_зарез_input)
-        form_layout4.addRow(QLabel("Нарушение геометрии:"), self.окончательный_брак_нарушение_геометрии_input)
-        form_layout4.addRow(QLabel("Рыхлота:"), self.окончательный_брак_рыхлота_input)
-        form_layout4.addRow(QLabel("Непроклей:"), self.окончательный_брак_непроклей_input)
-        form_layout4.addRow(QLabel("Пеномодель:"), self.окончательный_брак_пеномодель_input)
-        form_layout4.addRow(QLabel("Наплыв металла:"), self.окончательный_брак_наплыв_металла_input)
-        form_layout4.addRow(QLabel("Несоответствие размеров:"), self.окончательный_брак_несоответствие_размеров_input)
-        form_layout4.addRow(QLabel("Несоответствие внешнего вида:"), self.окончательный_брак_несоответствие_внешнего_вида_input)
-        form_layout4.addRow(QLabel("Нарушение маркировки:"), self.окончательный_брак_нарушение_маркировки_input)
-        form_layout4.addRow(QLabel("Неслитина:"), self.окончательный_брак_неслитина_input)
-        form_layout4.addRow(QLabel("Прочее:"), self.окончательный_брак_прочее_input)
-
-        group_box4.setLayout(form_layout4)
+        group_box2 = defect_groups['второй_сорт']
+        group_box3 = defect_groups['доработка']
+        group_box4 = defect_groups['окончательный_брак']
 
         # Создаем горизонтальные layout для группировки полей
         h_layout = QHBoxLayout()
@@ -344,6 +470,8 @@ class ControlForm(QWidget):
         scroll_area.setWidget(scroll_widget)
         layout.addWidget(scroll_area)
 
+        layout.addWidget(self.status_label)
+
         # Кнопка для сохранения данных
         self.save_button = QPushButton("Сохранить", self)
 
@@ -370,358 +498,466 @@ class ControlForm(QWidget):
         # Добавление кнопки в layout
         layout.addWidget(self.save_button)
 
+        # Исправление сохраненной записи: плавка загружается обратно в форму
+        self.editing_id = None  # id исправляемой записи журнала или None
+        self.correct_button = QPushButton("Исправить запись", self)
+        self.correct_button.clicked.connect(self.toggle_correction)
+        layout.addWidget(self.correct_button)
+
+        # control.xlsx обновляется в фоне после сохранений; кнопка - выгрузить сейчас
+        self.export_button = QPushButton("Выгрузить в control.xlsx", self)
+        self.export_button.clicked.connect(self.export_control_xlsx)
+        layout.addWidget(self.export_button)
+
+        # Парето дефектов и доли брака по журналу
+        self.analytics_button = QPushButton("Аналитика", self)
+        self.analytics_button.clicked.connect(self.show_analytics)
+        layout.addWidget(self.analytics_button)
+        self.analytics_view = None
+
+        # Скрытая панель диагностики: замеры горячих мест (perf.metrics)
+        self.diagnostics_view = None
+        QShortcut(QKeySequence("Ctrl+Shift+D"), self, self.show_diagnostics)
+
+        self.export_signals = ExportSignals(self)
+        self.export_signals.flushed.connect(self.on_export_flushed)
+        self.export_requested = False  # Выгрузку запросили кнопкой - сообщить о результате
+        # Со службой журнала control.xlsx выгружает она; своя выгрузка - только без нее
+        # (запускается, когда готов журнал)
+        self.export_writer = None
+
+        # Плавки, сохраненные на других станциях, убираются из списка без перезапуска
+        self.sync_timer = QTimer(self)
+        self.sync_timer.timeout.connect(self.sync_used_numbers)
+
+        # Новые плавки из plavka.xlsx появляются в списке без перезапуска: изменения
+        # файла ловит QFileSystemWatcher (и на всякий случай та же периодическая проверка),
+        # а в форму попадает только разница с уже загруженным списком
+        self.plavka_timer = QTimer(self)
+        self.plavka_timer.setSingleShot(True)
+        self.plavka_timer.setInterval(PLAVKA_SETTLE_MS)
+        self.plavka_timer.timeout.connect(self.refresh_plavka)
+        self.plavka_watcher = QFileSystemWatcher(self)
+        self.plavka_watcher.fileChanged.connect(self.on_plavka_file_changed)
+        self.sync_timer.timeout.connect(self.check_plavka_file)
+
         self.setLayout(layout)
 
-        # Подключение события изменения для расчета контроль_принято
-        self.контроль_отлито_input.textChanged.connect(self.calculate_control_prinato)
-        self.второй_сорт_раковины_input.textChanged.connect(self.calculate_control_prinato)
-        self.второй_сорт_зарез_input.textChanged.connect(self.calculate_control_prinato)
-        self.доработка_раковины_input.textChanged.connect(self.calculate_control_prinato)
-        self.доработка_зарез_input.textChanged.connect(self.calculate_control_prinato)
-        self.доработка_несоответствие_размеров_input.textChanged.connect(self.calculate_control_prinato)
-        self.доработка_несоответствие_внешнего_вида_input.textChanged.connect(self.calculate_control_prinato)
-        self.доработка_наплыв_металла_input.textChanged.connect(self.calculate_control_prinato)
-        self.доработка_прорыв_металла_input.textChanged.connect(self.calculate_control_prinato)
-        self.доработка_вырыв_input.textChanged.connect(self.calculate_control_prinato)
-        self.доработка_облой_input.textChanged.connect(self.calculate_control_prinato)
-        self.доработка_песок_на_поверхности_input.textChanged.connect(self.calculate_control_prinato)
-        self.доработка_песок_в_резьбе_input.textChanged.connect(self.calculate_control_prinato)
-        self.доработка_клей_input.textChanged.connect(self.calculate_control_prinato)
-        self.доработка_коробление_input.textChanged.connect(self.calculate_control_prinato)
-        self.доработка_дефект_пеномодели_input.textChanged.connect(self.calculate_control_prinato)
-        self.доработка_лапы_input.textChanged.connect(self.calculate_control_prinato)
-        self.доработка_питатель_input.textChanged.connect(self.calculate_control_prinato)
-        self.доработка_корона_input.textChanged.connect(self.calculate_control_prinato)
-        self.доработка_смещение_input.textChanged.connect(self.calculate_control_prinato)
-        self.окончательный_брак_недолив_input.textChanged.connect(self.calculate_control_prinato)
-        self.окончательный_брак_вырыв_input.textChanged.connect(self.calculate_control_prinato)
-        self.окончательный_брак_зарез_input.textChanged.connect(self.calculate_control_prinato)
-        self.окончательный_брак_коробление_input.textChanged.connect(self.calculate_control_prinato)
-        self.окончательный_брак_наплыв_металла_input.textChanged.connect(self.calculate_control_prinato)
-        self.окончательный_брак_нарушение_геометрии_input.textChanged.connect(self.calculate_control_prinato)
-        self.окончательный_брак_нарушение_маркировки_input.textChanged.connect(self.calculate_control_prinato)
-        self.окончательный_брак_непроклей_input.textChanged.connect(self.calculate_control_prinato)
-        self.окончательный_брак_неслитина_input.textChanged.connect(self.calculate_control_prinato)
-        self.окончательный_брак_несоответствие_внешнего_вида_input.textChanged.connect(self.calculate_control_prinato)
-        self.окончательный_брак_несоответствие_размеров_input.textChanged.connect(self.calculate_control_prinato)
-        self.окончательный_брак_пеномодель_input.textChanged.connect(self.calculate_control_prinato)
-        self.окончательный_брак_пористость_input.textChanged.connect(self.calculate_control_prinato)
-        self.окончательный_брак_пригар_песка_input.textChanged.connect(self.calculate_control_prinato)
-        self.окончательный_брак_прочее_input.textChanged.connect(self.calculate_control_prinato)
-        self.окончательный_брак_рыхлота_input.textChanged.connect(self.calculate_control_prinato)
-        self.окончательный_брак_раковины_input.textChanged.connect(self.calculate_control_prinato)
-        self.окончательный_брак_скол_input.textChanged.connect(self.calculate_control_prinato)
-        self.окончательный_брак_слом_input.textChanged.connect(self.calculate_control_prinato)
-        self.окончательный_брак_спай_input.textChanged.connect(self.calculate_control_prinato)
-        self.окончательный_брак_трещины_input.textChanged.connect(self.calculate_control_prinato)
+        # Подключение события изменения для расчета контроль_принято:
+        # сумма дефектов меняется только на разницу по измененным полям,
+        # а пересчет выполняется один раз после серии нажатий
+        self.defect_values = dict.fromkeys(self.defect_inputs, 0)
+        self.defect_total = 0
+        self.invalid_defects = set()  # Поля, в которых сейчас не число
+        self.changed_defects = set()  # Поля, измененные с последнего пересчета
+        self.recalc_timer = QTimer(self)
+        self.recalc_timer.setSingleShot(True)
+        self.recalc_timer.setInterval(RECALC_DELAY_MS)
+        self.recalc_timer.timeout.connect(self.calculate_control_prinato)
+        self.контроль_отлито_input.textChanged.connect(lambda text: self.recalc_timer.start())
+        for key, input_field in self.defect_inputs.items():
+            input_field.textChanged.connect(
+                lambda text, key=key: self.schedule_recalc(key)
+            )
+        
+        # Тени и анимация групп добавляются после первой отрисовки окна (setup_effects)
+        self.groups = [group_box1, group_box2, group_box3, group_box4]
+        self.effects_ready = False
+
+        # Добавляем валидацию для числовых полей
+        numeric_inputs = [self.контроль_отлито_input] + list(self.defect_inputs.values())
         
+        for input_field in numeric_inputs:
+            input_field.setValidator(CountValidator(input_field))
+
+        # Подключаем обработчик изменения номера плавки
+        self.номер_плавки_input.currentTextChanged.connect(self.update_наименование_отливки)
+
+        # Перенос старых записей при первом запуске и заполнение отливок читают
+        # XLSX и реестр - это делается вне GUI-потока, а форма пока недоступна
+        self.setEnabled(False)
+        startup.begin('подготовка журнала')
+        opener = JournalOpener(DB_PATH)
+        opener.signals.opened.connect(self.on_journal_opened)
+        opener.signals.failed.connect(self.on_journal_failed)
+        QThreadPool.globalInstance().start(opener)
+
+    def on_journal_opened(self):
+        startup.end('подготовка журнала')
+        if self.closed:
+            return
+        self.journal = ControlJournal(DB_PATH)
+        self.setEnabled(True)
+        if self.server is None:
+            self.start_export_writer()
+            self.start_local_sync()
+        self.load_plavka_numbers()
+
+    def on_journal_failed(self, message):
+        startup.end('подготовка журнала')
+        self.plavka_loading = False
+        self.номер_плавки_input.setPlaceholderText("")
+        self.status_label.setText("")
+        if not self.closed:
+            QMessageBox.critical(self, "Ошибка", f"Не удалось открыть журнал control.db: {message}")
+
+    @metrics.timed('form.paint')
+    def paintEvent(self, event):
+        super().paintEvent(event)
+        if not self.effects_ready:
+            self.effects_ready = True
+            startup.end('первая отрисовка')
+            QTimer.singleShot(0, self.setup_effects)
+
+    def setup_effects(self):
+        """Тени и анимация групп - не нужны для первого показа окна, поэтому отложены"""
         # Добавляем анимацию при наведении на группы
-        for group in [group_box1, group_box2, group_box3, group_box4]:
+        for group in self.groups:
             group.enterEvent = lambda e, g=group: self.animate_group_hover(g, True)
             group.leaveEvent = lambda e, g=group: self.animate_group_hover(g, False)
 
         # Добавляем тени для групп
-        for group in [group_box1, group_box2, group_box3, group_box4]:
+        for group in self.groups:
             shadow = QGraphicsDropShadowEffect()
             shadow.setBlurRadius(15)
             shadow.setColor(QColor(0, 0, 0, 30))
             shadow.setOffset(0, 2)
             group.setGraphicsEffect(shadow)
 
-        # Добавляем валидацию для числовых полей
-        numeric_inputs = [
-            self.контроль_отлито_input,
-            self.второй_сорт_раковины_input,
-            self.второй_сорт_зарез_input,
-            self.доработка_раковины_input,
-            self.доработка_зарез_input,
-            self.доработка_несоответствие_размеров_input,
-            self.доработка_несоответствие_внешнего_вида_input,
-            self.доработка_наплыв_металла_input,
-            self.доработка_прорыв_металла_input,
-            self.доработка_вырыв_input,
-            self.доработка_облой_input,
-            self.доработка_песок_на_поверхности_input,
-            self.доработка_песок_в_резьбе_input,
-            self.доработка_клей_input,
-            self.доработка_коробление_input,
-            self.доработка_дефект_пеномодели_input,
-            self.доработка_лапы_input,
-            self.доработка_питатель_input,
-            self.доработка_корона_input,
-            self.доработка_смещение_input,
-            self.окончательный_брак_недолив_input,
-            self.окончательный_брак_вырыв_input,
-            self.окончательный_брак_зарез_input,
-            self.окончательный_брак_коробление_input,
-            self.окончательный_брак_наплыв_металла_input,
-            self.окончательный_брак_нарушение_геометрии_input,
-            self.окончательный_брак_нарушение_маркировки_input,
-            self.окончательный_брак_непроклей_input,
-            self.окончательный_брак_неслитина_input,
-            self.окончательный_брак_несоответствие_внешнего_вида_input,
-            self.окончательный_брак_несоответствие_размеров_input,
-            self.окончательный_брак_пеномодель_input,
-            self.окончательный_брак_пористость_input,
-            self.окончательный_брак_пригар_песка_input,
-            self.окончательный_брак_прочее_input,
-            self.окончательный_брак_рыхлота_input,
-            self.окончательный_брак_раковины_input,
-            self.окончательный_брак_скол_input,
-            self.окончательный_брак_слом_input,
-            self.окончательный_брак_спай_input,
-            self.окончательный_брак_трещины_input
-        ]
-        
-        for input_field in numeric_inputs:
-            input_field.textChanged.connect(
-                lambda text, field=input_field: field.setText(''.join(filter(str.isdigit, text)))
-            )
-
-        # Подключаем обработчик изменения номера плавки
-        self.номер_плавки_input.currentTextChanged.connect(self.update_наименование_отливки)
-
     def load_plavka_numbers(self):
+        """Запускает фоновую загрузку доступных номеров плавок"""
+        # Запоминаем состояние источников, чтобы потом перечитывать их только после изменений
+        self.plavka_signature = file_signature('plavka.xlsx')
+        self.control_signature = file_signature('control.xlsx')
+        self.journal_version = self.journal.data_version()
+        self.last_seen_id = self.journal.last_id()
+        startup.begin('загрузка данных')
         if not os.path.exists('plavka.xlsx'):
+            startup.end('загрузка данных')
+            self.plavka_loading = False
+            self.номер_плавки_input.setPlaceholderText("")
+            self.status_label.setText("")
             QMessageBox.warning(self, "Ошибка", "Файл plavka.xlsx не найден")
             return
+
+        # Результаты предыдущей загрузки, если она еще идет, будут отброшены
+        self.load_generation += 1
+        self.plavka_loading = True
+        self.plavka_index = HeatRegister()
+        self.номер_плавки_input.clear_numbers()
+        self.номер_плавки_input.setPlaceholderText("Загрузка...")
+        self.status_label.setText("Загрузка номеров плавок...")
+
+        loader = PlavkaLoader(self.load_generation, 'plavka.xlsx', self.journal.path, self.seasons, self.server)
+        loader.signals.chunk.connect(self.on_plavka_chunk)
+        loader.signals.finished.connect(self.on_plavka_loaded)
+        loader.signals.failed.connect(self.on_plavka_failed)
+        QThreadPool.globalInstance().start(loader)
+
+    @metrics.timed('form.add_chunk')
+    def on_plavka_chunk(self, generation, numbers, castings):
+        """Добавляет очередную порцию номеров в реестр формы и комбобокс"""
+        if generation != self.load_generation:
+            return
+        available_numbers = []
+        for number, casting in zip(numbers, castings):
+            # Плавки, сохраненные пока шла загрузка, уже заняты
+            if number in self.used_numbers:
+                continue
+            self.plavka_index.add(number, casting)
+            available_numbers.append(number)
+        self.номер_плавки_input.add_numbers(available_numbers)
+
+    def on_plavka_loaded(self, generation, used_numbers, ranges):
+        if generation != self.load_generation:
+            return
+        self.plavka_loading = False
+        startup.end('загрузка данных')
+        self.used_numbers |= used_numbers
+        self.validator.output_ranges = ranges
+        self.номер_плавки_input.setPlaceholderText("")
+        self.update_plavka_status()
+
+    def on_plavka_failed(self, generation, message):
+        if generation != self.load_generation:
+            return
+        self.plavka_loading = False
+        startup.end('загрузка данных')
+        self.номер_плавки_input.setPlaceholderText("")
+        self.status_label.setText("")
+        QMessageBox.warning(self, "Ошибка", f"Ошибка при загрузке номеров плавок: {message}")
+
+    def update_plavka_status(self):
+        self.status_label.setText(f"Доступно номеров плавок: {len(self.plavka_index)}")
+
+    def connect_server(self):
         try:
-            # Загрузка данных из plavka.xlsx
-            self.df_plavka = pd.read_excel('plavka.xlsx')  # Сохраняем DataFrame как атрибут класса
-            
-            # Фильтрация номеров, содержащих "/25"
-            self.df_plavka = self.df_plavka[self.df_plavka['Учетный_номер'].astype(str).str.contains('/25')]
-            
-            # Загрузка данных из control.xlsx, если файл существует
-            try:
-                df_control = pd.read_excel('control.xlsx')
-                # Получение списка уже использованных номеров плавок
-                used_numbers = df_control['Номер_плавки'].astype(str).unique()
-                # Фильтрация, исключая использованные номера
-                self.df_plavka = self.df_plavka[~self.df_plavka['Учетный_номер'].astype(str).isin(used_numbers)]
-            except FileNotFoundError:
-                pass
-            
-            # Добавление отфильтрованных номеров в комбобокс
-            available_numbers = self.df_plavka['Учетный_номер'].astype(str).tolist()
-            self.номер_плавки_input.addItems(available_numbers)
-            
-            QMessageBox.information(self, "Информация", 
-                                  f"Доступно номеров плавок: {len(available_numbers)}")
-            
-        except Exception as e:
-            QMessageBox.warning(self, "Ошибка", f"Ошибка при загрузке номеров плавок: {str(e)}")
+            address = server_address()
+            if address is None:
+                return
+            self.server = JournalClient(address, on_event=self.server_signals.event.emit)
+            self.server.subscribe()
+        except (OSError, ValueError) as e:
+            server, self.server = self.server, None
+            if server is not None:
+                server.close()
+            print(f"Служба журнала недоступна, записи сохраняются прямо в control.db: {str(e)}")
+
+    def start_export_writer(self):
+        self.export_writer = ExportWriter(
+            self.journal.path, on_flushed=self.export_signals.flushed.emit, seasons=self.seasons
+        )
+        self.export_writer.start()
+        if self.journal.pending_export(self.seasons):
+            # Записи, не попавшие в control.xlsx в прошлый раз (сбой, выключение)
+            self.export_writer.schedule(0)
+
+    def start_local_sync(self):
+        """Без службы журнала форма сама следит за журналом и plavka.xlsx"""
+        self.watch_plavka()
+        self.sync_timer.start(SYNC_INTERVAL_MS)
+
+    def on_server_event(self, message):
+        event = message.get('event')
+        if self.server is None:
+            return
+        if event == 'used':
+            self.numbers_used_elsewhere(message['numbers'])
+        elif event == 'heats':
+            if self.journal is None:
+                # Полная загрузка номеров начнется, когда будет готов журнал
+                return
+            if self.plavka_loading:
+                # Список еще приходит порциями - проще взять его у службы заново
+                self.load_plavka_numbers()
+            else:
+                self.apply_plavka_changes((message['updated'], message['removed']))
+        elif event == 'closed':
+            self.server = None
+            # До готовности журнала это сделает on_journal_opened
+            if self.journal is not None:
+                self.start_local_sync()
+                if self.export_writer is None:
+                    self.start_export_writer()
+            QMessageBox.warning(self, "Внимание",
+                                "Нет связи со службой журнала. Записи сохраняются прямо в control.db")
+
+    def sources_changed(self):
+        """Изменился ли control.xlsx в обход журнала с момента загрузки
+
+        Изменения plavka.xlsx применяет refresh_plavka.
+        """
+        signature = file_signature('control.xlsx')
+        if signature == self.control_signature:
+            return False
+        # Выгрузку журнала (своей формой, другой станцией или службой) журнал запоминает
+        # в xlsx_signature - из-за нее перечитывать номера не нужно
+        if self.journal.get_meta('xlsx_signature') == repr(signature):
+            self.control_signature = signature
+            return False
+        return True
+
+    def watch_plavka(self):
+        path = os.path.abspath('plavka.xlsx')
+        # Файл, подмененный целиком (так сохраняет Excel), наблюдатель теряет - добавляем заново
+        if path not in self.plavka_watcher.files() and os.path.exists(path):
+            self.plavka_watcher.addPath(path)
+
+    def on_plavka_file_changed(self, path):
+        self.watch_plavka()
+        self.plavka_timer.start()
+
+    def check_plavka_file(self):
+        """Периодическая проверка plavka.xlsx - на случай, если наблюдатель пропустил изменение"""
+        self.watch_plavka()
+        if not self.plavka_timer.isActive() and file_signature('plavka.xlsx') != self.plavka_signature:
+            self.plavka_timer.start()
+
+    def refresh_plavka(self):
+        """Перечитывает измененный plavka.xlsx в фоне; в форму попадает только разница"""
+        signature = file_signature('plavka.xlsx')
+        if signature is None or signature == self.plavka_signature:
+            return
+        if self.plavka_loading or self.plavka_refreshing:
+            # Дождемся текущей загрузки, потом сравним еще раз
+            self.plavka_timer.start()
+            return
+        self.plavka_signature = signature
+        self.plavka_refreshing = True
+        refresher = PlavkaRefresher(self.load_generation, 'plavka.xlsx', self.seasons,
+                                    self.plavka_index.copy(), set(self.used_numbers))
+        refresher.signals.finished.connect(self.on_plavka_refreshed)
+        refresher.signals.failed.connect(self.on_plavka_refresh_failed)
+        QThreadPool.globalInstance().start(refresher)
+
+    def on_plavka_refreshed(self, generation, changes):
+        self.plavka_refreshing = False
+        if generation == self.load_generation:
+            self.apply_plavka_changes(changes)
+
+    @metrics.timed('form.apply_plavka_changes')
+    def apply_plavka_changes(self, changes):
+        """Добавляет новые плавки, обновляет измененные и убирает пропавшие; введенное в форму не трогается"""
+        updated, removed = changes
+        current = self.номер_плавки_input.currentText()
+        selected = self.номер_плавки_input.currentIndex() >= 0
+        for number in removed:
+            self.plavka_index.remove(number)
+            self.номер_плавки_input.remove_number(number)
+        # Плавки, сохраненные пока шло чтение, уже заняты
+        added = self.plavka_index.update_many(
+            {number: casting for number, casting in updated.items() if number not in self.used_numbers}
+        )
+        self.номер_плавки_input.add_numbers(added)
+        self.update_plavka_status()
+        if selected and current in removed:
+            # Не даем молча переключиться на соседнюю плавку
+            self.номер_плавки_input.setCurrentIndex(-1)
+            QMessageBox.warning(self, "Внимание",
+                                f"Плавки {current} больше нет в plavka.xlsx. Выберите другой номер плавки")
+        elif selected and current in updated:
+            self.update_наименование_отливки(current)
+
+    def on_plavka_refresh_failed(self, generation, message):
+        # Файл могли поймать недописанным - следующее изменение перечитает его снова
+        self.plavka_refreshing = False
+        print(f"Ошибка при перечитывании plavka.xlsx: {message}")
 
+    @metrics.timed('form.sync')
+    def sync_used_numbers(self):
+        """Убирает из списка плавки, которые с момента загрузки сохранили другие станции"""
+        version = self.journal.data_version()
+        if version == self.journal_version:
+            return
+        self.journal_version = version
+        self.last_seen_id, numbers = self.journal.numbers_since(self.last_seen_id)
+        self.numbers_used_elsewhere(numbers)
+
+    def numbers_used_elsewhere(self, numbers):
+        """Убирает плавки, сохраненные другими станциями; если среди них выбранная - предупреждает"""
+        current = self.номер_плавки_input.currentText()
+        numbers = [number for number in numbers if number not in self.used_numbers]
+        for number in numbers:
+            self.mark_number_used(number)
+        if current and current in numbers:
+            # Не даем молча переключиться на соседнюю плавку
+            self.номер_плавки_input.setCurrentIndex(-1)
+            QMessageBox.warning(self, "Внимание",
+                                f"Плавку {current} только что сохранили на другой станции. "
+                                "Выберите другой номер плавки")
+
+    def mark_number_used(self, number):
+        """Убирает сохраненную плавку из доступных, не перечитывая реестр и журнал"""
+        self.used_numbers.add(number)
+        self.plavka_index.remove(number)
+        self.номер_плавки_input.remove_number(number)
+        self.update_plavka_status()
+
+    @metrics.timed('form.lookup')
     def update_наименование_отливки(self, selected_number):
         """Обновляет поле наименования отливки при выборе номера плавки"""
         try:
-            if selected_number and hasattr(self, 'df_plavka'):
-                # Находим соответствующее наименование в DataFrame
-                наименование = self.df_plavka[
-                    self.df_plavka['Учетный_номер'].astype(str) == selected_number
-                ]['Наименование_отливки'].iloc[0]
-                self.наименование_отливки_input.setText(str(наименование))
+            casting = self.plavka_index.casting(selected_number) if selected_number else None
+            if casting is not None:
+                self.наименование_отливки_input.setText(casting)
             else:
                 self.наименование_отливки_input.clear()
         except Exception as e:
             self.наименование_отливки_input.clear()
             print(f"Ошибка при обновлении наименования отливки: {str(e)}")
 
+    def schedule_recalc(self, key):
+        """Запоминает измененное поле дефекта и откладывает пересчет"""
+        self.changed_defects.add(key)
+        self.recalc_timer.start()
+
+    def update_defect_total(self):
+        """Меняет сумму дефектов на разницу по измененным полям"""
+        for key in self.changed_defects:
+            try:
+                value = parse_count(self.defect_inputs[key].text())
+                self.invalid_defects.discard(key)
+            except ValueError:
+                value = 0
+                self.invalid_defects.add(key)
+            self.defect_total += value - self.defect_values[key]
+            self.defect_values[key] = value
+        self.changed_defects.clear()
+
+    @metrics.timed('form.recalc')
     def calculate_control_prinato(self):
+        self.recalc_timer.stop()
+        self.update_defect_total()
         try:
-            контроль_отлито = int(self.контроль_отлито_input.text() or 0)
-            второй_сорт_раковины = int(self.второй_сорт_раковины_input.text() or 0)
-            второй_сорт_зарез = int(self.второй_сорт_зарез_input.text() or 0)
-            доработка_раковины = int(self.доработка_раковины_input.text() or 0)
-            доработка_зарез = int(self.доработка_зарез_input.text() or 0)
-            доработка_несоответствие_размеров = int(self.доработка_несоответствие_размеров_input.text() or 0)
-            доработка_несоответствие_внешнего_вида = int(self.доработка_несоответствие_внешнего_вида_input.text() or 0)
-            доработка_наплыв_металла = int(self.доработка_наплыв_металла_input.text() or 0)
-            доработка_прорыв_металла = int(self.доработка_прорыв_металла_input.text() or 0)
-            доработка_вырыв = int(self.доработка_вырыв_input.text() or 0)
-            доработка_облой = int(self.доработка_облой_input.text() or 0)
-            доработка_песок_на_поверхности = int(self.доработка_песок_на_поверхности_input.text() or 0)
-            доработка_песок_в_резьбе = int(self.доработка_песок_в_резьбе_input.text() or 0)
-            доработка_клей = int(self.доработка_клей_input.text() or 0)
-            доработка_коробление = int(self.доработка_коробление_input.text() or 0)
-            доработка_дефект_пеномодели = int(self.доработка_дефект_пеномодели_input.text() or 0)
-            доработка_лапы = int(self.доработка_лапы_input.text() or 0)
-            доработка_питатель = int(self.доработка_питатель_input.text() or 0)
-            доработка_корона = int(self.доработка_корона_input.text() or 0)
-            доработка_смещение = int(self.доработка_смещение_input.text() or 0)
-            
-            # Добавление окончательных браков в расчет
-            окончательный_брак_недолив = int(self.окончательный_брак_недолив_input.text() or 0)
-            окончательный_брак_вырыв = int(self.окончательный_брак_вырыв_input.text() or 0)
-            окончательный_брак_зарез = int(self.окончательный_брак_зарез_input.text() or 0)
-            окончательный_брак_коробление = int(self.окончательный_брак_коробление_input.text() or 0)
-            окончательный_брак_наплыв_металла = int(self.окончательный_брак_наплыв_металла_input.text() or 0)
-            окончательный_брак_нарушение_геометрии = int(self.окончательный_брак_нарушение_геометрии_input.text() or 0)
-            окончательный_брак_нарушение_маркировки = int(self.окончательный_брак_нарушение_маркировки_input.text() or 0)
-            окончательный_брак_непроклей = int(self.окончательный_брак_непроклей_input.text() or 0)
-            окончательный_брак_неслитина = int(self.окончательный_брак_неслитина_input.text() or 0)
-            окончательный_брак_несоответствие_внешнего_вида = int(self.окончательный_брак_несоответствие_внешнего_вида_input.text() or 0)
-            окончательный_брак_несоответствие_размеров = int(self.окончательный_брак_несоответствие_размеров_input.text() or 0)
-            окончательный_брак_пеномодель = int(self.окончательный_брак_пеномодель_input.text() or 0)
-            окончательный_брак_пористость = int(self.окончательный_брак_пористость_input.text() or 0)
-            окончательный_брак_пригар_песка = int(self.окончательный_брак_пригар_песка_input.text() or 0)
-            окончательный_брак_прочее = int(self.окончательный_брак_прочее_input.text() or 0)
-            окончательный_брак_рыхлота = int(self.окончательный_брак_рыхлота_input.text() or 0)
-            окончательный_брак_раковины = int(self.окончательный_брак_раковины_input.text() or 0)
-            окончательный_брак_скол = int(self.окончательный_брак_скол_input.text() or 0)
-            окончательный_брак_слом = int(self.окончательный_брак_слом_input.text() or 0)
-            окончательный_брак_спай = int(self.окончательный_брак_спай_input.text() or 0)
-            окончательный_брак_трещины = int(self.окончательный_брак_трещины_input.text() or 0)
+            контроль_отлито = parse_count(self.контроль_отлито_input.text())
+            if self.invalid_defects:
+                raise ValueError("В поле дефекта не число")
 
             # Расчет контроль_принято
-            контроль_принято = контроль_отлито - (
-                второй_сорт_раковины + второй_сорт_зарез +
-                доработка_раковины + доработка_зарез +
-                доработка_несоответствие_размеров + доработка_несоответствие_внешнего_вида +
-                доработка_наплыв_металла + доработка_прорыв_металла +
-                доработка_вырыв + доработка_облой +
-                доработка_песок_на_поверхности + доработка_песок_в_резьбе +
-                доработка_клей + доработка_коробление +
-                доработка_дефект_пеномодели + доработка_лапы +
-                доработка_питатель + доработка_корона +
-                доработка_смещение + окончательный_брак_недолив + окончательный_брак_вырыв +
-                окончательный_брак_зарез + окончательный_брак_коробление +
-                окончательный_брак_наплыв_металла + окончательный_брак_нарушение_геометрии +
-                окончательный_брак_нарушение_маркировки + окончательный_брак_непроклей +
-                окончательный_брак_неслитина + окончательный_брак_несоответствие_внешнего_вида +
-                окончательный_брак_несоответствие_размеров + окончательный_брак_пеномодель +
-                окончательный_брак_пористость + окончательный_брак_пригар_песка +
-                окончательный_брак_прочее + окончательный_брак_рыхлота +
-                окончательный_брак_раковины + окончательный_брак_скол +
-                окончательный_брак_слом + окончательный_брак_спай +
-                окончательный_брак_трещины
-            )
+            контроль_принято = calculate_prinato(контроль_отлито, self.defect_total)
             self.контроль_принято_input.setText(str(контроль_принято))
         except ValueError:
             self.контроль_принято_input.setText("")
 
+    @metrics.timed('form.save')
     def save_data(self):
+        # Если пересчет "Принято" еще ждет таймера, выполняем его сейчас
+        if self.recalc_timer.isActive():
+            self.calculate_control_prinato()
         try:
-            # Проверка обязательных полей
-            if not self.номер_плавки_input.currentText():
-                QMessageBox.warning(self, "Ошибка", "Выберите номер плавки")
+            # Проверка полей и расчет "Принято" - в core.ControlRecord
+            номер_плавки = self.номер_плавки_input.currentText()
+            try:
+                record = ControlRecord.from_form(
+                    номер_плавки,
+                    self.контроль_отлито_input.text(),
+                    self.контроль_дата_приемки_input.date().toString("dd.MM.yyyy"),
+                    self.контролер1_input.currentText(),
+                    self.контролер2_input.currentText(),
+                    {key: field.text() for key, field in self.defect_inputs.items()},
+                    self.plavka_index.casting(номер_плавки),
+                )
+            except ValueError as e:
+                QMessageBox.warning(self, "Ошибка", str(e))
+                return
+            # Правила validation.py: ошибки не дают сохранить, предупреждения - на подтверждение
+            if not self.confirm_issues(self.validator.validate(record, check_heat=self.editing_id is None)):
                 return
-                
-            if not self.контроль_отлито_input.text():
-                QMessageBox.warning(self, "Ошибка", "Укажите количество отлитых деталей")
+            if self.editing_id is not None:
+                self.save_correction(record)
                 return
-                
-            if not self.контролер1_input.currentText() and not self.контролер2_input.currentText():
-                QMessageBox.warning(self, "Ошибка", "Укажите хотя бы одного контролера")
+            # В поле номера можно напечатать что угодно - сохраняем только плавки из списка
+            if номер_плавки not in self.plavka_index:
+                QMessageBox.warning(self, "Ошибка", "Выберите номер плавки из списка")
                 return
 
-            # Собираем все данные в список
-            data = [
-                self.номер_плавки_input.currentText(),
-                self.контроль_отлито_input.text(),
-                self.контроль_принято_input.text(),
-                self.контроль_дата_приемки_input.date().toString("dd.MM.yyyy"),
-                self.контролер1_input.currentText(),
-                self.контролер2_input.currentText(),
-                self.второй_сорт_раковины_input.text(),
-                self.второй_сорт_зарез_input.text(),
-                self.доработка_раковины_input.text(),
-                self.доработка_зарез_input.text(),
-                self.доработка_несоответствие_размеров_input.text(),
-                self.доработка_несоответствие_внешнего_вида_input.text(),
-                self.доработка_наплыв_металла_input.text(),
-                self.доработка_прорыв_металла_input.text(),
-                self.доработка_вырыв_input.text(),
-                self.доработка_облой_input.text(),
-                self.доработка_песок_на_поверхности_input.text(),
-                self.доработка_песок_в_резьбе_input.text(),
-                self.доработка_клей_input.text(),
-                self.доработка_коробление_input.text(),
-                self.доработка_дефект_пеномодели_input.text(),
-                self.доработка_лапы_input.text(),
-                self.доработка_питатель_input.text(),
-                self.доработка_корона_input.text(),
-                self.доработка_смещение_input.text(),
-                self.окончательный_брак_недолив_input.text(),
-                self.окончательный_брак_вырыв_input.text(),
-                self.окончательный_брак_зарез_input.text(),
-                self.окончательный_брак_коробление_input.text(),
-                self.окончательный_брак_наплыв_металла_input.text(),
-                self.окончательный_брак_нарушение_геометрии_input.text(),
-                self.окончательный_брак_нарушение_маркировки_input.text(),
-                self.окончательный_брак_непроклей_input.text(),
-                self.окончательный_брак_неслитина_input.text(),
-                self.окончательный_брак_несоответствие_внешнего_вида_input.text(),
-                self.окончательный_брак_несоответствие_размеров_input.text(),
-                self.окончательный_брак_пеномодель_input.text(),
-                self.окончательный_брак_пористость_input.text(),
-                self.окончательный_брак_пригар_песка_input.text(),
-                self.окончательный_брак_прочее_input.text(),
-                self.окончательный_брак_рыхлота_input.text(),
-                self.окончательный_брак_раковины_input.text(),
-                self.окончательный_брак_скол_input.text(),
-                self.окончательный_брак_слом_input.text(),
-                self.окончательный_брак_спай_input.text(),
-                self.окончательный_брак_трещины_input.text()
-            ]
-
-            headers = [
-                'Номер_плавки', 'Контроль_отлито', 'Контроль_принято',
-                'Контроль_дата_приемки', 'Контролер1', 'Контролер2',
-                'Второй_сорт_раковины', 'Второй_сорт_зарез',
-                'Доработка_раковины', 'Доработка_зарез',
-                'Доработка_несоответствие_размеров', 'Доработка_несоответствие_внешнего_вида',
-                'Доработка_наплыв_металла', 'Доработка_прорыв_металла',
-                'Доработка_вырыв', 'Доработка_облой',
-                'Доработка_песок_на_поверхности', 'Доработка_песок_в_резьбе',
-                'Доработка_клей', 'Доработка_коробление',
-                'Доработка_дефект_пеномодели', 'Доработка_лапы',
-                'Доработка_питатель', 'Доработка_корона',
-                'Доработка_смещение',
-                'Окончательный_брак_недолив', 'Окончательный_брак_вырыв',
-                'Окончательный_брак_зарез', 'Окончательный_брак_коробление',
-                'Окончательный_брак_наплыв_металла', 'Окончательный_брак_нарушение_геометрии',
-                'Окончательный_брак_нарушение_маркировки', 'Окончательный_брак_непроклей',
-                'Окончательный_брак_неслитина', 'Окончательный_брак_несоответствие_внешнего_вида',
-                'Окончательный_брак_несоответствие_размеров', 'Окончательный_брак_пеномодель',
-                'Окончательный_брак_пористость', 'Окончательный_брак_пригар_песка',
-                'Окончательный_брак_прочее', 'Окончательный_брак_рыхлота',
-                'Окончательный_брак_раковины', 'Окончательный_брак_скол',
-                'Окончательный_брак_слом', 'Окончательный_брак_спай',
-                'Окончательный_брак_трещины'
-            ]
-
-            if os.path.exists('control.xlsx'):
-                wb = load_workbook('control.xlsx')
-                ws = wb.active  # Используем Sheet1
-            else:
-                wb = Workbook()
-                ws = wb.active
-                # Добавляем заголовки только если это новый файл
-                for col, header in enumerate(headers, start=1):
-                    ws.cell(row=1, column=col, value=header)
-
-            # Добавляем новую строку данных
-            next_row = ws.max_row + 1
-            for col, value in enumerate(data, start=1):
-                cell = ws.cell(row=next_row, column=col)
-                cell.value = value
-                if col == 4:  # Колонка D (дата)
-                    cell.number_format = 'DD.MM.YYYY'
-
-            # Применяем формат даты ко всем ячейкам в колонке D
-            for row in range(2, ws.max_row + 1):
-                cell = ws.cell(row=row, column=4)
-                cell.number_format = 'DD.MM.YYYY'
-
-            wb.save('control.xlsx')
-            wb.close()
+            # Одна строка журнала в одной транзакции (под замком, общим для всех станций);
+            # со службой журнала запись пишет и выгружает она
+            try:
+                (self.server or self.journal).save(record)
+            except HeatAlreadyUsed:
+                self.mark_number_used(номер_плавки)
+                self.номер_плавки_input.setCurrentIndex(-1)
+                QMessageBox.warning(self, "Ошибка",
+                                    f"Плавку {номер_плавки} уже сохранили на другой станции. "
+                                    "Выберите другой номер плавки")
+                return
+            # Своя запись - не чужое сохранение, даже если известие о ней придет раньше
+            self.used_numbers.add(номер_плавки)
+            if self.server is None:
+                self.export_writer.schedule()
 
             QMessageBox.information(self, "Успех", "Данные успешно сохранены!")
             
-            # Очищаем и обновляем список доступных номеров плавок
-            self.номер_плавки_input.clear()
-            self.load_plavka_numbers()  # Обновляем список доступных номеров
+            # Обновляем список доступных номеров плавок
+            if self.sources_changed():
+                # Реестр или control.xlsx изменились на диске - перечитываем полностью
+                self.load_plavka_numbers()
+            else:
+                # Иначе достаточно убрать только что сохраненную плавку
+                # и те, что успели сохранить другие станции
+                self.mark_number_used(номер_плавки)
+                self.sync_used_numbers()
             
             # Спрашиваем пользователя, хочет ли он очистить форму
             reply = QMessageBox.question(self, 'Очистка формы', 
@@ -735,62 +971,162 @@ class ControlForm(QWidget):
             QMessageBox.critical(self, "Ошибка", f"Ошибка при сохранении данных: {str(e)}")
         
         
+    def confirm_issues(self, issues):
+        """Показывает замечания проверки записи; True - запись можно сохранять"""
+        errors = errors_of(issues)
+        if errors:
+            QMessageBox.warning(self, "Ошибка", "\n".join(errors))
+            return False
+        warnings = warnings_of(issues)
+        if warnings:
+            reply = QMessageBox.question(self, "Проверка записи",
+                                         "\n".join(warnings) + "\n\nВсе равно сохранить запись?",
+                                         QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
+            return reply == QMessageBox.Yes
+        return True
+
+    def export_control_xlsx(self):
+        """Выгружает журнал в control.xlsx сейчас (в фоне), по кнопке"""
+        if self.export_writer is None:
+            QMessageBox.information(self, "Выгрузка", "control.xlsx выгружает служба журнала после каждой записи")
+            return
+        self.export_requested = True
+        self.status_label.setText("Выгрузка журнала в control.xlsx...")
+        self.export_writer.schedule(0, force=True)
+
+    def on_export_flushed(self, error):
+        if error is None:
+            # Это наша собственная выгрузка - перечитывать номера из-за нее не нужно
+            self.control_signature = file_signature('control.xlsx')
+        if self.export_requested:
+            self.export_requested = False
+            self.update_plavka_status()
+            if error is None:
+                QMessageBox.information(self, "Успех", "Журнал выгружен в control.xlsx")
+            else:
+                QMessageBox.warning(self, "Ошибка", f"Ошибка при выгрузке журнала: {str(error)}")
+
+    def show_analytics(self):
+        if self.analytics_view is None:
+            # pandas-аналитика нужна не при каждом запуске формы, поэтому импортируется здесь
+            from analytics_view import AnalyticsView
+            self.analytics_view = AnalyticsView(self.journal.path, self)
+        else:
+            self.analytics_view.reload()
+        self.analytics_view.show()
+        self.analytics_view.raise_()
+
+    def show_diagnostics(self):
+        if self.diagnostics_view is None:
+            from diagnostics_view import DiagnosticsView
+            self.diagnostics_view = DiagnosticsView(self)
+        self.diagnostics_view.show()
+        self.diagnostics_view.raise_()
+
+    def closeEvent(self, event):
+        server, self.server = self.server, None
+        if server is not None:
+            server.close()
+        # Записи, еще не попавшие в control.xlsx, выгружаем перед закрытием формы;
+        # если не успеем, они выгрузятся при следующем запуске
+        if self.export_writer is not None:
+            self.export_writer.stop(timeout=30)
+        # Таймер не должен обращаться к закрытому журналу
+        self.sync_timer.stop()
+        self.closed = True
+        if self.journal is not None:
+            self.journal.close()
+        super().closeEvent(event)
+
     def clear_form(self):
         reply = QMessageBox.question(self, 'Подтверждение', 
                                    'Вы уверены, что хотите очистить форму?',
                                    QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         
         if reply == QMessageBox.Yes:
-            self.номер_плавки_input.setCurrentIndex(-1)
-            self.контроль_отлито_input.setText('')
-            self.контроль_принято_input.setText('')
-            self.контроль_дата_приемки_input.setDate(QDate.currentDate().addDays(-1))
-            self.контролер1_input.setCurrentIndex(-1)  # Сброс выбора
-            self.контролер2_input.setCurrentIndex(-1)  # Сброс выбора
-
-            self.второй_сорт_раковины_input.setText('')
-            self.второй_сорт_зарез_input.setText('')
-
-            self.доработка_раковины_input.setText('')
-            self.доработка_зарез_input.setText('')
-            self.доработка_несоответствие_размеров_input.setText('')
-            self.доработка_несоответствие_внешнего_вида_input.setText('')
-            self.доработка_наплыв_металла_input.setText('')
-            self.доработка_прорыв_металла_input.setText('')
-            self.доработка_вырыв_input.setText('')
-            self.доработка_облой_input.setText('')
-            self.доработка_песок_на_поверхности_input.setText('')
-            self.доработка_песок_в_резьбе_input.setText('')
-            self.доработка_клей_input.setText('')
-            self.доработка_коробление_input.setText('')
-            self.доработка_дефект_пеномодели_input.setText('')
-            self.доработка_лапы_input.setText('')
-            self.доработка_питатель_input.setText('')
-            self.доработка_корона_input.setText('')
-            self.доработка_смещение_input.setText('')
-
-            self.окончательный_брак_недолив_input.setText('')
-            self.окончательный_брак_вырыв_input.setText('')
-            self.окончательный_брак_зарез_input.setText('')
-            self.окончательный_брак_коробление_input.setText('')
-            self.окончательный_брак_наплыв_металла_input.setText('')
-            self.окончательный_брак_нарушение_геометрии_input.setText('')
-            self.окончательный_брак_нарушение_маркировки_input.setText('')
-            self.окончательный_брак_непроклей_input.setText('')
-            self.окончательный_брак_неслитина_input.setText('')
-            self.окончательный_брак_несоответствие_внешнего_вида_input.setText('')
-            self.окончательный_брак_несоответствие_размеров_input.setText('')
-            self.окончательный_брак_пеномодель_input.setText('')
-            self.окончательный_брак_пористость_input.setText('')
-            self.окончательный_брак_пригар_песка_input.setText('')
-            self.окончательный_брак_прочее_input.setText('')
-            self.окончательный_брак_рыхлота_input.setText('')
-            self.окончательный_брак_раковины_input.setText('')
-            self.окончательный_брак_скол_input.setText('')
-            self.окончательный_брак_слом_input.setText('')
-            self.окончательный_брак_спай_input.setText('')
-            self.окончательный_брак_трещины_input.setText('')
-            self.наименование_отливки_input.clear()  # Очищаем поле наименования
+            self.reset_form()
+
+    def reset_form(self):
+        self.номер_плавки_input.setCurrentIndex(-1)
+        self.контроль_отлито_input.setText('')
+        self.контроль_принято_input.setText('')
+        self.контроль_дата_приемки_input.setDate(QDate.currentDate().addDays(-1))
+        self.контролер1_input.setCurrentIndex(-1)  # Сброс выбора
+        self.контролер2_input.setCurrentIndex(-1)  # Сброс выбора
+
+        for input_field in self.defect_inputs.values():
+            input_field.setText('')
+        self.наименование_отливки_input.clear()  # Очищаем поле наименования
+
+    def toggle_correction(self):
+        """Кнопка "Исправить запись": открывает сохраненную плавку или отменяет исправление"""
+        if self.editing_id is not None:
+            self.close_record()
+            self.reset_form()
+            return
+        номер_плавки, ok = QInputDialog.getText(self, "Исправление записи", "Номер плавки:")
+        номер_плавки = номер_плавки.strip()
+        if not ok or not номер_плавки:
+            return
+        # Запись находится по индексу номера плавки в control.db (со службой - в ее журнале)
+        try:
+            found = (self.server or self.journal).find(номер_плавки)
+        except OSError as e:
+            QMessageBox.warning(self, "Ошибка", f"Ошибка при поиске записи: {str(e)}")
+            return
+        if found is None:
+            QMessageBox.warning(self, "Ошибка", f"По плавке {номер_плавки} записи в журнале нет")
+            return
+        record_id, row, casting = found
+        self.open_record(record_id, ControlRecord.from_row(row, casting))
+
+    def open_record(self, record_id, record):
+        """Загружает сохраненную запись в форму; номер плавки при исправлении не меняется"""
+        self.editing_id = record_id
+        self.номер_плавки_input.setCurrentIndex(-1)
+        self.номер_плавки_input.setEditText(record.номер_плавки)
+        self.номер_плавки_input.setEnabled(False)
+        self.наименование_отливки_input.setText(record.наименование_отливки or '')
+        self.контроль_отлито_input.setText(str(record.отлито))
+        date = QDate.fromString(record.дата_приемки or '', 'yyyy-MM-dd')
+        if date.isValid():
+            self.контроль_дата_приемки_input.setDate(date)
+        for combo, name in ((self.контролер1_input, record.контролер1), (self.контролер2_input, record.контролер2)):
+            # Контролера, которого уже нет в списке, не теряем при исправлении
+            if name and combo.findText(name) < 0:
+                combo.addItem(name)
+            combo.setCurrentIndex(combo.findText(name) if name else -1)
+        for key, input_field in self.defect_inputs.items():
+            count = record.defects[DEFECT_SLOTS[key]]
+            input_field.setText(str(count) if count else '')
+        self.save_button.setText("Сохранить исправление")
+        self.correct_button.setText("Отменить исправление")
+        corrections = (self.server or self.journal).corrections(record_id)
+        self.status_label.setText(f"Исправление записи по плавке {record.номер_плавки}"
+                                  + (f" (ранее исправлено полей: {len(corrections)})" if corrections else ""))
+
+    def close_record(self):
+        self.editing_id = None
+        self.номер_плавки_input.setEnabled(True)
+        self.save_button.setText("Сохранить")
+        self.correct_button.setText("Исправить запись")
+        self.update_plavka_status()
+
+    def save_correction(self, record):
+        """Записывает исправление открытой записи в журнал (с записью в журнал исправлений)"""
+        try:
+            changes = (self.server or self.journal).correct(self.editing_id, record)
+        except ValueError as e:
+            QMessageBox.warning(self, "Ошибка", str(e))
+            return
+        if not changes:
+            QMessageBox.information(self, "Исправление", "Изменений нет")
+            return
+        if self.server is None:
+            self.export_writer.schedule()
+        self.close_record()
+        self.reset_form()
+        QMessageBox.information(self, "Успех", f"Запись исправлена, изменено полей: {len(changes)}")
 
     def animate_group_hover(self, group, hover_in):
         if not hasattr(self, 'animations'):
@@ -818,6 +1154,9 @@ class ControlForm(QWidget):
 
 if __name__ == "__main__":
     app = QApplication(sys.argv)
+    startup.begin('построение формы')
     form = ControlForm()
+    startup.end('построение формы')
+    startup.begin('первая отрисовка')
     form.show()
     sys.exit(app.exec())
\ No newline at end of file
@@ -0,0 +1,132 @@
+"""Блокировка файлом-замком для записи с нескольких станций.
+
+Замок - файл рядом с защищаемым (control.db.lock, control.xlsx.lock),
+создается атомарно (O_CREAT | O_EXCL) и поэтому работает и между
+компьютерами через общую папку. В замок записывается владелец
+(компьютер, процесс, время). Если владелец упал и не снял замок, замок
+считается устаревшим: когда он старше STALE_AFTER секунд или когда
+процесс-владелец на этом же компьютере уже не существует.
+"""
+import os
+import socket
+import time
+import uuid
+
+# Сколько ждать освободившегося замка, секунд
+TIMEOUT = 15
+
+# Замок держится только на время одной записи, так что такой старый замок - брошенный
+STALE_AFTER = 120
+
+
+class LockTimeout(TimeoutError):
+    pass
+
+
+def _pid_alive(pid):
+    if os.name != 'posix':
+        # В Windows os.kill(pid, 0) завершает процесс, так что там полагаемся только на возраст замка
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class FileLock:
+    """Межпроцессная блокировка: with FileLock('control.db.lock'): ..."""
+
+    def __init__(self, path, timeout=TIMEOUT, stale_after=STALE_AFTER):
+        self.path = path
+        self.timeout = timeout
+        self.stale_after = stale_after
+        self.token = None
+        self.depth = 0  # Повторный вход из того же объекта не блокирует сам себя
+
+    def acquire(self):
+        if self.depth:
+            self.depth += 1
+            return
+        token = f"{socket.gethostname()} {os.getpid()} {time.time():.0f} {uuid.uuid4().hex}"
+        deadline = time.monotonic() + self.timeout
+        while True:
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except (FileExistsError, PermissionError):
+                # PermissionError - в Windows, пока чужой замок удаляется
+                owner = self._read(self.path)
+                if owner is not None and self._is_stale(owner):
+                    self._break_stale(owner)
+                    continue
+                if time.monotonic() >= deadline:
+                    raise LockTimeout(f"Файл занят другой станцией ({owner or 'неизвестно'}): {self.path}")
+                time.sleep(0.02)
+                continue
+            with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                f.write(token)
+            self.token = token
+            self.depth = 1
+            return
+
+    def release(self):
+        if not self.depth:
+            return
+        self.depth -= 1
+        if self.depth:
+            return
+        # Снимаем только свой замок: если его признали устаревшим и заняли, он уже чужой
+        if self._read(self.path) == self.token:
+            try:
+                os.remove(self.path)
+            except FileNotFoundError:
+                pass
+        self.token = None
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.release()
+
+    @staticmethod
+    def _read(path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                return f.read()
+        except (FileNotFoundError, UnicodeDecodeError):
+            return None
+
+    def _is_stale(self, owner):
+        try:
+            age = time.time() - os.path.getmtime(self.path)
+        except FileNotFoundError:
+            return False
+        if age > self.stale_after:
+            return True
+        try:
+            host, pid = owner.split()[:2]
+            return host == socket.gethostname() and not _pid_alive(int(pid))
+        except ValueError:
+            # Замок еще пишется (пустой) или поврежден - ждем, пока не устареет по времени
+            return False
+
+    def _break_stale(self, owner):
+        """Убирает брошенный замок; если его успел занять живой владелец - возвращает на место"""
+        stale_path = f"{self.path}.{uuid.uuid4().hex}.stale"
+        try:
+            os.rename(self.path, stale_path)
+        except (FileNotFoundError, FileExistsError, PermissionError):
+            return
+        taken = self._read(stale_path)
+        if taken != owner:
+            try:
+                fd = os.open(self.path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    f.write(taken or '')
+            except FileExistsError:
+                pass
+        os.remove(stale_path)
@@ -0,0 +1,190 @@
+"""Замеры времени запуска формы и горячих мест.
+
+Запуск: флаг --profile или переменная окружения KONTROL_PROFILE=1.
+Когда все этапы запуска закончены, отчет печатается в консоль:
+для каждого этапа - момент начала от старта процесса и длительность.
+
+Горячие места (чтение и запись файлов, отбор плавок, поиск, пересчет,
+сохранение) размечены metrics.timed / metrics.span. Замеры включаются
+флагом --metrics, переменной KONTROL_METRICS=1 или в скрытой панели
+диагностики формы (Ctrl+Shift+D). Для каждого места считаются число
+вызовов и p50/p95/max, каждое измерение пишется строкой JSON в
+kontrol-metrics.log (с ротацией). Выключенный замер - одна проверка флага.
+"""
+import functools
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from collections import deque
+from logging.handlers import RotatingFileHandler
+
+# Этот модуль импортируется первым, так что это практически старт процесса
+STARTED = time.perf_counter()
+
+# Этапы запуска в порядке отчета
+STAGES = ('импорт', 'построение формы', 'первая отрисовка', 'загрузка данных')
+
+
+class StartupProfile:
+    """Интервалы этапов запуска; выключенный профиль ничего не делает"""
+
+    def __init__(self, enabled):
+        self.enabled = enabled
+        self.spans = {}  # Этап -> [начало, конец]
+        self.reported = False
+
+    def begin(self, stage):
+        if self.enabled and stage not in self.spans:
+            self.spans[stage] = [time.perf_counter(), None]
+
+    def end(self, stage):
+        if not self.enabled or self.reported:
+            return
+        span = self.spans.get(stage)
+        if span is None or span[1] is not None:
+            return
+        span[1] = time.perf_counter()
+        if all(self.spans.get(name, (None, None))[1] is not None for name in STAGES):
+            self.report()
+
+    def report(self, stream=None):
+        self.reported = True
+        stream = stream or sys.stderr
+        print("Запуск формы, мс:        начало  длительность", file=stream)
+        for stage in STAGES:
+            start, end = self.spans[stage]
+            print(f"  {stage:<20} {(start - STARTED) * 1000:9.1f} {(end - start) * 1000:13.1f}",
+                  file=stream)
+        finished = max(end for start, end in self.spans.values())
+        print(f"  {'всего':<20} {0:9.1f} {(finished - STARTED) * 1000:13.1f}", file=stream)
+
+
+startup = StartupProfile('--profile' in sys.argv or os.environ.get('KONTROL_PROFILE') == '1')
+
+
+# Журнал замеров горячих мест: до 1 МБ, плюс 3 предыдущих файла
+METRICS_LOG = 'kontrol-metrics.log'
+METRICS_LOG_BYTES = 1024 * 1024
+METRICS_LOG_BACKUPS = 3
+
+# По скольким последним вызовам считать перцентили
+METRICS_WINDOW = 1000
+
+
+class _Span:
+    def __init__(self, metrics, name, fields):
+        self.metrics = metrics
+        self.name = name
+        self.fields = fields
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.metrics.record(self.name, time.perf_counter() - self.started, **self.fields)
+
+
+class _NoSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        pass
+
+
+_NO_SPAN = _NoSpan()
+
+
+class HotPathMetrics:
+    """Счетчики и задержки горячих мест; пока выключены - только проверка флага
+
+    Замеры пишут и фоновые потоки (загрузка плавок, выгрузка), а панель
+    диагностики читает их из GUI-потока, поэтому stats - под замком.
+    """
+
+    def __init__(self, enabled, log_path=METRICS_LOG):
+        self.enabled = enabled
+        self.log_path = log_path
+        self.log = None
+        self.stats = {}  # Место -> [вызовов, всего секунд, максимум, последние задержки]
+        self.lock = threading.Lock()
+
+    def timed(self, name):
+        """Декоратор: время каждого вызова функции записывается под именем name"""
+        def decorate(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return func(*args, **kwargs)
+                started = time.perf_counter()
+                try:
+                    return func(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - started)
+            return wrapper
+        return decorate
+
+    def span(self, name, **fields):
+        """with metrics.span('plavka.filter', rows=n): ... - замер участка кода"""
+        return _Span(self, name, fields) if self.enabled else _NO_SPAN
+
+    def record(self, name, seconds, **fields):
+        with self.lock:
+            stats = self.stats.get(name)
+            if stats is None:
+                stats = self.stats[name] = [0, 0.0, 0.0, deque(maxlen=METRICS_WINDOW)]
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+            stats[3].append(seconds)
+        self.write_log({'time': round(time.time(), 3), 'name': name,
+                        'ms': round(seconds * 1000, 3), **fields})
+
+    def write_log(self, entry):
+        with self.lock:
+            if self.log is None:
+                self.open_log()
+        self.log.info(json.dumps(entry, ensure_ascii=False))
+
+    def open_log(self):
+        log = logging.getLogger('kontrol.metrics')
+        log.propagate = False
+        log.setLevel(logging.INFO)
+        try:
+            handler = RotatingFileHandler(self.log_path, maxBytes=METRICS_LOG_BYTES,
+                                          backupCount=METRICS_LOG_BACKUPS, encoding='utf-8')
+        except OSError:
+            # Нет прав на запись рядом с формой - замеры остаются только в панели
+            handler = logging.NullHandler()
+        log.addHandler(handler)
+        self.log = log
+
+    def snapshot(self):
+        """Сводка по местам: имя, вызовов, p50/p95/max и сумма в мс"""
+        # Копия под замком, расчет - без него, чтобы не задерживать замеры
+        with self.lock:
+            stats = [(name, count, total, longest, list(recent))
+                     for name, (count, total, longest, recent) in self.stats.items()]
+        rows = []
+        for name, count, total, longest, recent in sorted(stats):
+            ordered = sorted(recent)
+            rows.append({
+                'name': name,
+                'count': count,
+                'p50_ms': ordered[len(ordered) // 2] * 1000,
+                'p95_ms': ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))] * 1000,
+                'max_ms': longest * 1000,
+                'total_ms': total * 1000,
+            })
+        return rows
+
+    def reset(self):
+        with self.lock:
+            self.stats.clear()
+
+
+metrics = HotPathMetrics('--metrics' in sys.argv or os.environ.get('KONTROL_METRICS') == '1')
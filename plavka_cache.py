@@ -0,0 +1,148 @@
+"""Кэш реестра плавок (plavka.xlsx) в компактном бинарном виде.
+
+Разбор XLSX - самая долгая часть запуска формы. Реестр один раз
+переводится в pickle-файлы рядом с книгой, и дальше читаются уже они.
+Кэш разбит по сезонам (году в учетном номере): .plavka.xlsx.25.cache и
+т.д., а .plavka.xlsx.cache - оглавление с состоянием книги и списком
+сезонов. Форма читает только файлы активных сезонов, поэтому прошлые
+годы реестра не замедляют запуск. Кэш пересобирается только если
+plavka.xlsx действительно изменился: сначала сверяются mtime и размер,
+а при расхождении - SHA-256 содержимого.
+"""
+import hashlib
+import os
+import pickle
+
+from perf import metrics
+
+# Меняется при изменении формата файла кэша - старые кэши просто пересобираются
+CACHE_VERSION = 2
+
+
+def cache_path_for(path, season=None):
+    """Оглавление кэша рядом с книгой (plavka.xlsx -> .plavka.xlsx.cache) или файл сезона (.plavka.xlsx.25.cache)"""
+    folder, name = os.path.split(path)
+    if season is None:
+        return os.path.join(folder, f".{name}.cache")
+    # Номера без года - в отдельном файле '-'
+    return os.path.join(folder, f".{name}.{season or '-'}.cache")
+
+
+@metrics.timed('plavka.sha256')
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def file_signature(path):
+    """Время изменения и размер файла (None, если файла нет) - для быстрой проверки изменений"""
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+@metrics.timed('plavka.read_cache')
+def _read_pickle(cache_path):
+    try:
+        with open(cache_path, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, EOFError, pickle.UnpicklingError, AttributeError, ImportError):
+        return None
+
+
+def _read_index(cache_path):
+    cached = _read_pickle(cache_path)
+    if not isinstance(cached, dict) or cached.get('version') != CACHE_VERSION:
+        return None
+    return cached
+
+
+@metrics.timed('plavka.write_cache')
+def _write_pickle(cache_path, value):
+    # Пишем во временный файл и атомарно подменяем, чтобы не оставить битый кэш
+    tmp_path = cache_path + '.tmp'
+    try:
+        with open(tmp_path, 'wb') as f:
+            pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+        return True
+    except OSError as e:
+        # Кэш - только ускорение: если папка недоступна на запись, работаем без него
+        print(f"Не удалось записать кэш {cache_path}: {str(e)}")
+        return False
+
+
+def _index(stat, digest, seasons):
+    return {
+        'version': CACHE_VERSION,
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'sha256': digest,
+        'seasons': seasons,  # Сезон -> число строк
+    }
+
+
+def _read_shards(path, index, seasons):
+    """DataFrame нужных сезонов из кэша или None, если какого-то файла не хватает"""
+    wanted = [season for season in index['seasons'] if seasons is None or season in seasons]
+    frames = []
+    for season in wanted:
+        df = _read_pickle(cache_path_for(path, season))
+        if df is None:
+            return None
+        frames.append(df)
+    if len(frames) == 1:
+        return frames[0]
+    import pandas as pd
+    if not frames:
+        # Ни одного активного сезона в реестре - пустая таблица с теми же колонками
+        return index['empty']
+    return pd.concat(frames, ignore_index=True)
+
+
+def load_plavka(path='plavka.xlsx', seasons=None):
+    """Возвращает DataFrame реестра плавок (только сезонов seasons, если заданы), по возможности из кэша"""
+    stat = os.stat(path)
+    cache_path = cache_path_for(path)
+    index = _read_index(cache_path)
+
+    if index is not None and index['size'] == stat.st_size:
+        if index['mtime_ns'] == stat.st_mtime_ns:
+            df = _read_shards(path, index, seasons)
+            if df is not None:
+                return df
+            digest = index['sha256']
+        else:
+            # Время изменения другое - проверяем, поменялось ли содержимое
+            digest = file_sha256(path)
+            if index['sha256'] == digest:
+                df = _read_shards(path, index, seasons)
+                if df is not None:
+                    _write_pickle(cache_path, {**index, **_index(stat, digest, index['seasons'])})
+                    return df
+    else:
+        digest = file_sha256(path)
+
+    # pandas нужен только для разбора XLSX; при попадании в кэш он
+    # подгружается при распаковке DataFrame (в фоновом потоке загрузки)
+    import pandas as pd
+    from core import seasons_of
+
+    with metrics.span('plavka.read_excel'):
+        df = pd.read_excel(path)
+    shards = dict(tuple(df.groupby(seasons_of(df['Учетный_номер']).fillna(''), sort=True)))
+    written = all(_write_pickle(cache_path_for(path, season), shard.reset_index(drop=True))
+                  for season, shard in shards.items())
+    if written:
+        # Оглавление пишется последним: пока его нет, кэш считается устаревшим
+        index = _index(stat, digest, {season: len(shard) for season, shard in shards.items()})
+        index['empty'] = df.iloc[0:0]
+        _write_pickle(cache_path, index)
+    if seasons is None:
+        return df
+    return df[seasons_of(df['Учетный_номер']).isin(seasons)].reset_index(drop=True)
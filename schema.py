@@ -0,0 +1,94 @@
+"""Схема журнала контроля: основные колонки и поля дефектов.
+
+Поля дефектов описаны один раз - по ним строятся поля формы, заголовки
+control.xlsx / control.db, строка для записи в журнал и очистка формы.
+Поля перечислены в порядке формы, а position - номер колонки в журнале
+(в control.xlsx порядок колонок исторически другой).
+"""
+from collections import namedtuple
+
+# Категория дефектов: ключ (он же префикс колонок) и заголовок блока формы
+Category = namedtuple('Category', ['key', 'title'])
+
+# Поле дефекта: категория, ключ, подпись в форме, имя колонки, номер колонки журнала
+DefectField = namedtuple('DefectField', ['category', 'key', 'label', 'column', 'position'])
+
+CATEGORIES = [
+    Category('второй_сорт', 'Второй сорт'),
+    Category('доработка', 'Доработка'),
+    Category('окончательный_брак', 'Окончательный брак'),
+]
+
+# Колонки основных данных (первые в журнале)
+MAIN_HEADERS = [
+    'Номер_плавки', 'Контроль_отлито', 'Контроль_принято',
+    'Контроль_дата_приемки', 'Контролер1', 'Контролер2',
+]
+
+_FIELDS = {
+    'второй_сорт': [
+        ('раковины', 'Раковины', 7),
+        ('зарез', 'Зарез', 8),
+    ],
+    'доработка': [
+        ('раковины', 'Раковины', 9),
+        ('зарез', 'Зарез', 10),
+        ('несоответствие_размеров', 'Несоответствие размеров', 11),
+        ('несоответствие_внешнего_вида', 'Несоответствие внешнего вида', 12),
+        ('наплыв_металла', 'Наплыв металла', 13),
+        ('прорыв_металла', 'Прорыв металла', 14),
+        ('вырыв', 'Вырыв', 15),
+        ('облой', 'Облой', 16),
+        ('песок_на_поверхности', 'Песок на поверхности', 17),
+        ('песок_в_резьбе', 'Песок в резьбе', 18),
+        ('клей', 'Клей', 19),
+        ('коробление', 'Коробление', 20),
+        ('дефект_пеномодели', 'Дефект пеномодели', 21),
+        ('лапы', 'Лапы', 22),
+        ('питатель', 'Питатель', 23),
+        ('корона', 'Корона', 24),
+        ('смещение', 'Смещение', 25),
+    ],
+    'окончательный_брак': [
+        ('недолив', 'Недолив', 26),
+        ('раковины', 'Раковины', 42),
+        ('коробление', 'Коробление', 29),
+        ('спай', 'Спай', 45),
+        ('трещины', 'Трещины', 46),
+        ('пригар_песка', 'Пригар песка', 39),
+        ('пористость', 'Пористость', 38),
+        ('вырыв', 'Вырыв', 27),
+        ('скол', 'Скол', 43),
+        ('слом', 'Слом', 44),
+        ('зарез', 'Зарез', 28),
+        ('нарушение_геометрии', 'Нарушение геометрии', 31),
+        ('рыхлота', 'Рыхлота', 41),
+        ('непроклей', 'Непроклей', 33),
+        ('пеномодель', 'Пеномодель', 37),
+        ('наплыв_металла', 'Наплыв металла', 30),
+        ('несоответствие_размеров', 'Несоответствие размеров', 36),
+        ('несоответствие_внешнего_вида', 'Несоответствие внешнего вида', 35),
+        ('нарушение_маркировки', 'Нарушение маркировки', 32),
+        ('неслитина', 'Неслитина', 34),
+        ('прочее', 'Прочее', 40),
+    ],
+}
+
+# Все поля дефектов в порядке формы: 'окончательный_брак_спай' -> колонка 'Окончательный_брак_спай'
+DEFECTS = [
+    DefectField(category.key, f'{category.key}_{name}', label,
+                f'{category.key}_{name}'.capitalize(), position)
+    for category in CATEGORIES
+    for name, label, position in _FIELDS[category.key]
+]
+
+# Те же поля в порядке колонок журнала
+JOURNAL_DEFECTS = sorted(DEFECTS, key=lambda field: field.position)
+
+HEADERS = MAIN_HEADERS + [field.column for field in JOURNAL_DEFECTS]
+
+# Колонка с датой приемки (в control.xlsx - колонка D)
+DATE_COLUMN = 'Контроль_дата_приемки'
+
+# Текстовые колонки, все остальные - количества в штуках
+TEXT_COLUMNS = {'Номер_плавки', DATE_COLUMN, 'Контролер1', 'Контролер2'}
@@ -0,0 +1,98 @@
+"""Нагрузочная проверка одновременной записи в журнал с нескольких станций.
+
+    python stress_journal.py [--processes 8] [--rows 200] [--shared 50]
+
+Каждый процесс изображает станцию: сохраняет свои плавки, пытается занять
+общие плавки, за которые борются все станции, и выгружает control.xlsx.
+В конце проверяется, что ни одна запись не потеряна, ни одна плавка не
+сохранена дважды и не осталось замков. Код выхода 0 - все в порядке.
+"""
+import argparse
+import collections
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+from journal import ControlJournal, HeatAlreadyUsed, open_journal, read_used_numbers_xlsx
+from schema import HEADERS
+
+
+def make_row(number):
+    return [number, 100, 100, '01.02.2025', 'Рябова', ''] + [''] * (len(HEADERS) - 6)
+
+
+def station(db_path, xlsx_path, station_id, rows, shared):
+    """Одна станция; возвращает, сколько общих плавок ей удалось занять"""
+    journal = ControlJournal(db_path)
+    claimed = 0
+    try:
+        for i in range(rows):
+            journal.append(make_row(f'{station_id}-{i}/25'))
+            if i < shared:
+                try:
+                    journal.append(make_row(f'общая-{i}/25'))
+                    claimed += 1
+                except HeatAlreadyUsed:
+                    pass
+            if i == rows // 2:
+                journal.export_xlsx(xlsx_path)
+    finally:
+        journal.close()
+    return claimed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Проверка одновременной записи в журнал")
+    parser.add_argument('--processes', type=int, default=8)
+    parser.add_argument('--rows', type=int, default=200, help="своих плавок на станцию")
+    parser.add_argument('--shared', type=int, default=50, help="общих плавок, за которые борются станции")
+    parser.add_argument('--dir', help="папка для журнала (например, общая сетевая); по умолчанию временная")
+    args = parser.parse_args(argv)
+
+    folder = args.dir or tempfile.mkdtemp(prefix='kontrol-stress-')
+    db_path = os.path.join(folder, 'control.db')
+    xlsx_path = os.path.join(folder, 'control.xlsx')
+    open_journal(db_path, xlsx_path).close()
+
+    started = time.perf_counter()
+    with multiprocessing.Pool(args.processes) as pool:
+        claimed = pool.starmap(station, [
+            (db_path, xlsx_path, station_id, args.rows, min(args.shared, args.rows))
+            for station_id in range(args.processes)
+        ])
+    elapsed = time.perf_counter() - started
+
+    journal = ControlJournal(db_path)
+    numbers = [number for (number, *_) in journal.rows()]
+    journal.export_xlsx(xlsx_path)
+    journal.close()
+
+    shared = min(args.shared, args.rows)
+    expected = args.processes * args.rows + shared
+    duplicates = [number for number, count in collections.Counter(numbers).items() if count > 1]
+    leftovers = [name for name in os.listdir(folder) if name.endswith(('.lock', '.stale'))]
+    problems = []
+    if len(numbers) != expected:
+        problems.append(f"записей {len(numbers)}, ожидалось {expected}")
+    if duplicates:
+        problems.append(f"плавки сохранены дважды: {duplicates[:10]}")
+    if sum(claimed) != shared:
+        problems.append(f"общих плавок занято {sum(claimed)}, ожидалось {shared}")
+    if len(read_used_numbers_xlsx(xlsx_path)) != len(set(numbers)):
+        problems.append("control.xlsx не совпадает с журналом")
+    if leftovers:
+        problems.append(f"остались замки: {leftovers}")
+
+    print(f"{args.processes} станций, {len(numbers)} записей за {elapsed:.2f} с "
+          f"({len(numbers) / elapsed:.0f} записей/с), папка {folder}")
+    for problem in problems:
+        print(f"ОШИБКА: {problem}", file=sys.stderr)
+    if not problems:
+        print("Потерянных и повторных записей нет")
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,19 @@
+"""Реестр доступных плавок формы
+
+    python -m pytest test_heat_register.py
+"""
+import pandas as pd
+
+from heat_register import CASTING_COLUMN, NUMBER_COLUMN, HeatRegister
+
+
+def test_empty_casting_is_not_taken_from_another_heat():
+    plavka = pd.DataFrame({
+        NUMBER_COLUMN: ['1-1/25', '2-1/25', '3-1/25'],
+        CASTING_COLUMN: ['Корпус', None, 'Фланец'],
+    })
+    register = HeatRegister.from_plavka(plavka, set(), ['25'])
+    assert register.casting('1-1/25') == 'Корпус'
+    assert register.casting('2-1/25') == ''
+    assert register.casting('3-1/25') == 'Фланец'
+    assert dict(register.items()) == {'1-1/25': 'Корпус', '2-1/25': '', '3-1/25': 'Фланец'}
@@ -0,0 +1,52 @@
+"""Журнал контроля: исправление записей, перенесенных из control.xlsx
+
+    python -m pytest test_journal.py
+"""
+from core import ControlRecord
+from journal import open_journal, write_xlsx
+from schema import HEADERS
+
+
+def migrated_row(number):
+    """Строка старого control.xlsx: нулевые дефекты записаны явно"""
+    return [number, 100, 97, '2025-03-01', 'Иванов', 'Петров', 3] + [0] * (len(HEADERS) - 7)
+
+
+def test_unchanged_migrated_record_is_not_corrected(tmp_path):
+    xlsx_path = str(tmp_path / 'control.xlsx')
+    write_xlsx(xlsx_path, [migrated_row('1-1/25')])
+    journal = open_journal(str(tmp_path / 'control.db'), xlsx_path, str(tmp_path / 'plavka.xlsx'))
+    try:
+        record_id, row, casting = journal.find('1-1/25')
+        assert journal.correct(record_id, ControlRecord.from_row(row, casting)) == []
+        assert journal.corrections(record_id) == []
+
+        row[1], row[2] = 101, 98
+        changes = journal.correct(record_id, ControlRecord.from_row(row, casting))
+        assert [header for header, _, _ in changes] == ['Контроль_отлито', 'Контроль_принято']
+        assert len(journal.corrections(record_id)) == 2
+    finally:
+        journal.close()
+
+
+def test_export_keeps_rows_added_to_xlsx_directly(tmp_path):
+    from openpyxl import load_workbook
+
+    xlsx_path = str(tmp_path / 'control.xlsx')
+    write_xlsx(xlsx_path, [migrated_row('1-1/25'), migrated_row('3-1/25')])
+    journal = open_journal(str(tmp_path / 'control.db'), xlsx_path, str(tmp_path / 'plavka.xlsx'))
+    try:
+        journal.export_xlsx(xlsx_path)
+        # Старая версия формы дописывает строку прямо в книгу
+        wb = load_workbook(xlsx_path)
+        wb.active.append(migrated_row('2-1/25'))
+        wb.save(xlsx_path)
+        assert '2-1/25' in journal.used_numbers_with_xlsx(xlsx_path)
+
+        journal.export_xlsx(xlsx_path)
+        assert journal.is_used('2-1/25')
+        numbers = [row[0] for row in load_workbook(xlsx_path, read_only=True).active.iter_rows(
+            min_row=2, max_col=1, values_only=True)]
+        assert numbers == ['1-1/25', '3-1/25', '2-1/25']
+    finally:
+        journal.close()
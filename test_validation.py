@@ -0,0 +1,53 @@
+"""Проверка записей по истории журнала, перенесенной из control.xlsx
+
+    python -m pytest test_validation.py
+"""
+from core import ControlRecord
+from journal import open_journal, write_xlsx
+from schema import HEADERS
+from validation import MIN_HISTORY, RecordValidator, audit, output_ranges
+
+
+def heat_row(number, отлито):
+    row = [None] * len(HEADERS)
+    row[:6] = [number, отлито, отлито, '2025-03-01', 'Иванов', 'Петров']
+    return row
+
+
+def migrated_journal(tmp_path, rows):
+    """Журнал, перенесенный из control.xlsx без реестра плавок: у записей нет отливки"""
+    xlsx_path = str(tmp_path / 'control.xlsx')
+    write_xlsx(xlsx_path, rows)
+    return open_journal(str(tmp_path / 'control.db'), xlsx_path, str(tmp_path / 'plavka.xlsx'))
+
+
+def test_output_range_of_migrated_records(tmp_path):
+    rows = [heat_row(f'{i}-1/25', 100 + i) for i in range(MIN_HISTORY)]
+    journal = migrated_journal(tmp_path, rows)
+    try:
+        assert journal.missing_castings()
+        castings = {row[0]: 'Фланец' for row in rows}
+        # Без реестра отливка перенесенных записей неизвестна
+        assert output_ranges(journal) == {}
+        ranges = output_ranges(journal, castings)
+        assert ranges['Фланец'][0] <= 100 and ranges['Фланец'][1] >= 100 + MIN_HISTORY - 1
+
+        castings['99-1/25'] = 'Фланец'
+        validator = RecordValidator(castings=castings, output_ranges=ranges)
+        assert validator.validate(ControlRecord.from_row(heat_row('99-1/25', 110))) == []
+        issues = validator.validate(ControlRecord.from_row(heat_row('99-1/25', 5000)))
+        assert [issue.rule for issue in issues] == ['output']
+    finally:
+        journal.close()
+
+
+def test_audit_checks_output_of_migrated_records(tmp_path):
+    # Записей достаточно, чтобы одна выбивающаяся не попала в обычный диапазон
+    rows = [heat_row(f'{i}-1/25', 100) for i in range(120)] + [heat_row('999-1/25', 5000)]
+    journal = migrated_journal(tmp_path, rows)
+    try:
+        castings = {row[0]: 'Фланец' for row in rows}
+        found = [(number, issue.rule) for _, number, issue in audit(journal, castings)]
+        assert found == [('999-1/25', 'output')]
+    finally:
+        journal.close()
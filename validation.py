@@ -0,0 +1,250 @@
+"""Проверка записей контроля перед сохранением и сверка всего журнала.
+
+    python validation.py [--db control.db] [--plavka plavka.xlsx] [--errors-only] [--csv сверка.csv]
+
+Правило (RULES) - функция (проверка, запись, указанное "Принято") ->
+текст замечания или None. Правила смотрят только в индексы в памяти
+RecordValidator: занятые плавки (множество), плавка -> наименование
+отливки (словарь из реестра) и отливка -> обычный диапазон "Отлито"
+(один раз считается по журналу, output_ranges), поэтому проверка записи
+занимает микросекунды. Ошибка (ERROR) не дает сохранить запись,
+предупреждение (WARNING) форма показывает и просит подтвердить.
+
+Та же проверка идет без формы по всему журналу как сверка (audit):
+записи проверяются по порядку добавления, а занятыми считаются плавки
+более ранних записей - так находятся повторы плавок.
+"""
+import argparse
+import csv
+import math
+import sys
+import time
+from collections import Counter, defaultdict, namedtuple
+from datetime import date, timedelta
+
+from core import ControlRecord, check_required, season_of, validate_prinato
+from journal import CASTING_COLUMN, DB_PATH, ControlJournal, from_iso_date, quote, read_castings
+from perf import metrics
+from schema import HEADERS
+
+ERROR = 'ошибка'
+WARNING = 'предупреждение'
+
+# Сколько дней после конца года еще принимают плавки сезона (декабрьские - в январе-марте)
+SEASON_LATE_DAYS = 90
+
+# Обычный диапазон "Отлито" отливки - от 1-го до 99-го процентиля ее записей
+# с запасом в полтора раза; отливки, у которых записей меньше MIN_HISTORY, не проверяются
+OUTPUT_QUANTILES = (0.01, 0.99)
+OUTPUT_MARGIN = 1.5
+MIN_HISTORY = 20
+
+Issue = namedtuple('Issue', 'rule severity message')
+
+
+def show_date(value):
+    """ГГГГ-ММ-ДД -> ДД.ММ.ГГГГ для сообщений"""
+    value = from_iso_date(value)
+    return value.strftime('%d.%m.%Y') if isinstance(value, date) else str(value)
+
+
+def rule_required(validator, record, указано):
+    return check_required(record.номер_плавки, record.отлито, record.контролер1, record.контролер2)
+
+
+def rule_heat_used(validator, record, указано):
+    if record.номер_плавки in validator.used:
+        return f"По плавке {record.номер_плавки} уже есть запись контроля"
+    return None
+
+
+def rule_heat_known(validator, record, указано):
+    if validator.castings is not None and record.номер_плавки not in validator.castings:
+        return f"Плавка {record.номер_плавки} не найдена в реестре плавок"
+    return None
+
+
+def rule_prinato(validator, record, указано):
+    return validate_prinato(record.отлито, record.defect_total, указано)
+
+
+def rule_date(validator, record, указано):
+    дата = record.дата_приемки
+    if not дата:
+        return "Не указана дата приемки"
+    if len(дата) != 10 or дата[4] != '-' or дата[7] != '-':
+        return f"Неверная дата приемки: {дата!r}"
+    if дата > date.today().isoformat():
+        return f"Дата приемки {show_date(дата)} еще не наступила"
+    return None
+
+
+def rule_season(validator, record, указано):
+    season = season_of(record.номер_плавки)
+    bounds = validator.season_bounds(season)
+    if bounds and not bounds[0] <= record.дата_приемки <= bounds[1]:
+        return (f"Дата приемки {show_date(record.дата_приемки)} вне сезона плавки {season} "
+                f"({show_date(bounds[0])} - {show_date(bounds[1])})")
+    return None
+
+
+def rule_output(validator, record, указано):
+    casting = validator.casting_of(record)
+    bounds = validator.output_ranges.get(casting)
+    if bounds and not bounds[0] <= record.отлито <= bounds[1]:
+        return f"Отлито {record.отлито} - необычно для отливки {casting} (обычно {bounds[0]}-{bounds[1]})"
+    return None
+
+
+# (правило, важность, функция) в порядке проверки
+RULES = (
+    ('required', ERROR, rule_required),
+    ('heat_used', ERROR, rule_heat_used),
+    ('heat_known', ERROR, rule_heat_known),
+    ('prinato', ERROR, rule_prinato),
+    ('date', ERROR, rule_date),
+    ('season', WARNING, rule_season),
+    ('output', WARNING, rule_output),
+)
+
+# Правила о самой плавке: при исправлении сохраненной записи не нужны
+HEAT_RULES = {'heat_used', 'heat_known'}
+
+
+class RecordValidator:
+    """Проверка записи правилами RULES по индексам в памяти"""
+
+    def __init__(self, used=None, castings=None, output_ranges=None, rules=RULES):
+        self.used = used if used is not None else set()  # Занятые плавки (можно общий с формой)
+        self.castings = castings  # Плавка -> наименование отливки; None - реестр не проверяется
+        self.output_ranges = output_ranges or {}  # Отливка -> (от, до)
+        self.rules = rules
+        self.seasons = {}  # Сезон -> (первая, последняя дата приемки)
+
+    def season_bounds(self, season):
+        """Даты приемки плавок сезона (ГГГГ-ММ-ДД) или None, если у номера нет года"""
+        if season not in self.seasons:
+            bounds = None
+            if len(season) == 2 and season.isdigit():
+                year = 2000 + int(season)
+                last = date(year + 1, 1, 1) + timedelta(days=SEASON_LATE_DAYS - 1)
+                bounds = (f'{year}-01-01', last.isoformat())
+            self.seasons[season] = bounds
+        return self.seasons[season]
+
+    def casting_of(self, record):
+        if record.наименование_отливки or self.castings is None:
+            return record.наименование_отливки
+        return self.castings.get(record.номер_плавки)
+
+    @metrics.timed('validation.record')
+    def validate(self, record, указано=None, check_heat=True):
+        """Замечания к записи [Issue]; check_heat=False - не проверять плавку (исправление записи)"""
+        issues = []
+        for name, severity, rule in self.rules:
+            if not check_heat and name in HEAT_RULES:
+                continue
+            message = rule(self, record, указано)
+            if message:
+                issues.append(Issue(name, severity, message))
+                if name == 'date' or name == 'required' and (not record.номер_плавки or record.отлито is None):
+                    # Без номера, количества или даты остальные правила проверять нечего
+                    break
+        return issues
+
+
+def errors_of(issues):
+    return [issue.message for issue in issues if issue.severity == ERROR]
+
+
+def warnings_of(issues):
+    return [issue.message for issue in issues if issue.severity == WARNING]
+
+
+@metrics.timed('validation.output_ranges')
+def output_ranges(journal, castings=None):
+    """Отливка -> (от, до) обычного "Отлито" по записям журнала
+
+    У записей без отливки (перенесенных из control.xlsx) она берется из
+    castings (номер плавки -> отливка), как в сводах и отчетах.
+    """
+    where = '' if castings else f'{quote(CASTING_COLUMN)} IS NOT NULL AND '
+    cursor = journal.conn.execute(
+        f'SELECT {quote(CASTING_COLUMN)}, "Номер_плавки", "Контроль_отлито" FROM control '
+        f'WHERE {where}"Контроль_отлито" > 0'
+    )
+    values_of = defaultdict(list)
+    for casting, number, value in cursor:
+        casting = casting or castings.get(number)
+        if casting:
+            values_of[casting].append(value)
+    ranges = {}
+    for casting, values in values_of.items():
+        if len(values) < MIN_HISTORY:
+            continue
+        values.sort()
+        low = values[int(OUTPUT_QUANTILES[0] * (len(values) - 1))]
+        high = values[math.ceil(OUTPUT_QUANTILES[1] * (len(values) - 1))]
+        ranges[casting] = (int(low / OUTPUT_MARGIN), math.ceil(high * OUTPUT_MARGIN))
+    return ranges
+
+
+@metrics.timed('validation.audit')
+def audit(journal, castings=None, ranges=None):
+    """Сверка журнала: (id записи, номер плавки, Issue) по всем записям в порядке добавления"""
+    validator = RecordValidator(castings=castings,
+                                output_ranges=output_ranges(journal, castings) if ranges is None else ranges)
+    columns = ', '.join(quote(h) for h in HEADERS)
+    prinato = HEADERS.index('Контроль_принято')
+    cursor = journal.conn.execute(f'SELECT id, {columns}, {quote(CASTING_COLUMN)} FROM control ORDER BY id')
+    for record_id, *row, casting in cursor:
+        number = row[0]
+        try:
+            record = ControlRecord.from_row(row, casting)
+        except ValueError as e:
+            yield record_id, number, Issue('format', ERROR, f"Не число в записи: {e}")
+            continue
+        for issue in validator.validate(record, row[prinato]):
+            yield record_id, number, issue
+        validator.used.add(number)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Сверка журнала контроля по правилам проверки записей")
+    parser.add_argument('--db', default=DB_PATH, help="журнал контроля (по умолчанию control.db)")
+    parser.add_argument('--plavka', default='plavka.xlsx', help="реестр плавок (без него плавки не сверяются)")
+    parser.add_argument('--errors-only', action='store_true', help="не показывать предупреждения")
+    parser.add_argument('--csv', help="сохранить замечания в CSV (для Excel)")
+    args = parser.parse_args(argv)
+
+    castings = None
+    if args.plavka:
+        castings = read_castings(args.plavka) or None
+
+    started = time.perf_counter()
+    journal = ControlJournal(args.db)
+    try:
+        records = journal.count()
+        found = [(record_id, number, issue) for record_id, number, issue in audit(journal, castings)
+                 if not args.errors_only or issue.severity == ERROR]
+    finally:
+        journal.close()
+    elapsed = time.perf_counter() - started
+
+    for record_id, number, issue in found:
+        print(f"{record_id} {number}: {issue.severity}: {issue.message}")
+    if args.csv:
+        # Excel в русской локали открывает CSV через ';'
+        with open(args.csv, 'w', encoding='utf-8-sig', newline='') as f:
+            writer = csv.writer(f, delimiter=';')
+            writer.writerow(['id', 'Номер_плавки', 'Правило', 'Важность', 'Замечание'])
+            writer.writerows([record_id, number, *issue] for record_id, number, issue in found)
+    by_rule = Counter(issue.rule for _, _, issue in found)
+    errors = sum(1 for _, _, issue in found if issue.severity == ERROR)
+    print(f"Проверено записей: {records}, ошибок: {errors}, предупреждений: {len(found) - errors} "
+          f"({elapsed:.2f} с)" + (f"; по правилам: {dict(by_rule)}" if by_rule else ""))
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())